@@ -1,16 +1,30 @@
 """Flask web application and API"""
 
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, flash, session as flask_session
+from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, flash, session as flask_session, Response, stream_with_context, g, has_request_context
 from flask_cors import CORS
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from models import get_session, Domain, StatusHistory, User
+from sqlalchemy import func, event, and_, or_, case
+from models import get_session, get_engine, Domain, StatusHistory, User, CheckRun, DomainResolution, TlsProbe, DomainRegistration, DomainEpisode
+from sqlalchemy.orm import selectinload
 from telegram_notifier import TelegramNotifier
+import events
+import rollups
+import bulk
+import replica
+import timeline
+import episodes
+from history_export import HistoryExport, FORMATS as EXPORT_FORMATS, available_formats, parse_time
+from metrics import WEB_REQUEST_LATENCY, WEB_REQUEST_QUERIES, render as render_metrics, update_pool_metrics
 from datetime import datetime, timedelta
 import csv
+import hmac
+import ipaddress
 import io
+import json
 import logging
 import subprocess
 import os
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,6 +33,93 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 CORS(app)
 
+# Server-Sent Events settings: poll interval of the stream (without
+# LISTEN/NOTIFY), keep-alive interval and how long one connection is held open
+# before the browser reconnects
+SSE_POLL_SECONDS = float(os.getenv('SSE_POLL_SECONDS', 2))
+SSE_KEEPALIVE_SECONDS = float(os.getenv('SSE_KEEPALIVE_SECONDS', 15))
+SSE_MAX_SECONDS = int(os.getenv('SSE_MAX_SECONDS', 300))
+
+# Dashboard panel: certificates expiring within this many days
+CERT_EXPIRY_WARNING_DAYS = int(os.getenv('CERT_EXPIRY_WARNING_DAYS', 14))
+
+# Domain search (typeahead): shortest query and largest page served. pg_trgm
+# extracts no trigram from shorter %q% patterns, which would scan the table
+SEARCH_MIN_LENGTH = 3
+SEARCH_MAX_LIMIT = 100
+
+# Most ids/domains accepted by one bulk request
+BULK_MAX_ITEMS = 10000
+
+# Trends (daily rollups): longest period and most series served
+TRENDS_MAX_DAYS = 366
+TRENDS_MAX_SERIES = 50
+
+# Timeline (domain x bucket status matrix): most domains and buckets served
+TIMELINE_MAX_DOMAINS = 2000
+TIMELINE_MAX_BUCKETS = 720
+
+# Domain page: latest ban/SSL episodes listed (totals count all of them)
+EPISODES_SHOWN = 20
+
+# /metrics: bearer token if set; otherwise only direct requests from these networks
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRICS_ALLOW_NETWORKS = [
+    ipaddress.ip_network(network.strip())
+    for network in os.getenv('METRICS_ALLOW_NETWORKS', '127.0.0.0/8,::1/128').split(',') if network.strip()
+]
+
+# Return the number of SQL statements of each request in an X-DB-Queries
+# header (used by benchmarks/bench_web.py)
+EXPOSE_QUERY_COUNT = os.getenv('EXPOSE_QUERY_COUNT', '').lower() in ('1', 'true', 'yes')
+
+
+@event.listens_for(get_engine(), 'before_cursor_execute')
+def count_request_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+
+
+if replica.configured():
+    event.listen(replica.get_read_engine(), 'before_cursor_execute', count_request_query)
+
+
+def read_session():
+    """Session for read-only routes: the replica, unless it hasn't replayed this user's last write"""
+    return replica.read_session(flask_session.get('write_lsn'), flask_session.get('written_at'))
+
+
+def read_engine():
+    return replica.read_engine(flask_session.get('write_lsn'), flask_session.get('written_at'))
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started_at = time.perf_counter()
+    g.db_queries = 0
+
+
+@app.after_request
+def observe_request_latency(response):
+    started_at = g.get('request_started_at')
+    if started_at is not None and request.endpoint != 'metrics':
+        endpoint = request.endpoint or 'unknown'
+        WEB_REQUEST_LATENCY.labels(
+            endpoint, request.method, response.status_code
+        ).observe(time.perf_counter() - started_at)
+        WEB_REQUEST_QUERIES.labels(endpoint).observe(g.get('db_queries', 0))
+    if EXPOSE_QUERY_COUNT:
+        response.headers['X-DB-Queries'] = str(g.get('db_queries', 0))
+    if (replica.configured() and request.method in ('POST', 'PUT', 'PATCH', 'DELETE')
+            and response.status_code < 400 and current_user.is_authenticated):
+        # The user's next reads wait for the replica to replay past this point
+        try:
+            flask_session['write_lsn'] = replica.primary_lsn()
+            flask_session['written_at'] = time.time()
+        except Exception as e:
+            logger.error(f"Could not record WAL position after write: {str(e)}")
+    return response
+
 # Jinja2 filter for Moscow timezone
 @app.template_filter('moscow_time')
 def moscow_time_filter(dt):
@@ -47,6 +148,20 @@ def moscow_time_pretty_filter(dt):
     moscow_dt = dt + timedelta(hours=3)
     return moscow_dt.strftime('Проверено: %d.%m.%Y в %H:%M')
 
+
+@app.template_filter('duration')
+def duration_filter(seconds):
+    """Seconds as '2 д 3 ч', '5 ч 10 мин' or '15 мин'"""
+    if seconds is None:
+        return None
+    minutes = int(seconds) // 60
+    days, hours, minutes = minutes // 1440, minutes // 60 % 24, minutes % 60
+    if days:
+        return f'{days} д {hours} ч'
+    if hours:
+        return f'{hours} ч {minutes} мин'
+    return f'{minutes} мин'
+
 # Flask-Login setup
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -119,7 +234,7 @@ def logout():
 @login_required
 def index():
     """Main page with domain list"""
-    session = get_session()
+    session = read_session()
     try:
         domains = session.query(Domain).order_by(Domain.created_at.desc()).all()
 
@@ -138,7 +253,12 @@ def index():
             'pending': pending_count
         }
 
-        return render_template('index.html', domains=domains, stats=stats)
+        expiring = query_expiring_certificates(session, CERT_EXPIRY_WARNING_DAYS)
+        runs = session.query(CheckRun).order_by(CheckRun.id.desc()).limit(10).all()
+
+        return render_template('index.html', domains=domains, stats=stats,
+                               expiring=expiring, expiry_days=CERT_EXPIRY_WARNING_DAYS, runs=runs,
+                               page_time=datetime.utcnow().isoformat())
     finally:
         session.close()
 
@@ -147,7 +267,7 @@ def index():
 @login_required
 def domain_detail(domain_id):
     """Domain details page with history"""
-    session = get_session()
+    session = read_session()
     try:
         domain = session.query(Domain).filter_by(id=domain_id).first()
         if not domain:
@@ -159,20 +279,90 @@ def domain_detail(domain_id):
             .limit(50)\
             .all()
 
-        return render_template('domain_detail.html', domain=domain, history=history)
+        resolution = session.query(DomainResolution).filter_by(domain_id=domain_id).first()
+        certificate = session.query(TlsProbe).filter_by(domain_id=domain_id).first()
+        registration = session.query(DomainRegistration).filter_by(domain_id=domain_id).first()
+        domain_episodes = session.query(DomainEpisode)\
+            .filter_by(domain_id=domain_id)\
+            .order_by(DomainEpisode.started_at.desc())\
+            .all()
+
+        return render_template('domain_detail.html', domain=domain, history=history,
+                               resolution=resolution, certificate=certificate, registration=registration,
+                               episodes=domain_episodes[:EPISODES_SHOWN],
+                               episode_summary=episodes.domain_summary(domain_episodes))
     finally:
         session.close()
 
 
+def query_expiring_certificates(session, days, limit=None):
+    """Certificates expiring within N days (range scan on tls_probes.not_after)"""
+    query = session.query(TlsProbe, Domain)\
+        .join(Domain, Domain.id == TlsProbe.domain_id)\
+        .filter(TlsProbe.not_after <= datetime.utcnow() + timedelta(days=days))\
+        .order_by(TlsProbe.not_after)
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
 # API Endpoints
 
 @app.route('/api/domains', methods=['GET'])
 @login_required
 def get_domains():
-    """Get all domains"""
-    session = get_session()
+    """Get all domains, or only those checked since `checked_since` (ISO 8601, UTC)"""
     try:
-        domains = session.query(Domain).all()
+        checked_since = parse_time(request.args.get('checked_since'))
+    except ValueError:
+        return jsonify({'error': 'checked_since must be an ISO date or datetime'}), 400
+
+    session = read_session()
+    try:
+        query = session.query(Domain)
+        if checked_since:
+            query = query.filter(Domain.last_check_time >= checked_since)
+        domains = query.all()
+        return jsonify([d.to_dict() for d in domains])
+    finally:
+        session.close()
+
+
+@app.route('/api/domains/search', methods=['GET'])
+@login_required
+def search_domains():
+    """
+    Substring search over domain, project and purpose (trigram indexes on PostgreSQL)
+    Exact and prefix domain matches come first
+    """
+    q = request.args.get('q', '').strip().lower()
+    limit = max(1, min(request.args.get('limit', 20, type=int), SEARCH_MAX_LIMIT))
+    status = request.args.get('status')
+
+    if len(q) < SEARCH_MIN_LENGTH:
+        return jsonify([])
+
+    # Wildcards typed by the user are matched literally
+    escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    pattern = f'%{escaped}%'
+
+    session = read_session()
+    try:
+        query = session.query(Domain).filter(or_(
+            Domain.domain.ilike(pattern, escape='\\'),
+            Domain.project.ilike(pattern, escape='\\'),
+            Domain.purpose.ilike(pattern, escape='\\')
+        ))
+        if status:
+            query = query.filter(Domain.current_status == status)
+
+        rank = case(
+            (Domain.domain == q, 0),
+            (Domain.domain.like(f'{escaped}%', escape='\\'), 1),
+            (Domain.domain.like(pattern, escape='\\'), 2),
+            else_=3
+        )
+        domains = query.order_by(rank, func.length(Domain.domain), Domain.domain).limit(limit).all()
         return jsonify([d.to_dict() for d in domains])
     finally:
         session.close()
@@ -211,6 +401,8 @@ def add_domain():
         )
 
         session.add(new_domain)
+        session.flush()
+        events.publish(session, events.DOMAIN_CHANNEL, {'type': 'added', 'id': new_domain.id})
         session.commit()
 
         logger.info(f"New domain added: {domain_name}")
@@ -228,7 +420,7 @@ def add_domain():
 @login_required
 def get_domain(domain_id):
     """Get single domain"""
-    session = get_session()
+    session = read_session()
     try:
         domain = session.query(Domain).filter_by(id=domain_id).first()
         if not domain:
@@ -249,7 +441,9 @@ def delete_domain(domain_id):
             return jsonify({'error': 'Domain not found'}), 404
 
         domain_name = domain.domain
-        session.delete(domain)
+        # History goes in one statement rather than one DELETE per row via the ORM
+        bulk.delete_domains(session, Domain.id == domain_id)
+        events.publish(session, events.DOMAIN_CHANNEL, {'type': 'deleted', 'id': domain_id})
         session.commit()
 
         logger.info(f"Domain deleted: {domain_name}")
@@ -263,27 +457,177 @@ def delete_domain(domain_id):
         session.close()
 
 
+@app.route('/api/domains/bulk', methods=['POST'])
+@login_required
+def bulk_domains():
+    """
+    Change many domains in one transaction:
+        {"action": "update", <selection>, "set": {"project": ..., "purpose": ..., "added_by": ...}}
+        {"action": "delete", <selection>}
+        {"action": "upsert", "domains": ["a.com", {"domain": "b.com", "project": ...}]}
+    selection: "ids", "domains" and/or "where": {field: value}
+    """
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    if action not in ('update', 'delete', 'upsert'):
+        return jsonify({'error': 'action must be update, delete or upsert'}), 400
+    for key in ('ids', 'domains'):
+        if data.get(key) is not None and (not isinstance(data[key], list) or len(data[key]) > BULK_MAX_ITEMS):
+            return jsonify({'error': f'{key} must be a list of at most {BULK_MAX_ITEMS} items'}), 400
+
+    session = get_session()
+    try:
+        if action == 'upsert':
+            if not data.get('domains'):
+                return jsonify({'error': 'domains is required'}), 400
+            result = bulk.upsert_domains(session, data['domains'], added_by=current_user.username)
+        elif action == 'update':
+            result = {'updated': bulk.update_domains(session, bulk.selection(data), data.get('set'))}
+        else:
+            result = {'deleted': bulk.delete_domains(session, bulk.selection(data))}
+
+        events.publish(session, events.DOMAIN_CHANNEL, {'type': 'bulk', 'action': action})
+        session.commit()
+
+        logger.info(f"Bulk {action} by {current_user.username}: {result}")
+        return jsonify(dict(result, action=action)), 200
+
+    except ValueError as e:
+        session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error in bulk {action}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        session.close()
+
+
 @app.route('/api/domains/<int:domain_id>/history', methods=['GET'])
 @login_required
 def get_domain_history(domain_id):
-    """Get domain status history"""
-    session = get_session()
+    """Get domain status history (filters: status, ssl_status, threat_type)"""
+    session = read_session()
     try:
-        history = session.query(StatusHistory)\
-            .filter_by(domain_id=domain_id)\
-            .order_by(StatusHistory.checked_at.desc())\
-            .all()
+        query = session.query(StatusHistory).filter_by(domain_id=domain_id)
+        if request.args.get('status'):
+            query = query.filter(StatusHistory.status == request.args['status'])
+        if request.args.get('ssl_status'):
+            query = query.filter(StatusHistory.ssl_status == request.args['ssl_status'])
+        if request.args.get('threat_type'):
+            query = query.filter(StatusHistory.has_threat_type(get_engine().dialect.name,
+                                                               request.args['threat_type']))
+        history = query.order_by(StatusHistory.checked_at.desc()).all()
 
         return jsonify([h.to_dict() for h in history])
     finally:
         session.close()
 
 
+@app.route('/api/domains/<int:domain_id>/episodes', methods=['GET'])
+@login_required
+def get_domain_episodes(domain_id):
+    """Ban and SSL-failure episodes of a domain, latest first (filter: kind)"""
+    session = read_session()
+    try:
+        query = session.query(DomainEpisode).filter_by(domain_id=domain_id)
+        if request.args.get('kind'):
+            query = query.filter(DomainEpisode.kind == request.args['kind'])
+        return jsonify([e.to_dict() for e in query.order_by(DomainEpisode.started_at.desc()).all()])
+    finally:
+        session.close()
+
+
+@app.route('/api/reports/episodes', methods=['GET'])
+@login_required
+def get_episode_report():
+    """
+    Episodes per project started in a period (from/to, default: last 30 days):
+    count, domains, still open and time to recovery
+    """
+    kind = request.args.get('kind', 'ban')
+    if kind not in episodes.KINDS:
+        return jsonify({'error': f"kind must be one of: {', '.join(episodes.KINDS)}"}), 400
+    try:
+        since = parse_time(request.args.get('from')) or datetime.utcnow() - timedelta(days=30)
+        until = parse_time(request.args.get('to'))
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates or datetimes'}), 400
+
+    session = read_session()
+    try:
+        return jsonify(episodes.project_report(session, kind, since, until, request.args.getlist('project')))
+    finally:
+        session.close()
+
+
+@app.route('/api/threats', methods=['GET'])
+@login_required
+def get_threats():
+    """
+    Domains flagged with a threat type in a period (from/to, default: last 30 days),
+    with the number of flagged checks and first/last time seen
+    """
+    threat_type = request.args.get('threat_type')
+    if not threat_type:
+        return jsonify({'error': 'threat_type is required'}), 400
+    try:
+        since = parse_time(request.args.get('from')) or datetime.utcnow() - timedelta(days=30)
+        until = parse_time(request.args.get('to'))
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates or datetimes'}), 400
+
+    session = read_session()
+    try:
+        query = session.query(
+            Domain.id, Domain.domain, Domain.project, Domain.purpose, Domain.current_status,
+            func.count(StatusHistory.id), func.min(StatusHistory.checked_at), func.max(StatusHistory.checked_at)
+        ).join(StatusHistory, StatusHistory.domain_id == Domain.id)\
+            .filter(StatusHistory.has_threat_type(get_engine().dialect.name, threat_type))\
+            .filter(StatusHistory.checked_at >= since)
+        if until:
+            query = query.filter(StatusHistory.checked_at < until)
+        if request.args.getlist('project'):
+            query = query.filter(Domain.project.in_(request.args.getlist('project')))
+        rows = query.group_by(Domain.id).order_by(func.max(StatusHistory.checked_at).desc()).all()
+
+        return jsonify([{
+            'id': domain_id,
+            'domain': domain,
+            'project': project,
+            'purpose': purpose,
+            'current_status': current_status,
+            'flagged_checks': flagged,
+            'first_seen': first_seen.isoformat(),
+            'last_seen': last_seen.isoformat()
+        } for domain_id, domain, project, purpose, current_status, flagged, first_seen, last_seen in rows])
+    finally:
+        session.close()
+
+
+@app.route('/api/certificates/expiring', methods=['GET'])
+@login_required
+def get_expiring_certificates():
+    """Get certificates expiring within N days (already expired included)"""
+    days = request.args.get('days', CERT_EXPIRY_WARNING_DAYS, type=int)
+    limit = request.args.get('limit', 500, type=int)
+
+    session = read_session()
+    try:
+        rows = query_expiring_certificates(session, days, limit)
+        return jsonify([
+            dict(certificate.to_dict(), domain=domain.domain, project=domain.project)
+            for certificate, domain in rows
+        ])
+    finally:
+        session.close()
+
+
 @app.route('/api/export/csv', methods=['GET'])
 @login_required
 def export_csv():
     """Export domains to CSV"""
-    session = get_session()
+    session = read_session()
     try:
         domains = session.query(Domain).all()
 
@@ -319,11 +663,44 @@ def export_csv():
         session.close()
 
 
+@app.route('/api/export/history', methods=['GET'])
+@login_required
+def export_history():
+    """
+    Stream status history with domain attributes (format: ndjson, parquet, arrow).
+    Filters: from, to (ISO UTC), project, purpose, status (repeatable), threat_type
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    if fmt not in available_formats():
+        return jsonify({'error': f'{fmt} export needs pyarrow installed'}), 400
+    try:
+        since = parse_time(request.args.get('from'))
+        until = parse_time(request.args.get('to'))
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates or datetimes'}), 400
+
+    exporter = HistoryExport(read_engine())
+    query = exporter.query(since, until, request.args.getlist('project'),
+                           request.args.getlist('purpose'), request.args.getlist('status'),
+                           request.args.get('threat_type'))
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f'status_history_{datetime.utcnow().strftime("%Y%m%d_%H%M%S")}.{extension}'
+    logger.info(f"History export ({fmt}) started by {current_user.username}")
+
+    return Response(
+        stream_with_context(exporter.stream(fmt, query)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/api/telegram/send-status', methods=['POST'])
 @login_required
 def send_status_telegram():
     """Send current status report to Telegram"""
-    session = get_session()
+    session = read_session()
     try:
         domains = session.query(Domain).all()
 
@@ -426,19 +803,18 @@ def send_status_telegram():
 def trigger_domain_check():
     """Trigger immediate domain check in background"""
     try:
-        # Run checker.py in background without waiting
+        # Run checker.py in background without waiting. Its logs go to the
+        # container's stderr; an unread pipe would fill up and block the checker
         subprocess.Popen(
-            ['python', 'checker.py'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
+            ['python', 'checker.py', '--trigger', 'web'],
+            stdout=subprocess.DEVNULL
         )
 
         logger.info(f"Domain check triggered by user {current_user.username}")
 
         return jsonify({
             'success': True,
-            'message': 'Проверка доменов запущена в фоне. Это займет несколько минут. Обновите страницу через 2-3 минуты для просмотра результатов.'
+            'message': 'Проверка доменов запущена в фоне. Прогресс и изменения статусов отображаются на странице в реальном времени.'
         }), 200
 
     except Exception as e:
@@ -446,6 +822,317 @@ def trigger_domain_check():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/stats', methods=['GET'])
+@login_required
+def get_stats():
+    """Get domain counts by SafeBrowsing and SSL status"""
+    if events.get_listener().connected:
+        # Recomputed only after a status transition or a domain change was published,
+        # from the primary: a lagging replica would cache counts from before the change
+        return jsonify(_stats_cache().get(lambda: _compute_stats(get_session())))
+    return jsonify(_compute_stats(read_session()))
+
+
+_stats_cache_instance = None
+
+
+def _stats_cache():
+    global _stats_cache_instance
+    if _stats_cache_instance is None:
+        _stats_cache_instance = events.EventCache(events.get_listener())
+    return _stats_cache_instance
+
+
+def _compute_stats(session):
+    try:
+        stats = {'total': 0, 'ok': 0, 'banned': 0, 'error': 0, 'pending': 0}
+        rows = session.query(Domain.current_status, func.count(Domain.id))\
+            .group_by(Domain.current_status)\
+            .all()
+        for status, count in rows:
+            stats['total'] += count
+            if status in stats:
+                stats[status] = count
+
+        ssl_rows = session.query(Domain.ssl_status, func.count(Domain.id))\
+            .group_by(Domain.ssl_status)\
+            .all()
+        stats['ssl'] = {status or 'pending': count for status, count in ssl_rows}
+
+        return stats
+    finally:
+        session.close()
+
+
+@app.route('/api/trends', methods=['GET'])
+@login_required
+def get_trends():
+    """One metric per project or purpose over time, read from the daily rollups"""
+    dimension = request.args.get('dimension', 'project')
+    metric = request.args.get('metric', 'bans')
+    bucket = request.args.get('bucket', 'day')
+    if dimension not in rollups.DIMENSIONS:
+        return jsonify({'error': f"dimension must be one of: {', '.join(rollups.DIMENSIONS)}"}), 400
+    if metric not in rollups.METRICS:
+        return jsonify({'error': f"metric must be one of: {', '.join(rollups.METRICS)}"}), 400
+    if bucket not in ('day', 'week'):
+        return jsonify({'error': 'bucket must be day or week'}), 400
+
+    days = max(1, min(request.args.get('days', 30, type=int), TRENDS_MAX_DAYS))
+    limit = max(1, min(request.args.get('limit', 8, type=int), TRENDS_MAX_SERIES))
+
+    session = read_session()
+    try:
+        return jsonify(rollups.trends(session, dimension, metric, days, bucket, limit))
+    finally:
+        session.close()
+
+
+@app.route('/api/timeline', methods=['GET'])
+@login_required
+def get_timeline():
+    """
+    Status matrix of many domains (ids, domain, project, purpose, status filters)
+    over a period (from/to, default: last 7 days) in buckets of `bucket` (default 1h)
+    """
+    try:
+        step = timeline.parse_bucket(request.args.get('bucket', '1h'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        until = parse_time(request.args.get('to')) or datetime.utcnow()
+        since = parse_time(request.args.get('from')) or until - timedelta(days=7)
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates or datetimes'}), 400
+    if since >= until:
+        return jsonify({'error': 'from must be before to'}), 400
+    if timeline.align(since, until, step)[1] > TIMELINE_MAX_BUCKETS:
+        return jsonify({'error': f'At most {TIMELINE_MAX_BUCKETS} buckets, use a larger bucket'}), 400
+
+    conditions = []
+    try:
+        ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        return jsonify({'error': 'ids must be a comma-separated list of domain ids'}), 400
+    if ids:
+        conditions.append(Domain.id.in_(ids))
+    if request.args.getlist('domain'):
+        conditions.append(Domain.domain.in_([bulk.normalize_domain(d) for d in request.args.getlist('domain')]))
+    for param, column in (('project', Domain.project), ('purpose', Domain.purpose), ('status', Domain.current_status)):
+        if request.args.getlist(param):
+            conditions.append(column.in_(request.args.getlist(param)))
+
+    session = read_session()
+    try:
+        return jsonify(timeline.matrix(session, and_(*conditions) if conditions else None,
+                                       since, until, step, TIMELINE_MAX_DOMAINS))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        session.close()
+
+
+@app.route('/api/check-progress', methods=['GET'])
+@login_required
+def get_check_progress():
+    """Get progress of the latest check cycle"""
+    session = get_session()
+    try:
+        run = session.query(CheckRun).order_by(CheckRun.id.desc()).first()
+        return jsonify(run.to_dict() if run else None)
+    finally:
+        session.close()
+
+
+@app.route('/api/check-runs', methods=['GET'])
+@login_required
+def get_check_runs():
+    """List recent check cycles with counts and per-stage timings"""
+    limit = request.args.get('limit', 50, type=int)
+    trigger = request.args.get('trigger')
+
+    session = read_session()
+    try:
+        query = session.query(CheckRun)
+        if trigger:
+            query = query.filter(CheckRun.trigger == trigger)
+        runs = query.order_by(CheckRun.id.desc()).limit(limit).all()
+        return jsonify([run.to_dict() for run in runs])
+    finally:
+        session.close()
+
+
+@app.route('/api/check-runs/<int:run_id>', methods=['GET'])
+@login_required
+def get_check_run(run_id):
+    """Get one check cycle with its slowest domains per stage"""
+    session = read_session()
+    try:
+        run = session.query(CheckRun).filter_by(id=run_id).first()
+        if not run:
+            return jsonify({'error': 'Check run not found'}), 404
+        return jsonify(dict(run.to_dict(), outliers=[o.to_dict() for o in run.outliers]))
+    finally:
+        session.close()
+
+
+@app.route('/api/check-runs/compare', methods=['GET'])
+@login_required
+def compare_check_runs():
+    """Compare check cycles against the first given run (?ids=12,15)"""
+    try:
+        ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        return jsonify({'error': 'ids must be a comma-separated list of run ids'}), 400
+    if len(ids) < 2:
+        return jsonify({'error': 'At least two run ids are required'}), 400
+
+    session = read_session()
+    try:
+        runs = session.query(CheckRun)\
+            .options(selectinload(CheckRun.outliers))\
+            .filter(CheckRun.id.in_(ids))\
+            .all()
+        by_id = {run.id: run for run in runs}
+        missing = [i for i in ids if i not in by_id]
+        if missing:
+            return jsonify({'error': f'Check runs not found: {missing}'}), 404
+
+        baseline = by_id[ids[0]].to_dict()
+        result = []
+        for run_id in ids:
+            run = by_id[run_id].to_dict()
+            stages = set(baseline['stage_seconds']) | set(run['stage_seconds'])
+            run['delta'] = {
+                'elapsed_seconds': round(run['elapsed_seconds'] - baseline['elapsed_seconds'], 1),
+                'rate': round(run['rate'] - baseline['rate'], 2),
+                'stage_seconds': {
+                    stage: round(run['stage_seconds'].get(stage, 0) - baseline['stage_seconds'].get(stage, 0), 3)
+                    for stage in sorted(stages)
+                }
+            }
+            run['outliers'] = [o.to_dict() for o in by_id[run_id].outliers]
+            result.append(run)
+
+        return jsonify({'baseline': ids[0], 'runs': result})
+    finally:
+        session.close()
+
+
+def _sse(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route('/api/events', methods=['GET'])
+@login_required
+def stream_events():
+    """Stream check-cycle progress and domain status changes (Server-Sent Events)"""
+    listener = events.get_listener()
+    stream = _pushed_events(listener) if listener.connected else _polled_events()
+    return Response(
+        stream_with_context(stream),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def _pushed_events(listener):
+    """Events forwarded from LISTEN/NOTIFY: no queries while the stream is idle"""
+    with events.Subscription(listener) as subscription:
+        session = get_session()
+        try:
+            run = session.query(CheckRun).order_by(CheckRun.id.desc()).first()
+            progress = run.to_dict() if run else None
+        finally:
+            session.close()
+
+        yield f"retry: {int(SSE_POLL_SECONDS * 1000)}\n\n"
+        if progress:
+            yield _sse('progress', progress)
+
+        deadline = time.monotonic() + SSE_MAX_SECONDS
+        while time.monotonic() < deadline:
+            item = subscription.get(timeout=SSE_KEEPALIVE_SECONDS)
+            if item is None:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+                continue
+
+            channel, payload = item
+            if payload.get('type') == events.RESYNC:
+                # Events were missed (reconnect or a stalled client): reload the page
+                yield _sse('resync', {})
+                return
+            if channel == events.RUN_CHANNEL:
+                yield _sse('progress', payload['run'])
+            elif payload.get('type') == 'transition':
+                yield _sse('domain', {key: payload.get(key) for key in (
+                    'id', 'domain', 'current_status', 'ssl_status',
+                    'previous_status', 'previous_ssl_status', 'last_check_time')})
+
+
+def _polled_events():
+    """Fallback without LISTEN/NOTIFY (SQLite, listener reconnecting)"""
+    # Statuses the client has already rendered; only differences are sent
+    session = get_session()
+    try:
+        known = {
+            row.id: (row.current_status, row.ssl_status)
+            for row in session.query(Domain.id, Domain.current_status, Domain.ssl_status)
+        }
+        cursor = session.query(func.max(Domain.last_check_time)).scalar() or datetime.utcnow()
+    finally:
+        session.close()
+
+    last_progress = None
+    deadline = time.monotonic() + SSE_MAX_SECONDS
+    yield f"retry: {int(SSE_POLL_SECONDS * 1000)}\n\n"
+
+    while time.monotonic() < deadline:
+        session = get_session()
+        try:
+            run = session.query(CheckRun).order_by(CheckRun.id.desc()).first()
+            progress = run.to_dict() if run else None
+            if progress and (not last_progress
+                             or progress['id'] != last_progress['id']
+                             or progress['updated_at'] != last_progress['updated_at']
+                             or progress['status'] != last_progress['status']):
+                yield _sse('progress', progress)
+            last_progress = progress
+
+            updated = session.query(Domain.id, Domain.domain, Domain.current_status,
+                                    Domain.ssl_status, Domain.last_check_time)\
+                .filter(Domain.last_check_time > cursor)\
+                .order_by(Domain.last_check_time)\
+                .all()
+        finally:
+            session.close()
+
+        for row in updated:
+            cursor = max(cursor, row.last_check_time)
+            previous = known.get(row.id)
+            current = (row.current_status, row.ssl_status)
+            if previous == current:
+                continue
+            known[row.id] = current
+            yield _sse('domain', {
+                'id': row.id,
+                'domain': row.domain,
+                'current_status': row.current_status,
+                'ssl_status': row.ssl_status,
+                'previous_status': previous[0] if previous else None,
+                'previous_ssl_status': previous[1] if previous else None,
+                'last_check_time': row.last_check_time.isoformat()
+            })
+
+        if not updated:
+            # Comment line keeps proxies from closing an idle stream
+            yield ": keep-alive\n\n"
+
+        time.sleep(SSE_POLL_SECONDS)
+
+
 @app.route('/api/import/csv', methods=['POST'])
 @login_required
 def import_csv():
@@ -513,6 +1200,8 @@ def import_csv():
                 errors.append(f"Row {row_num}: {str(e)}")
                 continue
 
+        if added_count:
+            events.publish(session, events.DOMAIN_CHANNEL, {'type': 'imported', 'added': added_count})
         session.commit()
 
         return jsonify({
@@ -530,6 +1219,31 @@ def import_csv():
         session.close()
 
 
+def metrics_allowed():
+    """Valid bearer token, or (no token configured) a direct request from an allowed network"""
+    if METRICS_TOKEN:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}')
+    # Behind a reverse proxy every request comes from the proxy's (local) address
+    if request.headers.get('X-Forwarded-For') or request.headers.get('Forwarded'):
+        return False
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    return any(address in network for network in METRICS_ALLOW_NETWORKS)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics endpoint"""
+    if not metrics_allowed():
+        return jsonify({'error': 'Unauthorized'}), 401 if METRICS_TOKEN else 403
+
+    update_pool_metrics(get_engine())
+    body, content_type = render_metrics()
+    return Response(body, mimetype=content_type)
+
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
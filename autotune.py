@@ -0,0 +1,317 @@
+"""Adaptive concurrency and timeouts for outbound probes (AIMD)
+
+Fixed concurrency levels and timeouts are wrong for part of the fleet and part
+of the day. Every outbound stage (dns, tls, safebrowsing, rdap) therefore runs
+its requests through a StageTuner: one controller for the stage and one per
+destination (the IPv4 /24 or IPv6 /48 of a TLS target, an RDAP registry, the
+Safe Browsing API host, the DNS resolver). A request holds a slot of its
+destination and of its stage.
+
+Limits change once per round (as many completions as the current limit):
+
+- additive increase: +1 when the round used the whole limit and went well;
+- multiplicative decrease: x AUTOTUNE_DECREASE when the round's mean latency
+  exceeded AUTOTUNE_LATENCY_TOLERANCE x the best recent round, or when it saw
+  timeouts or errors (destination) or rate limiting (destination and stage).
+  Dead hosts time out whatever the load, so they only slow down their own
+  network (to AUTOTUNE_DESTINATION_MIN), never the whole stage.
+
+Request timeouts follow observed latency (srtt + 4 x rttvar as in RFC 6298,
+x AUTOTUNE_TIMEOUT_FACTOR) between AUTOTUNE_MIN_TIMEOUT and the stage's
+configured timeout, which stays the upper bound. As in RFC 6298 (5.5) a
+destination's timeout doubles after each timeout until it answers again, so a
+slow network is not cut off at the estimate of fast ones. A destination that
+has not answered yet gets the configured timeout; a dead one costs its own
+network's slots (AUTOTUNE_DESTINATION_MIN), not the stage's.
+
+Stage maximums (<STAGE>_MAX_CONCURRENCY, 4x the configured concurrency
+by default) are capped by local limits: open files (RLIMIT_NOFILE, shared by
+all stages of the process), for stages whose workers use the database the
+connection pool and, for HTTP APIs, the client's connections per host.
+
+Controllers live as long as the process, so what one cycle learned carries
+over to the next. AUTOTUNE=0 restores fixed concurrency and timeouts.
+"""
+
+import os
+import time
+import logging
+import resource
+import ipaddress
+import threading
+from types import SimpleNamespace
+from contextlib import contextmanager
+
+from models import get_engine
+from metrics import PROBE_CONCURRENCY_LIMIT, PROBE_TIMEOUT
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Outcomes reported by callers: the server answered (whatever it said), the
+# request timed out, failed otherwise, or the destination asked us to slow down
+OUTCOMES = ('ok', 'timeout', 'error', 'overload')
+
+STAGE_SIGNALS = ('overload',)
+DESTINATION_SIGNALS = ('timeout', 'error', 'overload')
+
+
+def enabled():
+    return os.getenv('AUTOTUNE', '1') != '0'
+
+
+def settings():
+    return SimpleNamespace(
+        adaptive=enabled(),
+        decrease=float(os.getenv('AUTOTUNE_DECREASE', 0.5)),
+        tolerance=float(os.getenv('AUTOTUNE_LATENCY_TOLERANCE', 2)),
+        timeout_factor=float(os.getenv('AUTOTUNE_TIMEOUT_FACTOR', 3)),
+        min_timeout=float(os.getenv('AUTOTUNE_MIN_TIMEOUT', 3)),
+        destination_min=int(os.getenv('AUTOTUNE_DESTINATION_MIN', 4)),
+        baseline_seconds=float(os.getenv('AUTOTUNE_BASELINE_SECONDS', 300)),
+    )
+
+
+def destination_network(address):
+    """/24 (IPv4) or /48 (IPv6) of an address; other values are used as they are"""
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return address
+    prefix = 24 if ip.version == 4 else 48
+    return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+
+
+def fd_budget():
+    """Sockets this process may hold: the open files limit less a reserve"""
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        soft = 65536
+    return max(16, soft - int(os.getenv('AUTOTUNE_FD_RESERVE', 128)))
+
+
+def db_pool_capacity():
+    """Connections the engine's pool can hand out (None when unbounded)"""
+    pool = get_engine().pool
+    if not hasattr(pool, 'size'):
+        return None
+    overflow = getattr(pool, '_max_overflow', 0)
+    if overflow < 0:
+        return None
+    # The thread applying results and the web/scheduler bookkeeping need one too
+    return max(1, pool.size() + overflow - int(os.getenv('AUTOTUNE_DB_RESERVE', 2)))
+
+
+class AimdController:
+    """Concurrency limit and timeout estimate for one stage or destination"""
+
+    def __init__(self, name, initial, minimum, maximum, max_timeout, signals, config):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.max_timeout = max_timeout
+        self.signals = signals
+        self.config = config
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        # Latency estimates (successful requests only)
+        self.srtt = None
+        self.rttvar = None
+        # Timeout multiplier, doubled per timeout and reset by an answer
+        self.backoff = 1
+        # Best round mean latency, refreshed every AUTOTUNE_BASELINE_SECONDS
+        self.baseline = None
+        self._next_baseline = None
+        self._baseline_at = time.monotonic()
+        self._reset_round()
+
+    def _reset_round(self):
+        self._round_done = 0
+        self._round_bad = 0
+        self._round_latency = 0.0
+        self._round_ok = 0
+        self._saturated = False
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            if self.in_flight >= int(self.limit):
+                self._saturated = True
+
+    def release(self, latency, outcome):
+        with self._cond:
+            self.in_flight -= 1
+            if self.config.adaptive:
+                self._observe(latency, outcome)
+            # The limit may have grown: wake every waiter, not just one
+            self._cond.notify_all()
+
+    def _observe(self, latency, outcome):
+        if outcome == 'ok':
+            if self.srtt is None:
+                self.srtt, self.rttvar = latency, latency / 2
+            else:
+                self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - latency)
+                self.srtt = 0.875 * self.srtt + 0.125 * latency
+            self._round_latency += latency
+            self._round_ok += 1
+            self.backoff = 1
+        elif outcome == 'timeout' and 'timeout' in self.signals:
+            # Back off up to the configured timeout (the stage's own estimate ignores timeouts)
+            if self.timeout() < self.max_timeout:
+                self.backoff *= 2
+
+        if outcome in self.signals:
+            self._round_bad += 1
+        self._round_done += 1
+        if self._round_done >= int(self.limit):
+            self._end_round()
+
+    def _end_round(self):
+        previous = self.limit
+        mean = self._round_latency / self._round_ok if self._round_ok else None
+        inflated = False
+        if mean is not None:
+            inflated = self.baseline is not None and mean > self.config.tolerance * self.baseline
+            self._update_baseline(mean)
+
+        if self._round_bad or inflated:
+            self.limit = max(self.minimum, self.limit * self.config.decrease)
+        elif self._saturated:
+            self.limit = min(self.maximum, self.limit + 1)
+
+        if int(self.limit) != int(previous):
+            logger.debug(f"Autotune {self.name}: limit {int(previous)} -> {int(self.limit)} "
+                         f"(bad {self._round_bad}/{self._round_done}, mean {mean}, baseline {self.baseline})")
+        self._reset_round()
+
+    def _update_baseline(self, mean):
+        now = time.monotonic()
+        if self.baseline is None or mean < self.baseline:
+            self.baseline = mean
+        self._next_baseline = mean if self._next_baseline is None else min(self._next_baseline, mean)
+        # Forget old bests so a permanently slower network isn't throttled forever
+        if now - self._baseline_at >= self.config.baseline_seconds:
+            self.baseline = self._next_baseline
+            self._next_baseline = None
+            self._baseline_at = now
+
+    def timeout(self):
+        """Timeout for the next request (the configured one before the first answer)"""
+        if not self.config.adaptive or self.srtt is None:
+            return self.max_timeout
+        estimate = self.config.timeout_factor * (self.srtt + 4 * self.rttvar)
+        return min(self.max_timeout, max(self.config.min_timeout, estimate) * self.backoff)
+
+
+class Slot:
+    """Handed to the caller of StageTuner.slot(): the timeout to use and the outcome to report"""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.outcome = 'ok'
+
+
+class StageTuner:
+    """The stage's controller plus one controller per destination"""
+
+    def __init__(self, stage, initial, max_timeout, uses_db=False, destination_maximum=None,
+                 destination_signals=DESTINATION_SIGNALS):
+        self.stage = stage
+        self.config = settings()
+        maximum = int(os.getenv(f'{stage.upper()}_MAX_CONCURRENCY', 0) or initial * 4)
+        if not self.config.adaptive:
+            maximum = initial
+        maximum = min(maximum, fd_budget())
+        if uses_db:
+            capacity = db_pool_capacity()
+            if capacity is not None:
+                maximum = min(maximum, capacity)
+        # Worker threads to start: requests beyond the current limit wait for a slot
+        self.maximum = max(1, maximum)
+        self.initial = max(1, min(initial, self.maximum))
+        self.max_timeout = max_timeout
+        self.destination_maximum = min(self.maximum, destination_maximum or self.maximum)
+        self.destination_signals = destination_signals
+        self.controller = AimdController(stage, self.initial, 1, self.maximum, max_timeout,
+                                         STAGE_SIGNALS, self.config)
+        self._destinations = {}
+        self._lock = threading.Lock()
+
+    def _destination(self, destination):
+        controller = self._destinations.get(destination)
+        if controller is None:
+            with self._lock:
+                controller = self._destinations.get(destination)
+                if controller is None:
+                    controller = AimdController(f"{self.stage}/{destination}", self.initial,
+                                                min(self.config.destination_min, self.initial),
+                                                self.destination_maximum, self.max_timeout,
+                                                self.destination_signals, self.config)
+                    self._destinations[destination] = controller
+        return controller
+
+    @property
+    def limit(self):
+        return int(self.controller.limit)
+
+    def timeout(self, destination=None):
+        if destination is not None:
+            return self._destination(destination).timeout()
+        return self.controller.timeout()
+
+    @contextmanager
+    def slot(self, destination):
+        """Wait for a slot of the destination and of the stage; the caller sets slot.outcome"""
+        controller = self._destination(destination)
+        controller.acquire()
+        self.controller.acquire()
+        _fd_tokens().acquire()
+        slot = Slot(self.timeout(destination))
+        started = time.perf_counter()
+        try:
+            yield slot
+        except Exception:
+            slot.outcome = 'error'
+            raise
+        finally:
+            latency = time.perf_counter() - started
+            _fd_tokens().release()
+            self.controller.release(latency, slot.outcome)
+            controller.release(latency, slot.outcome)
+            PROBE_CONCURRENCY_LIMIT.labels(self.stage).set(self.limit)
+            PROBE_TIMEOUT.labels(self.stage).set(self.timeout())
+
+
+_tuners = {}
+_fd_semaphore = None
+_lock = threading.Lock()
+
+
+def _fd_tokens():
+    """Process-wide socket budget shared by all stages"""
+    global _fd_semaphore
+    if _fd_semaphore is None:
+        with _lock:
+            if _fd_semaphore is None:
+                _fd_semaphore = threading.BoundedSemaphore(fd_budget())
+    return _fd_semaphore
+
+
+def get_tuner(stage, initial, max_timeout, uses_db=False, destination_maximum=None,
+              destination_signals=DESTINATION_SIGNALS):
+    """This process's tuner for a stage, created with the first caller's settings"""
+    tuner = _tuners.get(stage)
+    if tuner is None:
+        with _lock:
+            tuner = _tuners.get(stage)
+            if tuner is None:
+                tuner = StageTuner(stage, initial, max_timeout, uses_db, destination_maximum, destination_signals)
+                _tuners[stage] = tuner
+                logger.info(f"Autotune {stage}: start at {tuner.initial}, up to {tuner.maximum} "
+                            f"concurrent, timeout up to {max_timeout}s"
+                            + ("" if tuner.config.adaptive else " (fixed, AUTOTUNE=0)"))
+    return tuner
@@ -0,0 +1,188 @@
+"""Checker benchmark against local stand-in servers
+
+Seeds a dedicated database with N synthetic domains, points the checker at
+local Safe Browsing, DNS, TLS and Telegram stand-ins and runs full check
+cycles. Prints one JSON document with throughput, per-stage p50/p99
+latency, DB time and peak RSS.
+
+    python -m benchmarks.bench_checker --database-url postgresql://.../gdbchecker_bench \\
+        --domains 10000 --sb-latency 0.05 --sb-429-rate 0.01 --runs 2
+
+The database's tables are DROPPED and recreated; never point it at production.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import resource
+from urllib.parse import urlsplit
+
+from benchmarks.mock_servers import MockSafeBrowsing, FakeTelegram, StubDnsServer, MockTlsServer
+
+DEFAULT_MIX = 'ok=0.7,banned=0.1,expired=0.05,selfsigned=0.05,refused=0.05,nx=0.05'
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        kind, _, weight = part.partition('=')
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def synthetic_domains(count, mix, seed=42):
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    for i in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        yield {
+            'domain': f'{kind}-{i}.bench.test',
+            'project': f'project-{i % 20}',
+            'purpose': rng.choice(['Landing', 'Traffic', 'Редиректор офферов']),
+            'current_status': 'pending',
+            'ssl_status': 'pending',
+            'added_by': 'bench'
+        }
+
+
+def seed_database(models, count, mix, chunk_size=5000):
+    engine = models.get_engine()
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+
+    started = time.perf_counter()
+    rows = list(synthetic_domains(count, mix))
+    with engine.begin() as conn:
+        for i in range(0, len(rows), chunk_size):
+            conn.execute(models.Domain.__table__.insert(), rows[i:i + chunk_size])
+    return time.perf_counter() - started
+
+
+def outbound_stats(stats, stand_in_urls):
+    """Client stats for the stand-in APIs; per-domain fallback hosts are summed into 'other'"""
+    hosts = {urlsplit(url).netloc for url in stand_in_urls}
+    result = {host: stats[host] for host in hosts if host in stats}
+    other = [s for host, s in stats.items() if host not in hosts]
+    if other:
+        result['other'] = {
+            'hosts': len(other),
+            'requests': sum(s['requests'] for s in other),
+            'errors': sum(s['errors'] for s in other),
+        }
+    return result
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark check cycles against local stand-in servers')
+    parser.add_argument('--database-url', required=True, help='Dedicated benchmark database (tables are dropped)')
+    parser.add_argument('--domains', type=int, default=1000, help='Number of synthetic domains (1k-100k)')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Domain kinds and weights (default: {DEFAULT_MIX})')
+    parser.add_argument('--runs', type=int, default=1, help='Consecutive cycles (later ones hit the caches)')
+    parser.add_argument('--sb-latency', type=float, default=0.05, help='Safe Browsing response latency, seconds')
+    parser.add_argument('--sb-error-rate', type=float, default=0.0, help='Share of 503 responses')
+    parser.add_argument('--sb-429-rate', type=float, default=0.0, help='Share of 429 responses')
+    parser.add_argument('--dns-ttl', type=int, default=300, help='TTL served by the stub resolver')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+
+    safebrowsing = MockSafeBrowsing(args.sb_latency, args.sb_error_rate, args.sb_429_rate).start()
+    telegram = FakeTelegram().start()
+    dns_server = StubDnsServer(ttl=args.dns_ttl).start()
+    tls_server = MockTlsServer().start()
+
+    # Project modules read their configuration at import/construction time
+    os.environ.update({
+        'DATABASE_URL': args.database_url,
+        'GOOGLE_API_KEY': 'bench',
+        'SAFEBROWSING_API_URL': safebrowsing.api_url,
+        'DNS_NAMESERVERS': '127.0.0.1',
+        'DNS_PORT': str(dns_server.port),
+        'TLS_PORT': str(tls_server.port),
+        'TLS_CA_FILE': tls_server.ca_file,
+        'TELEGRAM_API_URL': telegram.url,
+        'TELEGRAM_BOT_TOKEN': 'bench',
+        'TELEGRAM_CHAT_ID': '1',
+    })
+
+    import models
+    from checker import DomainChecker
+    from metrics import StageTimings
+
+    seed_seconds = seed_database(models, args.domains, parse_mix(args.mix))
+    checker = DomainChecker()
+
+    runs = []
+    for _ in range(args.runs):
+        requests_before = safebrowsing.requests
+        messages_before = len(telegram.messages)
+        timings = StageTimings(keep_samples=True)
+
+        started = time.perf_counter()
+        run_id = checker.check_all_domains(timings=timings)
+        wall = time.perf_counter() - started
+
+        session = models.get_session()
+        try:
+            run = session.query(models.CheckRun).filter_by(id=run_id).first().to_dict()
+        finally:
+            session.close()
+
+        totals = timings.totals()
+        counts = timings.counts()
+        runs.append({
+            'run_id': run_id,
+            'status': run['status'],
+            'wall_seconds': round(wall, 3),
+            'checked': run['checked'],
+            'errors': run['errors'],
+            'banned': run['banned'],
+            'throughput_domains_per_second': round(run['checked'] / wall, 2) if wall > 0 else None,
+            'db_seconds': totals.get('db_flush', 0),
+            'stage_seconds': totals,
+            'latency': {
+                stage: dict(count=counts[stage], **{
+                    k: round(v, 4) for k, v in timings.percentiles(stage, (50, 99)).items()
+                })
+                for stage in counts
+            },
+            'safebrowsing_requests': safebrowsing.requests - requests_before,
+            'telegram_messages': len(telegram.messages) - messages_before,
+            'http_client': outbound_stats(checker.http.stats(), (safebrowsing.url, telegram.url))
+        })
+
+    result = {
+        'config': {
+            'domains': args.domains,
+            'mix': parse_mix(args.mix),
+            'sb_latency': args.sb_latency,
+            'sb_error_rate': args.sb_error_rate,
+            'sb_429_rate': args.sb_429_rate,
+            'dns_ttl': args.dns_ttl,
+        },
+        'seed_seconds': round(seed_seconds, 3),
+        'runs': runs,
+        'dns_queries': dns_server.queries,
+        'tls_handshakes': tls_server.handshakes,
+        'peak_rss_mb': peak_rss_mb()
+    }
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+    for server in (safebrowsing, telegram, dns_server, tls_server):
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
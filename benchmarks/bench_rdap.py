@@ -0,0 +1,108 @@
+"""RDAP collection against a local stand-in registry
+
+Seeds a dedicated database, points the collector at a local RDAP server via a
+generated bootstrap file and Public Suffix List and runs the collection twice:
+the first run queries every domain, the second should be served from
+domain_registrations.
+
+    python -m benchmarks.bench_rdap --database-url postgresql://.../gdbchecker_bench \\
+        --domains 2000 --rate-per-registry 50 --rdap-429-rate 0.01
+
+The database's tables are DROPPED and recreated; never point it at production.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+from benchmarks.mock_servers import MockRdap
+from benchmarks.bench_checker import parse_mix, seed_database, peak_rss_mb
+
+DEFAULT_MIX = 'ok=0.9,norenew=0.05,unregistered=0.05'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark RDAP collection against a local registry')
+    parser.add_argument('--database-url', required=True, help='Dedicated benchmark database (tables are dropped)')
+    parser.add_argument('--domains', type=int, default=1000)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Domain kinds and weights (default: {DEFAULT_MIX})')
+    parser.add_argument('--rdap-latency', type=float, default=0.05, help='Registry response latency, seconds')
+    parser.add_argument('--rdap-429-rate', type=float, default=0.0, help='Share of 429 responses')
+    parser.add_argument('--rate-per-registry', type=float, default=50, help='RDAP_RATE_PER_REGISTRY')
+    parser.add_argument('--concurrency', type=int, default=10, help='RDAP_CONCURRENCY')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+
+    registry = MockRdap(args.rdap_latency, args.rdap_429_rate).start()
+    workdir = tempfile.mkdtemp(prefix='gdbchecker-rdap-')
+    bootstrap = registry.write_bootstrap(os.path.join(workdir, 'dns.json'))
+    public_suffixes = registry.write_public_suffix_list(os.path.join(workdir, 'public_suffix_list.dat'))
+
+    os.environ.update({
+        'DATABASE_URL': args.database_url,
+        'RDAP_BOOTSTRAP_FILE': bootstrap,
+        'RDAP_PSL_FILE': public_suffixes,
+        'RDAP_RATE_PER_REGISTRY': str(args.rate_per_registry),
+        'RDAP_CONCURRENCY': str(args.concurrency),
+    })
+
+    import models
+    from rdap import RdapCollector
+    from metrics import StageTimings
+
+    seed_seconds = seed_database(models, args.domains, parse_mix(args.mix))
+    collector = RdapCollector()
+
+    runs = []
+    for _ in range(2):
+        requests_before = registry.requests
+        timings = StageTimings(keep_samples=True)
+        session = models.get_session()
+        try:
+            started = time.perf_counter()
+            counts = collector.collect(session, timings=timings)
+            wall = time.perf_counter() - started
+        finally:
+            session.close()
+        runs.append({
+            'wall_seconds': round(wall, 3),
+            'results': counts,
+            'registry_requests': registry.requests - requests_before,
+            'latency': {k: round(v, 4) for k, v in timings.percentiles('rdap', (50, 99)).items()}
+        })
+
+    session = models.get_session()
+    try:
+        filled = {
+            'expire_date': session.query(models.Domain).filter(models.Domain.expire_date.isnot(None)).count(),
+            'autorenew_enabled': session.query(models.Domain).filter_by(autorenew='enabled').count(),
+            'autorenew_disabled': session.query(models.Domain).filter_by(autorenew='disabled').count(),
+        }
+    finally:
+        session.close()
+
+    json.dump({
+        'config': {
+            'domains': args.domains,
+            'mix': parse_mix(args.mix),
+            'rdap_latency': args.rdap_latency,
+            'rdap_429_rate': args.rdap_429_rate,
+            'rate_per_registry': args.rate_per_registry,
+            'concurrency': args.concurrency,
+        },
+        'seed_seconds': round(seed_seconds, 3),
+        'runs': runs,
+        'domains_filled': filled,
+        'peak_rss_mb': peak_rss_mb()
+    }, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    registry.stop()
+
+
+if __name__ == '__main__':
+    main()
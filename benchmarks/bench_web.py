@@ -0,0 +1,338 @@
+"""Web-tier load benchmark for the dashboard and API endpoints
+
+Seeds a dedicated database with N domains and M history rows per domain,
+starts gunicorn the way it is deployed (gthread workers, gunicorn.conf.py)
+and drives the heavy endpoints concurrently with logged-in clients. Prints
+one JSON document with latency percentiles, SQL statements per request
+(X-DB-Queries) and worker RSS.
+
+    python -m benchmarks.bench_web --database-url postgresql://.../gdbchecker_bench \\
+        --domains 50000 --history-per-domain 20 --concurrency 16 --requests 50
+
+The database's tables are DROPPED and recreated; never point it at production.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import argparse
+import itertools
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+from benchmarks.mock_servers import FakeTelegram
+from benchmarks.bench_checker import peak_rss_mb
+
+logger = logging.getLogger(__name__)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCH_USER = 'bench'
+BENCH_PASSWORD = 'bench'
+
+ENDPOINTS = ('index', 'domains', 'export_csv', 'import_csv', 'send_status')
+STATUSES = ['ok'] * 85 + ['banned'] * 10 + ['error'] * 5
+
+
+def seed_database(models, domains, history_per_domain, chunk_size=5000, seed=42):
+    """Bulk insert domains and history rows, returns seconds spent"""
+    rng = random.Random(seed)
+    engine = models.get_engine()
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        user = models.User(username=BENCH_USER)
+        user.set_password(BENCH_PASSWORD)
+        conn.execute(models.User.__table__.insert(), {
+            'username': user.username, 'password_hash': user.password_hash, 'is_active': True
+        })
+
+        rows = []
+        for i in range(domains):
+            rows.append({
+                'domain': f'site-{i}.bench.test',
+                'project': f'project-{i % 20}',
+                'purpose': rng.choice(['Landing', 'Traffic', 'Редиректор офферов']),
+                'current_status': rng.choice(STATUSES),
+                'ssl_status': rng.choice(['valid', 'valid', 'valid', 'expired', 'missing']),
+                'last_check_time': now - timedelta(minutes=rng.randint(0, 480)),
+                'added_by': 'bench'
+            })
+            if len(rows) == chunk_size:
+                conn.execute(models.Domain.__table__.insert(), rows)
+                rows = []
+        if rows:
+            conn.execute(models.Domain.__table__.insert(), rows)
+
+        domain_ids = [row[0] for row in conn.execute(models.Domain.__table__.select().with_only_columns(
+            models.Domain.__table__.c.id))]
+
+        rows = []
+        for domain_id in domain_ids:
+            for n in range(history_per_domain):
+                rows.append({
+                    'domain_id': domain_id,
+                    'status': rng.choice(STATUSES),
+                    'checked_at': now - timedelta(hours=8 * n, minutes=rng.randint(0, 30)),
+                    'details': {}
+                })
+                if len(rows) == chunk_size:
+                    conn.execute(models.StatusHistory.__table__.insert(), rows)
+                    rows = []
+        if rows:
+            conn.execute(models.StatusHistory.__table__.insert(), rows)
+
+    return time.perf_counter() - started
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(port, workers, threads, env):
+    """Launch gunicorn as in the Dockerfile, from the repository root"""
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-k', 'gthread', '--threads', str(threads),
+         '-b', f'127.0.0.1:{port}', '--timeout', '300', 'app:app'],
+        cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=sys.stderr
+    )
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            requests.get(f'http://127.0.0.1:{port}/health', timeout=1)
+            return process
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start within 60 seconds')
+
+
+def worker_pids(master_pid):
+    """Children of the gunicorn master, from /proc (Linux)"""
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; fields after it are fixed
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == master_pid:
+            pids.append(int(entry))
+    return pids
+
+
+def rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class RssSampler:
+    """Peak RSS per gunicorn worker, sampled in the background"""
+
+    def __init__(self, master_pid, interval=0.25):
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peaks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            for pid in worker_pids(self.master_pid):
+                self.peaks[pid] = max(self.peaks.get(pid, 0.0), rss_mb(pid))
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return {
+            'workers': len(self.peaks),
+            'peak_per_worker_mb': round(max(self.peaks.values(), default=0.0), 1),
+            'peak_total_mb': round(sum(self.peaks.values()), 1)
+        }
+
+
+class Client:
+    """Logged-in session bound to one benchmark thread"""
+
+    _counter = itertools.count()
+
+    def __init__(self, base_url, import_rows):
+        self.base_url = base_url
+        self.import_rows = import_rows
+        self.session = requests.Session()
+        response = self.session.post(f'{base_url}/login', data={
+            'username': BENCH_USER, 'password': BENCH_PASSWORD
+        }, allow_redirects=False)
+        if response.status_code != 302:
+            raise RuntimeError(f"Login failed with status {response.status_code}")
+
+    def _import_file(self):
+        # Half of the rows already exist, half are new to this request
+        batch = next(self._counter)
+        lines = ['domain,project,purpose']
+        for i in range(self.import_rows):
+            if i % 2:
+                lines.append(f'site-{i}.bench.test,project-{i % 20},Landing')
+            else:
+                lines.append(f'import-{batch}-{i}.bench.test,imported,Traffic')
+        return ('bench.csv', '\n'.join(lines).encode(), 'text/csv')
+
+    def call(self, endpoint):
+        url = self.base_url
+        if endpoint == 'index':
+            return self.session.get(f'{url}/', timeout=300)
+        if endpoint == 'domains':
+            return self.session.get(f'{url}/api/domains', timeout=300)
+        if endpoint == 'export_csv':
+            return self.session.get(f'{url}/api/export/csv', timeout=300)
+        if endpoint == 'import_csv':
+            return self.session.post(f'{url}/api/import/csv', files={'file': self._import_file()}, timeout=300)
+        if endpoint == 'send_status':
+            return self.session.post(f'{url}/api/telegram/send-status', timeout=300)
+        raise ValueError(f"Unknown endpoint {endpoint}")
+
+
+def percentile(samples, point):
+    """Nearest-rank percentile of sorted samples"""
+    return samples[min(len(samples) - 1, max(0, int(round(point / 100 * len(samples))) - 1))]
+
+
+def run_endpoint(base_url, endpoint, concurrency, count, import_rows):
+    """Send `count` requests to one endpoint from `concurrency` clients"""
+    local = threading.local()
+
+    def one(_):
+        if not hasattr(local, 'client'):
+            local.client = Client(base_url, import_rows)
+        started = time.perf_counter()
+        try:
+            response = local.client.call(endpoint)
+        except requests.exceptions.RequestException as e:
+            return time.perf_counter() - started, None, None, 0, str(e)
+        queries = response.headers.get('X-DB-Queries')
+        return (time.perf_counter() - started, response.status_code,
+                int(queries) if queries is not None else None, len(response.content), None)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(count)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(r[0] for r in results)
+    queries = [r[2] for r in results if r[2] is not None]
+    errors = [r for r in results if r[1] is None or r[1] >= 400]
+    return {
+        'requests': count,
+        'errors': len(errors),
+        'first_error': (errors[0][4] or f'HTTP {errors[0][1]}') if errors else None,
+        'requests_per_second': round(count / wall, 2) if wall > 0 else None,
+        'latency': {f'p{p}': round(percentile(latencies, p), 4) for p in (50, 95, 99)},
+        'latency_max': round(latencies[-1], 4),
+        'db_queries': {
+            'min': min(queries), 'max': max(queries), 'avg': round(sum(queries) / len(queries), 1)
+        } if queries else None,
+        'response_bytes_avg': int(sum(r[3] for r in results) / count)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the dashboard and API through gunicorn')
+    parser.add_argument('--database-url', required=True, help='Dedicated benchmark database (tables are dropped)')
+    parser.add_argument('--domains', type=int, default=10000, help='Number of seeded domains')
+    parser.add_argument('--history-per-domain', type=int, default=10, help='status_history rows per domain')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help=f'Subset of {",".join(ENDPOINTS)}')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients per endpoint')
+    parser.add_argument('--requests', type=int, default=20, help='Requests per endpoint')
+    parser.add_argument('--import-rows', type=int, default=500, help='Rows per uploaded CSV')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers (deployed: 4)')
+    parser.add_argument('--threads', type=int, default=8, help='Threads per worker (deployed: 8)')
+    args = parser.parse_args()
+
+    endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    telegram = FakeTelegram().start()
+
+    env = dict(os.environ, **{
+        'DATABASE_URL': args.database_url,
+        'TELEGRAM_API_URL': telegram.url,
+        'TELEGRAM_BOT_TOKEN': 'bench',
+        'TELEGRAM_CHAT_ID': '1',
+        'EXPOSE_QUERY_COUNT': '1',
+    })
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    os.environ['DATABASE_URL'] = args.database_url
+
+    import models
+    seed_seconds = seed_database(models, args.domains, args.history_per_domain)
+    models.get_engine().dispose()
+
+    port = free_port()
+    gunicorn = start_gunicorn(port, args.workers, args.threads, env)
+    sampler = RssSampler(gunicorn.pid).start()
+    base_url = f'http://127.0.0.1:{port}'
+
+    results = {}
+    try:
+        for endpoint in endpoints:
+            results[endpoint] = run_endpoint(base_url, endpoint, args.concurrency, args.requests, args.import_rows)
+    finally:
+        memory = sampler.stop()
+        gunicorn.terminate()
+        gunicorn.wait(timeout=30)
+        telegram.stop()
+
+    json.dump({
+        'config': {
+            'domains': args.domains,
+            'history_rows': args.domains * args.history_per_domain,
+            'concurrency': args.concurrency,
+            'requests_per_endpoint': args.requests,
+            'import_rows': args.import_rows,
+            'workers': args.workers,
+            'threads': args.threads,
+        },
+        'seed_seconds': round(seed_seconds, 3),
+        'endpoints': results,
+        'worker_rss': memory,
+        'telegram_messages': len(telegram.messages),
+        'bench_peak_rss_mb': peak_rss_mb()
+    }, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
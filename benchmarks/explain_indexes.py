@@ -0,0 +1,156 @@
+"""EXPLAIN regression check for the query-driven indexes (PostgreSQL)
+
+Builds the schema as init_db.py does (create_all + migrations), seeds a
+fleet with history, runs ANALYZE and asserts that the planner picks the
+expected index for every hot query. Exits with status 1 when a plan
+regresses, so it can gate schema or query changes.
+
+    python -m benchmarks.explain_indexes --database-url postgresql://.../gdbchecker_bench
+
+The database's tables are DROPPED and recreated; never point it at production.
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+# (description, SQL, parameters, index the plan must use); callable parameters
+# get the seeding time
+CHECKS = [
+    ('banned domains of a project',
+     "SELECT id, domain FROM domains WHERE current_status = 'banned' AND project = :project",
+     {'project': 'project-7'}, 'ix_domains_status_project'),
+    ('domains of a project (checker --project)',
+     'SELECT id, domain FROM domains WHERE project = :project',
+     {'project': 'project-7'}, 'ix_domains_project'),
+    ('domains not checked since (checker --not-checked-since)',
+     'SELECT id FROM domains WHERE last_check_time < :since',
+     {'since': lambda now: now - timedelta(days=7)}, 'ix_domains_last_check_time'),
+    ('latest history of a domain (domain page)',
+     'SELECT * FROM status_history WHERE domain_id = :domain_id ORDER BY checked_at DESC LIMIT 50',
+     {'domain_id': 42}, 'ix_status_history_domain_checked'),
+    ('last ban of a domain within 24 hours (status report)',
+     "SELECT * FROM status_history WHERE domain_id = :domain_id AND status = 'banned' "
+     'AND checked_at >= :since ORDER BY checked_at DESC LIMIT 1',
+     {'domain_id': 42, 'since': lambda now: now - timedelta(days=1)}, 'ix_status_history_domain_status_checked'),
+    ('substring search over domain names (typeahead)',
+     'SELECT id FROM domains WHERE domain ILIKE :pattern LIMIT 20',
+     {'pattern': '%site-1234.%'}, 'ix_domains_domain_trgm'),
+    ('results flagged with a threat type (history API, export)',
+     'SELECT domain_id, checked_at FROM status_history WHERE threat_types @> ARRAY[:threat_type]',
+     {'threat_type': 'SOCIAL_ENGINEERING'}, 'ix_status_history_threat_types'),
+    ('bans across the fleet within 24 hours',
+     "SELECT domain_id FROM status_history WHERE status = 'banned' AND checked_at >= :since",
+     {'since': lambda now: now - timedelta(days=1)}, 'ix_status_history_banned'),
+]
+
+THREAT_TYPES = ['MALWARE', 'SOCIAL_ENGINEERING', 'UNWANTED_SOFTWARE', 'POTENTIALLY_HARMFUL_APPLICATION']
+
+
+def seed(conn, models, domains, history_per_domain, projects, seed_value=42):
+    """Fleet shaped like production: few bans, most domains checked recently"""
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+
+    rows = [{
+        'domain': f'site-{i}.explain.test',
+        'project': f'project-{i % projects}',
+        'purpose': 'Landing',
+        'current_status': 'banned' if rng.random() < 0.02 else 'ok',
+        'ssl_status': 'valid',
+        # 1% of the fleet has fallen behind by more than a week
+        'last_check_time': now - (timedelta(days=rng.randint(8, 30)) if rng.random() < 0.01
+                                  else timedelta(hours=rng.randint(0, 8))),
+    } for i in range(domains)]
+    conn.execute(models.Domain.__table__.insert(), rows)
+
+    domain_ids = [row[0] for row in conn.execute(text('SELECT id FROM domains'))]
+    batch = []
+    for domain_id in domain_ids:
+        for n in range(history_per_domain):
+            banned = rng.random() < 0.02
+            threat_types = [rng.choice(THREAT_TYPES)] if banned else None
+            batch.append({
+                'domain_id': domain_id,
+                'status': 'banned' if banned else 'ok',
+                'checked_at': now - timedelta(hours=8 * n),
+                'details': {'threat_types': threat_types} if banned else {},
+                'threat_types': threat_types,
+                'ssl_status': 'valid'
+            })
+        if len(batch) >= 10000:
+            conn.execute(models.StatusHistory.__table__.insert(), batch)
+            batch = []
+    if batch:
+        conn.execute(models.StatusHistory.__table__.insert(), batch)
+    return now
+
+
+def plan_indexes(node):
+    """Index names used anywhere in an EXPLAIN (FORMAT JSON) plan"""
+    names = set()
+    if 'Index Name' in node:
+        names.add(node['Index Name'])
+    for child in node.get('Plans', []):
+        names |= plan_indexes(child)
+    return names
+
+
+def resolve_params(params, now):
+    return {key: value(now) if callable(value) else value for key, value in params.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Assert that hot queries use their indexes')
+    parser.add_argument('--database-url', required=True, help='Dedicated PostgreSQL database (tables are dropped)')
+    parser.add_argument('--domains', type=int, default=20000)
+    parser.add_argument('--history-per-domain', type=int, default=30)
+    parser.add_argument('--projects', type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    import models
+    from migrations import run_migrations
+
+    engine = models.get_engine()
+    if engine.dialect.name != 'postgresql':
+        parser.error('EXPLAIN checks need PostgreSQL')
+
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    run_migrations(engine)
+
+    with engine.begin() as conn:
+        now = seed(conn, models, args.domains, args.history_per_domain, args.projects)
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level='AUTOCOMMIT').execute(text('ANALYZE domains, status_history'))
+
+    results = []
+    with engine.connect() as conn:
+        for description, sql, params, expected in CHECKS:
+            plan = conn.execute(text(f'EXPLAIN (FORMAT JSON) {sql}'), resolve_params(params, now)).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            used = plan_indexes(plan[0]['Plan'])
+            results.append({
+                'query': description,
+                'expected_index': expected,
+                'used_indexes': sorted(used),
+                'ok': expected in used
+            })
+
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    failed = [r['query'] for r in results if not r['ok']]
+    if failed:
+        sys.stderr.write(f"Plans without the expected index: {', '.join(failed)}\n")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+"""Local stand-ins for Safe Browsing, DNS, TLS endpoints and the Telegram Bot API
+
+Domain names encode how every stand-in treats them, so one synthetic fleet
+exercises all paths:
+
+    banned-*    Safe Browsing match (SOCIAL_ENGINEERING)
+    nx-*        NXDOMAIN from the stub resolver
+    refused-*   resolves to 127.0.0.2, where nothing listens (connection refused)
+    expired-*   TLS endpoint serves an expired certificate
+    selfsigned-* TLS endpoint serves a self-signed certificate
+    anything else: resolves to 127.0.0.1, valid certificate from the local CA
+
+RDAP: unregistered-* is 404, norenew-* has renewal prohibited, everything
+else is registered with autorenew and an expiry derived from the name.
+"""
+
+import os
+import ssl
+import json
+import time
+import zlib
+import random
+import socket
+import logging
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+logger = logging.getLogger(__name__)
+
+LOOPBACK = '127.0.0.1'
+UNREACHABLE = '127.0.0.2'
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real APIs
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+
+class _HttpStandIn:
+    handler = None
+
+    def __init__(self):
+        self.server = ThreadingHTTPServer((LOOPBACK, 0), self.handler)
+        self.server.daemon_threads = True
+        self.server.stand_in = self
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    @property
+    def url(self):
+        return f"http://{LOOPBACK}:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self):
+        with self.lock:
+            self.requests += 1
+
+
+class _SafeBrowsingHandler(_QuietHandler):
+    def do_POST(self):
+        stand_in = self.server.stand_in
+        stand_in.count()
+        body = self._read_json()
+
+        if stand_in.latency:
+            time.sleep(stand_in.latency)
+
+        roll = random.random()
+        if roll < stand_in.rate_limit_rate:
+            return self._json(429, {'error': {'code': 429, 'message': 'Quota exceeded'}})
+        if roll < stand_in.rate_limit_rate + stand_in.error_rate:
+            return self._json(503, {'error': {'code': 503, 'message': 'Backend error'}})
+
+        matches = [
+            {
+                'threatType': 'SOCIAL_ENGINEERING',
+                'platformType': 'ANY_PLATFORM',
+                'threatEntryType': 'URL',
+                'threat': {'url': entry['url']},
+                'cacheDuration': '300s'
+            }
+            for entry in body.get('threatInfo', {}).get('threatEntries', [])
+            if '//banned-' in entry.get('url', '')
+        ]
+        self._json(200, {'matches': matches} if matches else {})
+
+
+class MockSafeBrowsing(_HttpStandIn):
+    """threatMatches:find with configurable latency, 5xx error rate and 429 rate"""
+    handler = _SafeBrowsingHandler
+
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit_rate=0.0):
+        super().__init__()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+
+    @property
+    def api_url(self):
+        return f"{self.url}/v4/threatMatches:find"
+
+
+class _TelegramHandler(_QuietHandler):
+    def do_POST(self):
+        stand_in = self.server.stand_in
+        stand_in.count()
+        body = self._read_json()
+        if not self.path.endswith('/sendMessage') or 'chat_id' not in body:
+            return self._json(400, {'ok': False, 'description': 'Bad Request'})
+        with stand_in.lock:
+            stand_in.messages.append(body.get('text', ''))
+        self._json(200, {'ok': True, 'result': {'message_id': stand_in.requests}})
+
+
+class FakeTelegram(_HttpStandIn):
+    """Bot API sendMessage that records messages"""
+    handler = _TelegramHandler
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+
+class _RdapHandler(_QuietHandler):
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        stand_in.count()
+        prefix = '/rdap/domain/'
+        if not self.path.startswith(prefix):
+            return self._json(404, {'errorCode': 404, 'title': 'Not Found'})
+        name = self.path[len(prefix):].lower()
+
+        if stand_in.latency:
+            time.sleep(stand_in.latency)
+        if random.random() < stand_in.rate_limit_rate:
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if name.startswith('unregistered-'):
+            return self._json(404, {'errorCode': 404, 'title': 'Not Found'})
+
+        # Stable expiry per name, 10-400 days ahead
+        now = datetime.utcnow().replace(microsecond=0)
+        expires = now + timedelta(days=10 + zlib.crc32(name.encode()) % 390)
+        statuses = ['client transfer prohibited']
+        statuses.append('client renew prohibited' if name.startswith('norenew-') else 'auto renew period')
+        self._json(200, {
+            'objectClassName': 'domain',
+            'ldhName': name,
+            'status': statuses,
+            'events': [
+                {'eventAction': 'registration', 'eventDate': (now - timedelta(days=700)).isoformat() + 'Z'},
+                {'eventAction': 'expiration', 'eventDate': expires.isoformat() + 'Z'}
+            ]
+        })
+
+
+class MockRdap(_HttpStandIn):
+    """RDAP domain endpoint with latency and 429 rate, plus a matching bootstrap file"""
+    handler = _RdapHandler
+
+    def __init__(self, latency=0.0, rate_limit_rate=0.0):
+        super().__init__()
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+
+    def write_bootstrap(self, path, suffixes=('bench.test',)):
+        """IANA-format bootstrap file pointing the given suffixes at this server"""
+        with open(path, 'w') as f:
+            json.dump({'version': '1.0', 'services': [[list(suffixes), [f"{self.url}/rdap/"]]]}, f)
+        return path
+
+    @staticmethod
+    def write_public_suffix_list(path, suffixes=('bench.test',)):
+        """Public Suffix List with the given suffixes (plus the rules rdap.py checks on load)"""
+        with open(path, 'w') as f:
+            f.write('\n'.join(['com', 'uk', 'co.uk', 'br', 'com.br', *suffixes]) + '\n')
+        return path
+
+
+class StubDnsServer:
+    """UDP resolver answering from the name prefix (see module docstring)"""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((LOOPBACK, 0))
+        self.queries = 0
+
+    @property
+    def port(self):
+        return self.sock.getsockname()[1]
+
+    def _answer(self, query):
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        name = question.name.to_text()
+
+        if name.startswith('nx-'):
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            response.authority.append(dns.rrset.from_text(
+                question.name.parent(), self.ttl, 'IN', 'SOA', 'ns. hostmaster. 1 3600 600 86400 300'
+            ))
+        elif question.rdtype == dns.rdatatype.A:
+            address = UNREACHABLE if name.startswith('refused-') else LOOPBACK
+            response.answer.append(dns.rrset.from_text(question.name, self.ttl, 'IN', 'A', address))
+        return response
+
+    def _serve(self):
+        while True:
+            try:
+                data, peer = self.sock.recvfrom(4096)
+            except OSError:
+                return
+            self.queries += 1
+            try:
+                response = self._answer(dns.message.from_wire(data))
+                self.sock.sendto(response.to_wire(), peer)
+            except Exception as e:
+                logger.debug(f"Stub DNS error: {e}")
+
+    def start(self):
+        threading.Thread(target=self._serve, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.sock.close()
+
+
+def _private_key():
+    return ec.generate_private_key(ec.SECP256R1())
+
+
+def _name(common_name):
+    return x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+
+
+def _certificate(subject, issuer, public_key, signing_key, not_before, not_after, san=None, ca=False):
+    builder = x509.CertificateBuilder()\
+        .subject_name(subject)\
+        .issuer_name(issuer)\
+        .public_key(public_key)\
+        .serial_number(x509.random_serial_number())\
+        .not_valid_before(not_before)\
+        .not_valid_after(not_after)\
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+    if san:
+        builder = builder.add_extension(x509.SubjectAlternativeName([x509.DNSName(n) for n in san]), critical=False)
+    return builder.sign(signing_key, hashes.SHA256())
+
+
+class MockTlsServer:
+    """
+    TLS endpoint on one port that picks a certificate by SNI:
+    valid (signed by a local CA written to ca_file), expired or self-signed.
+    Answers any HTTP request with a 301 redirect.
+    """
+
+    def __init__(self, zone='bench.test'):
+        self.zone = zone
+        self.directory = tempfile.mkdtemp(prefix='gdbchecker-bench-')
+        self.ca_file = os.path.join(self.directory, 'ca.pem')
+        self.contexts = self._build_contexts()
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((LOOPBACK, 0))
+        self.sock.listen(1024)
+        self.handshakes = 0
+
+    @property
+    def port(self):
+        return self.sock.getsockname()[1]
+
+    def _build_contexts(self):
+        now = datetime.utcnow()
+        ca_key = _private_key()
+        ca_cert = _certificate(_name('gdbchecker bench CA'), _name('gdbchecker bench CA'), ca_key.public_key(),
+                               ca_key, now - timedelta(days=1), now + timedelta(days=3650), ca=True)
+        with open(self.ca_file, 'wb') as f:
+            f.write(ca_cert.public_bytes(serialization.Encoding.PEM))
+
+        san = [f'*.{self.zone}', self.zone]
+        variants = {
+            'valid': (now - timedelta(days=1), now + timedelta(days=365), False),
+            'expired': (now - timedelta(days=90), now - timedelta(days=1), False),
+            'selfsigned': (now - timedelta(days=1), now + timedelta(days=365), True),
+        }
+
+        contexts = {}
+        for variant, (not_before, not_after, self_signed) in variants.items():
+            key = _private_key()
+            subject = _name(f'{variant}.{self.zone}')
+            cert = _certificate(subject, subject if self_signed else ca_cert.subject, key.public_key(),
+                                key if self_signed else ca_key, not_before, not_after, san=san)
+            path = os.path.join(self.directory, f'{variant}.pem')
+            with open(path, 'wb') as f:
+                f.write(cert.public_bytes(serialization.Encoding.PEM))
+                f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                          serialization.NoEncryption()))
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(path)
+            contexts[variant] = context
+
+        def select(ssl_socket, server_name, _context):
+            for variant in ('expired', 'selfsigned'):
+                if server_name and server_name.startswith(f'{variant}-'):
+                    ssl_socket.context = contexts[variant]
+
+        contexts['valid'].sni_callback = select
+        return contexts
+
+    def _handle(self, conn):
+        try:
+            conn.settimeout(10)
+            with self.contexts['valid'].wrap_socket(conn, server_side=True) as tls:
+                self.handshakes += 1
+                if tls.recv(4096):
+                    tls.sendall(b"HTTP/1.1 301 Moved Permanently\r\nLocation: https://www."
+                                + self.zone.encode() + b"/\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        except (ssl.SSLError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def start(self):
+        threading.Thread(target=self._serve, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.sock.close()
@@ -0,0 +1,128 @@
+"""Set-based bulk changes to domains (POST /api/domains/bulk)
+
+Each operation costs a fixed number of statements however many domains it
+touches: UPDATE/DELETE ... WHERE over the selection and chunked
+INSERT ... ON CONFLICT for upserts. Deleting domains removes their history,
+cached DNS/TLS/RDAP results, probe schedule and episodes with one DELETE per table
+instead of the ORM's row-by-row cascade. Callers commit, so an operation is all-or-nothing.
+"""
+
+import logging
+from datetime import datetime
+
+from sqlalchemy import and_, delete, func, select
+
+from models import (dialect_insert, Domain, StatusHistory, DomainResolution, TlsProbe, DomainRegistration,
+                    ProbeSchedule, DomainEpisode)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+UPDATABLE_FIELDS = ('project', 'purpose', 'added_by')
+FILTER_FIELDS = ('project', 'purpose', 'added_by', 'current_status', 'ssl_status')
+
+# Tables keyed by domain_id, emptied before the domains themselves
+DEPENDENT_TABLES = (StatusHistory, DomainResolution, TlsProbe, DomainRegistration, ProbeSchedule,
+                    DomainEpisode)
+
+CHUNK_SIZE = 1000
+
+
+def normalize_domain(value):
+    """Host name as stored: lowercase, without scheme or path"""
+    name = str(value).strip().lower().replace('http://', '').replace('https://', '')
+    return name.split('/')[0]
+
+
+def _clean(value):
+    if value is None:
+        return None
+    return str(value).strip() or None
+
+
+def selection(spec):
+    """
+    WHERE clause over domains from {'ids': [...]}, {'domains': [...]} and/or
+    {'where': {field: value}} (null matches unset fields). Raises ValueError.
+    """
+    conditions = []
+    if spec.get('ids') is not None:
+        try:
+            conditions.append(Domain.id.in_([int(i) for i in spec['ids']]))
+        except (TypeError, ValueError):
+            raise ValueError('ids must be a list of integers')
+    if spec.get('domains') is not None:
+        conditions.append(Domain.domain.in_([normalize_domain(name) for name in spec['domains']]))
+    for field, value in (spec.get('where') or {}).items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"where supports: {', '.join(FILTER_FIELDS)}")
+        column = getattr(Domain, field)
+        conditions.append(column.is_(None) if value is None else column == value)
+
+    if not conditions:
+        raise ValueError('Select domains with ids, domains or where')
+    return and_(*conditions)
+
+
+def update_domains(session, condition, values):
+    """Set project/purpose/added_by on the selection. Returns: rows updated"""
+    if not values or set(values) - set(UPDATABLE_FIELDS):
+        raise ValueError(f"set supports: {', '.join(UPDATABLE_FIELDS)}")
+    values = {field: _clean(value) for field, value in values.items()}
+    return session.query(Domain).filter(condition).update(values, synchronize_session=False)
+
+
+def delete_domains(session, condition):
+    """Delete the selection with its history. Returns: {'domains': n, 'history': n}"""
+    ids = select(Domain.id).where(condition)
+    counts = {}
+    for model in DEPENDENT_TABLES:
+        result = session.execute(
+            delete(model).where(model.domain_id.in_(ids)).execution_options(synchronize_session=False)
+        )
+        if model is StatusHistory:
+            counts['history'] = result.rowcount
+    counts['domains'] = session.execute(
+        delete(Domain).where(condition).execution_options(synchronize_session=False)
+    ).rowcount
+    return counts
+
+
+def upsert_domains(session, items, added_by=None):
+    """
+    Add domains (names or {'domain', 'project', 'purpose'}); existing ones get
+    the project/purpose given, omitted or empty fields are kept.
+
+    Returns: {'inserted': n, 'updated': n}
+    """
+    rows = {}
+    for item in items:
+        if not isinstance(item, dict):
+            item = {'domain': item}
+        name = normalize_domain(item.get('domain') or '')
+        if not name:
+            raise ValueError('Every item needs a domain')
+        rows[name] = {'domain': name, 'project': _clean(item.get('project')), 'purpose': _clean(item.get('purpose'))}
+
+    names = list(rows)
+    existing = 0
+    for start in range(0, len(names), CHUNK_SIZE):
+        existing += session.query(func.count(Domain.id))\
+            .filter(Domain.domain.in_(names[start:start + CHUNK_SIZE]))\
+            .scalar()
+
+    table = Domain.__table__
+    insert = dialect_insert(session.get_bind())
+    now = datetime.utcnow()
+    for start in range(0, len(names), CHUNK_SIZE):
+        statement = insert(table).values([
+            dict(rows[name], current_status='pending', autorenew='unknown', added_by=added_by, created_at=now)
+            for name in names[start:start + CHUNK_SIZE]
+        ])
+        statement = statement.on_conflict_do_update(index_elements=['domain'], set_={
+            'project': func.coalesce(statement.excluded.project, table.c.project),
+            'purpose': func.coalesce(statement.excluded.purpose, table.c.purpose),
+        })
+        session.execute(statement)
+
+    return {'inserted': len(names) - existing, 'updated': existing}
@@ -2,13 +2,31 @@
 
 import requests
 import os
+import re
+import sys
 import json
-import ssl
-import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from models import get_session, Domain, StatusHistory
+from types import SimpleNamespace
+from sqlalchemy import func, or_
+from models import get_session, get_engine, Domain, StatusHistory, CheckRun, CheckRunOutlier
 from telegram_notifier import TelegramNotifier
+import events
+import outbox
+import autotune
+from resolver import DnsResolver
+from tls_probe import TlsProber
+from safebrowsing_cache import SafeBrowsingCache
+from http_client import get_client
+from rollups import RollupBatch
+from episodes import EpisodeBatch
+import probes
+from metrics import (CYCLE_DOMAINS, CYCLE_DURATION, CYCLE_THROUGHPUT, QUEUE_DEPTH,
+                     StageTimings, timed, update_pool_metrics)
+import argparse
 import logging
+from urllib.parse import urlsplit
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -17,18 +35,66 @@ logger = logging.getLogger(__name__)
 class DomainChecker:
     def __init__(self):
         self.api_key = os.getenv('GOOGLE_API_KEY')
-        self.api_url = 'https://safebrowsing.googleapis.com/v4/threatMatches:find'
+        self.api_url = os.getenv('SAFEBROWSING_API_URL', 'https://safebrowsing.googleapis.com/v4/threatMatches:find')
+        self.timeout = float(os.getenv('SAFEBROWSING_TIMEOUT', 10))
         self.notifier = TelegramNotifier()
-
-    def check_domain(self, domain):
+        self.resolver = DnsResolver()
+        self.prober = TlsProber()
+        self.cache = SafeBrowsingCache()
+        self.http = get_client()
+        self.destination = urlsplit(self.api_url).netloc
+        # Lookup workers read and write the verdict cache: capped by the DB pool
+        self.tuner = autotune.get_tuner('safebrowsing', int(os.getenv('CHECK_CONCURRENCY', 10)),
+                                        self.timeout, uses_db=True, destination_maximum=self.http.pool_maxsize)
+        self.probes = probes.build_stages(self)
+
+    def check_domain(self, domain, timings=None):
         """
         Check domain using Google Safe Browsing API
-        Returns: 'ok', 'banned', or 'error'
+        Returns: ('ok' or 'banned', details dict) or ('error', message)
+        """
+        urls = [f"http://{domain}", f"https://{domain}"]
+
+        # Answers still within their cache duration don't cost quota
+        verdicts = self.cache.get(urls)
+        missing = [url for url in urls if url not in verdicts]
+
+        if missing:
+            if not self.api_key:
+                logger.error("Google API key not configured")
+                return 'error', 'API key not configured'
+
+            status, result = self._lookup(domain, missing, timings)
+            if status == 'error':
+                return status, result
+
+            self.cache.put(missing, result)
+            for url in missing:
+                matches = [m for m in result if m.get('threat', {}).get('url') == url]
+                verdicts[url] = (
+                    [m.get('threatType', 'UNKNOWN') for m in matches],
+                    matches[0].get('platformType', 'UNKNOWN') if matches else None
+                )
+
+        threat_types = [t for url in urls for t in verdicts[url][0]]
+        details = {'checked_at': datetime.utcnow().isoformat()}
+        if not missing:
+            details['cached'] = True
+
+        # If matches found - domain is banned
+        if threat_types:
+            details['threat_types'] = threat_types
+            details['platform'] = next(verdicts[url][1] for url in urls if verdicts[url][0])
+            return 'banned', details
+
+        # No threats found - domain is OK
+        return 'ok', details
+
+    def _lookup(self, domain, urls, timings=None):
+        """
+        Query threatMatches:find for the given URL expressions
+        Returns: ('ok', matches) or ('error', message)
         """
-        if not self.api_key:
-            logger.error("Google API key not configured")
-            return 'error', 'API key not configured'
-
         # Prepare request payload
         payload = {
             "client": {
@@ -44,35 +110,26 @@ class DomainChecker:
                 ],
                 "platformTypes": ["ANY_PLATFORM"],
                 "threatEntryTypes": ["URL"],
-                "threatEntries": [
-                    {"url": f"http://{domain}"},
-                    {"url": f"https://{domain}"}
-                ]
+                "threatEntries": [{"url": url} for url in urls]
             }
         }
 
+        with self.tuner.slot(self.destination) as slot:
+            return self._request(domain, payload, slot, timings)
+
+    def _request(self, domain, payload, slot, timings=None):
+        """Send one lookup within the tuner's slot, reporting how the API answered"""
         try:
-            response = requests.post(
-                f"{self.api_url}?key={self.api_key}",
-                json=payload,
-                timeout=10
-            )
+            with timed('safebrowsing', timings, domain):
+                response = self.http.post(
+                    f"{self.api_url}?key={self.api_key}",
+                    json=payload,
+                    budget=slot.timeout,
+                    destination='safebrowsing'
+                )
 
             if response.status_code == 200:
-                result = response.json()
-
-                # If matches found - domain is banned
-                if 'matches' in result and len(result['matches']) > 0:
-                    threat_types = [match.get('threatType', 'UNKNOWN') for match in result['matches']]
-                    details = {
-                        'threat_types': threat_types,
-                        'platform': result['matches'][0].get('platformType', 'UNKNOWN'),
-                        'checked_at': datetime.utcnow().isoformat()
-                    }
-                    return 'banned', json.dumps(details)
-                else:
-                    # No threats found - domain is OK
-                    return 'ok', json.dumps({'checked_at': datetime.utcnow().isoformat()})
+                return 'ok', response.json().get('matches', [])
 
             elif response.status_code == 400:
                 logger.error(f"Bad request for domain {domain}: {response.text}")
@@ -80,154 +137,450 @@ class DomainChecker:
 
             elif response.status_code == 429:
                 logger.warning(f"Rate limit exceeded for domain {domain}")
+                slot.outcome = 'overload'
                 return 'error', "Rate limit exceeded"
 
             else:
                 logger.error(f"API error {response.status_code} for domain {domain}: {response.text}")
+                if response.status_code >= 500:
+                    slot.outcome = 'error'
                 return 'error', f"API error: {response.status_code}"
 
         except requests.exceptions.Timeout:
             logger.error(f"Timeout checking domain {domain}")
+            slot.outcome = 'timeout'
             return 'error', "Request timeout"
 
         except requests.exceptions.RequestException as e:
             logger.error(f"Request exception for domain {domain}: {str(e)}")
+            slot.outcome = 'error'
             return 'error', f"Request failed: {str(e)}"
 
         except Exception as e:
             logger.error(f"Unexpected error checking domain {domain}: {str(e)}")
             return 'error', f"Unexpected error: {str(e)}"
 
-    def check_ssl(self, domain):
+    def check_ssl(self, domain, addresses=None):
         """
         Check SSL certificate status
         Returns: 'valid', 'expired', 'invalid', 'missing'
         """
-        try:
-            # Try HTTPS connection
-            context = ssl.create_default_context()
-
-            with socket.create_connection((domain, 443), timeout=10) as sock:
-                with context.wrap_socket(sock, server_hostname=domain) as ssock:
-                    cert = ssock.getpeercert()
-
-                    # Check if certificate is valid
-                    not_after = cert.get('notAfter')
-                    if not_after:
-                        # Parse expiration date
-                        from datetime import datetime
-                        expiry_date = datetime.strptime(not_after, '%b %d %H:%M:%S %Y %Z')
-
-                        if expiry_date < datetime.utcnow():
-                            return 'expired'
-
-                    # Certificate is valid
-                    return 'valid'
-
-        except ssl.SSLError as e:
-            # SSL error - invalid or self-signed certificate
-            logger.warning(f"SSL error for {domain}: {str(e)}")
-            if 'certificate verify failed' in str(e).lower():
-                return 'invalid'
-            return 'invalid'
-
-        except socket.gaierror:
-            # Domain doesn't resolve
-            logger.warning(f"Domain {domain} doesn't resolve")
-            return 'missing'
-
-        except (socket.timeout, ConnectionRefusedError, OSError):
-            # HTTPS not available - try HTTP to check if domain exists
-            try:
-                response = requests.head(f"http://{domain}", timeout=5, allow_redirects=True)
-                # Domain exists but no HTTPS
-                return 'missing'
-            except:
-                # Domain completely unavailable
-                return 'missing'
-
-        except Exception as e:
-            logger.error(f"Unexpected error checking SSL for {domain}: {str(e)}")
-            return 'missing'
+        return self.prober.probe(domain, addresses).ssl_status
+
+    def select_domains(self, session, projects=None, purposes=None, statuses=None, not_checked_since=None,
+                       ids=None, after_id=None):
+        """Domains matching the CLI filters (all domains when none are given)"""
+        query = session.query(Domain)
+        if ids is not None:
+            query = query.filter(Domain.id.in_(ids))
+        if after_id is not None:
+            # Resuming after a checkpoint
+            query = query.filter(Domain.id > after_id)
+        if projects:
+            query = query.filter(Domain.project.in_(projects))
+        if purposes:
+            query = query.filter(Domain.purpose.in_(purposes))
+        if statuses:
+            query = query.filter(Domain.current_status.in_(statuses))
+        if not_checked_since:
+            query = query.filter(or_(Domain.last_check_time.is_(None),
+                                     Domain.last_check_time < not_checked_since))
+        return query.order_by(Domain.id).all()
+
+    def check_all_domains(self, trigger='cli', timings=None, filters=None, concurrency=None,
+                          batch_size=None, notify=True, dry_run=False, on_result=None, stages=None,
+                          report=None, resume_run_id=None):
+        """
+        Check all domains in database (trigger: scheduler, web or cli)
+
+        filters: keyword arguments for select_domains (partial runs)
+        concurrency / batch_size: Safe Browsing worker threads (default: the tuner's
+            maximum; its adaptive limit decides how many look up at once), domains per commit
+        notify: send ban/unban notifications and the status report
+        stages: probe stages run over the selection before the verdicts (default
+            dns and tls); with none, the SSL status stored by the tls stage is kept
+        report: send the status report (default: notify)
+        dry_run: check and report only; domains, history and check_runs are not
+            written and nothing is sent (DNS, TLS and Safe Browsing caches are refreshed)
+        on_result: called with a dict for every checked domain
+        resume_run_id: continue an interrupted run after its checkpoint, with the
+            filters and options it was started with (see resume_interrupted)
+
+        Returns: id of the check_runs record (None for dry runs)
+        """
+        concurrency = int(concurrency or self.tuner.maximum)
+        batch_size = int(batch_size or os.getenv('CHECK_BATCH_SIZE', 100))
+        notify = notify and not dry_run
+        report = notify if report is None else report and not dry_run
+        stages = probes.INLINE_STAGES if stages is None else stages
 
-    def check_all_domains(self):
-        """Check all domains in database"""
         session = get_session()
-        logger.info("Starting domain check cycle...")
+        run = None
+        heartbeat = None
+        timings = timings or StageTimings()
+        previous_seconds = {}
 
         try:
-            domains = session.query(Domain).all()
-            total = len(domains)
-            logger.info(f"Found {total} domains to check")
-
-            checked_count = 0
-            banned_count = 0
-            unbanned_count = 0
-            error_count = 0
-
-            for domain in domains:
-                try:
-                    # Check SafeBrowsing status
-                    status, details = self.check_domain(domain.domain)
-                    old_status = domain.current_status
-
-                    # Check SSL status
-                    ssl_status = self.check_ssl(domain.domain)
-
-                    # Update domain status
-                    domain.current_status = status
-                    domain.ssl_status = ssl_status
-                    domain.last_check_time = datetime.utcnow()
-
-                    # Create history record
-                    history = StatusHistory(
-                        domain_id=domain.id,
-                        status=status,
-                        checked_at=datetime.utcnow(),
-                        details=details
-                    )
-                    session.add(history)
-
-                    # Send notifications on status change
-                    if old_status != status:
-                        if status == 'banned' and old_status != 'banned':
-                            # Domain got banned
-                            self.notifier.send_ban_notification(domain)
+            if resume_run_id is not None:
+                run = session.get(CheckRun, resume_run_id)
+                options = run.run_options()
+                filters = load_filters(options['filters'])
+                notify, report, stages = options['notify'], options['report'], options['stages']
+                dry_run = False
+                previous_seconds = run.stage_totals()
+                domains = self.select_domains(session, after_id=run.last_domain_id, **filters)
+                total = run.total
+                logger.info(f"Resuming check run {run.id}: {len(domains)} of {total} domains left")
+            else:
+                logger.info("Starting domain check cycle...")
+                domains = self.select_domains(session, **(filters or {}))
+                total = len(domains)
+                logger.info(f"Found {total} domains to check" + (" (dry run)" if dry_run else ""))
+
+            # Ban/unban notifications are queued in the outbox for the scheduler's
+            # dispatcher when it listens for transitions; otherwise (SQLite, scheduler
+            # down) sent inline
+            notify_inline = notify and not events.notifier_listening(session)
+
+            if run is not None:
+                run.status = 'running'
+                run.resumed = (run.resumed or 0) + 1
+                run.heartbeat_at = datetime.utcnow()
+                self._publish_run(session, run)
+                session.commit()
+            elif not dry_run:
+                # Progress record, streamed to the dashboard via /api/events. Probe stage
+                # runs (a list of due ids) are not resumable: their domains stay due.
+                resumable = (filters or {}).get('ids') is None
+                run = CheckRun(status='running', trigger=trigger, total=total, started_at=datetime.utcnow(),
+                               heartbeat_at=datetime.utcnow(),
+                               options=dump_options(filters, notify, report, stages) if resumable else None)
+                session.add(run)
+                session.flush()
+                self._publish_run(session, run)
+                session.commit()
+
+            if run is not None:
+                # Tells a restarted scheduler whether this run is still alive
+                heartbeat = RunHeartbeat(run.id).start()
+
+            self.cache.purge_expired()
+
+            # DNS first, so TLS connects go straight to the resolved addresses;
+            # recently verified certificates are skipped
+            context = {'inline': True, 'trigger': trigger}
+            domain_ids = [d.id for d in domains]
+            for name in stages:
+                stage = self.probes[name]
+                stage.run(session, domains, context, timings)
+                if not dry_run:
+                    stage.mark(session, domain_ids)
+                    session.commit()
+            ssl_statuses = context.get('ssl_statuses')
+            verdicts = self.probes['safebrowsing']
+
+            # A resumed run carries on with its counters
+            checked_count, banned_count, unbanned_count, error_count = \
+                (run.checked, run.banned, run.unbanned, run.errors) if resume_run_id is not None else (0, 0, 0, 0)
+            QUEUE_DEPTH.labels('safebrowsing').set(len(domains))
+
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                for start in range(0, len(domains), batch_size):
+                    batch = domains[start:start + batch_size]
+                    # Lookups run in parallel; results are applied in order on this thread
+                    results = pool.map(lambda name: self.check_domain(name, timings), [d.domain for d in batch])
+                    rollup = RollupBatch()
+                    episodes = EpisodeBatch()
+                    applied = []
+
+                    for domain, (status, details) in zip(batch, results):
+                        QUEUE_DEPTH.labels('safebrowsing').dec()
+                        try:
+                            result = CheckResult(
+                                domain=domain,
+                                domain_id=domain.id,
+                                status=status,
+                                details=details,
+                                ssl_status=domain.ssl_status if ssl_statuses is None
+                                else ssl_statuses.get(domain.id, 'missing'),
+                                old_status=domain.current_status,
+                                old_ssl_status=domain.ssl_status,
+                                checked_at=datetime.utcnow()
+                            )
+
+                            if on_result:
+                                on_result({
+                                    'domain': domain.domain,
+                                    'project': domain.project,
+                                    'purpose': domain.purpose,
+                                    'status': status,
+                                    'previous_status': result.old_status,
+                                    'ssl_status': result.ssl_status,
+                                    'details': details,
+                                    'checked_at': result.checked_at.isoformat()
+                                })
+
+                            if dry_run:
+                                transition = result.transition()
+                                banned_count += transition == 'banned'
+                                unbanned_count += transition == 'unbanned'
+                            else:
+                                self._apply_result(session, result, rollup, episodes,
+                                                   notify and not notify_inline)
+                                applied.append(result)
+
+                            if status == 'error':
+                                error_count += 1
+
+                            checked_count += 1
+                            CYCLE_DOMAINS.labels(status).inc()
+
+                        except Exception as e:
+                            logger.error(f"Error processing domain {domain.domain}: {str(e)}")
+                            error_count += 1
+
+                    if dry_run:
+                        continue
+
+                    # Commit once per batch to keep progress without a round trip per domain;
+                    # the batch's last id is the checkpoint a restart resumes after
+                    transitions = [r.transition() for r in applied]
+                    self._update_run(run, checked_count, banned_count + transitions.count('banned'),
+                                     unbanned_count + transitions.count('unbanned'), error_count, timings,
+                                     previous_seconds, last_domain_id=batch[-1].id)
+                    self._publish_run(session, run)
+                    try:
+                        with timed('db_flush', timings):
+                            # Daily rollups, episodes and the schedule move with the batch's history rows
+                            rollup.flush(session)
+                            episodes.flush(session)
+                            verdicts.mark(session, [r.domain_id for r in applied])
+                            session.commit()
+                        saved = applied
+                    except Exception as e:
+                        logger.error(f"Error saving batch of {len(batch)} domains, saving one by one: {str(e)}")
+                        session.rollback()
+                        saved = self._save_one_by_one(session, applied, verdicts, notify and not notify_inline)
+
+                    # Only transitions that reached the database are counted and notified:
+                    # a lost one is found again (and notified) by the next check
+                    for result in saved:
+                        transition = result.transition()
+                        if transition == 'banned':
+                            if notify_inline:
+                                with timings.track('telegram', result.domain.domain):
+                                    self.notifier.send_ban_notification(result.domain)
                             banned_count += 1
-                            logger.warning(f"Domain BANNED: {domain.domain}")
-
-                        elif status == 'ok' and old_status == 'banned':
-                            # Domain got unbanned
-                            self.notifier.send_unban_notification(domain)
+                            logger.warning(f"Domain BANNED: {result.domain.domain}")
+                        elif transition == 'unbanned':
+                            if notify_inline:
+                                with timings.track('telegram', result.domain.domain):
+                                    self.notifier.send_unban_notification(result.domain)
                             unbanned_count += 1
-                            logger.info(f"Domain UNBANNED: {domain.domain}")
+                            logger.info(f"Domain UNBANNED: {result.domain.domain}")
+
+                    if saved is not applied:
+                        try:
+                            self._update_run(run, checked_count, banned_count, unbanned_count, error_count,
+                                             timings, previous_seconds, last_domain_id=batch[-1].id)
+                            session.commit()
+                        except Exception as e:
+                            logger.error(f"Error updating check run {run.id}: {str(e)}")
+                            session.rollback()
+                    update_pool_metrics(get_engine())
+
+            if not dry_run:
+                self._update_run(run, checked_count, banned_count, unbanned_count, error_count, timings,
+                                 previous_seconds)
+                run.status = 'completed'
+                run.finished_at = datetime.utcnow()
+                for stage, domain_name, seconds in timings.outliers():
+                    run.outliers.append(CheckRunOutlier(stage=stage, domain=domain_name, seconds=seconds))
+                self._publish_run(session, run)
+                session.commit()
+
+                duration = (run.finished_at - run.started_at).total_seconds()
+                CYCLE_DURATION.observe(duration)
+                CYCLE_THROUGHPUT.set(checked_count / duration if duration > 0 else 0)
 
-                    if status == 'error':
-                        error_count += 1
+            logger.info(f"Check cycle completed: {checked_count}/{total} domains checked, "
+                       f"{banned_count} newly banned, {unbanned_count} unbanned, {error_count} errors")
+            for host, stats in self.http.stats().items():
+                logger.info(f"HTTP {host}: {stats['requests']} requests, "
+                            f"{stats['reused_connections']} on reused connections, "
+                            f"avg {stats['latency_avg']}s, max {stats['latency_max']}s")
+
+            # Send status report to Telegram after check (once per run, resumed or not)
+            if report and (run is None or run.report_sent_at is None):
+                self.send_status_report(session)
+                if run is not None:
+                    run.report_sent_at = datetime.utcnow()
+                    session.commit()
 
-                    checked_count += 1
+        except Exception as e:
+            logger.error(f"Error in check_all_domains: {str(e)}")
+            session.rollback()
+            self._fail_run(session, run)
 
-                    # Commit after each domain to avoid losing progress
-                    session.commit()
+        finally:
+            if heartbeat is not None:
+                heartbeat.stop()
+            run_id = run.id if run is not None else None
+            session.close()
 
-                except Exception as e:
-                    logger.error(f"Error processing domain {domain.domain}: {str(e)}")
-                    session.rollback()
-                    error_count += 1
+        return run_id
 
-            logger.info(f"Check cycle completed: {checked_count}/{total} domains checked, "
-                       f"{banned_count} newly banned, {unbanned_count} unbanned, {error_count} errors")
+    def resume_interrupted(self, dead_trigger=None):
+        """
+        Deal with runs whose process stopped mid-cycle: the latest resumable one
+        continues after its checkpoint, the others are marked interrupted.
 
-            # Send status report to Telegram after check
-            self.send_status_report(session)
+        A run is dead when it has had no heartbeat for CHECK_RUN_STALE_SECONDS or
+        was started with dead_trigger: the scheduler passes its own trigger at
+        startup, when no run of a previous scheduler process can still be alive.
+        Nothing is resumed while another run is in progress; the dead resumable
+        run waits for the next call.
 
+        Returns: id of the resumed run, or None when there was nothing to resume
+        """
+        stale_before = datetime.utcnow() - timedelta(seconds=float(os.getenv('CHECK_RUN_STALE_SECONDS', 120)))
+        session = get_session()
+        try:
+            dead = func.coalesce(CheckRun.heartbeat_at, CheckRun.updated_at) < stale_before
+            if dead_trigger is not None:
+                dead = or_(dead, CheckRun.trigger == dead_trigger)
+            runs = session.query(CheckRun)\
+                .filter(CheckRun.status == 'running', dead)\
+                .order_by(CheckRun.id.desc())\
+                .all()
+            live = session.query(CheckRun.id)\
+                .filter(CheckRun.status == 'running', ~dead)\
+                .first()
+            resume = next((run for run in runs if run.options is not None), None)
+            if resume is not None and live is not None:
+                logger.info(f"Check run {resume.id} was interrupted, resuming it after run {live.id} finishes")
+            for run in runs:
+                if run is not resume:
+                    logger.warning(f"Check run {run.id} was interrupted at {run.checked}/{run.total} domains")
+                    run.status = 'interrupted'
+                    run.finished_at = run.heartbeat_at or run.updated_at
+                    self._publish_run(session, run)
+            session.commit()
+            resume_id = resume.id if resume is not None else None
         except Exception as e:
-            logger.error(f"Error in check_all_domains: {str(e)}")
+            logger.error(f"Error looking for interrupted check runs: {str(e)}")
             session.rollback()
-
+            return None
         finally:
             session.close()
 
+        if resume_id is None or live is not None:
+            return None
+        return self.check_all_domains(resume_run_id=resume_id)
+
+    def last_full_run(self, session):
+        """Latest completed check of all domains (no filters), or None"""
+        runs = session.query(CheckRun)\
+            .filter(CheckRun.status == 'completed', CheckRun.options.isnot(None))\
+            .order_by(CheckRun.finished_at.desc())\
+            .limit(20)
+        return next((run for run in runs if not any(run.run_options()['filters'].values())), None)
+
+    def _apply_result(self, session, result, rollup, episodes, dispatch):
+        """Write one verdict to the session: domain, history, rollups, episodes and its event"""
+        domain = result.domain
+        domain.current_status = result.status
+        domain.ssl_status = result.ssl_status
+        domain.last_check_time = result.checked_at
+
+        record = result.details if isinstance(result.details, dict) else {'error': result.details}
+        session.add(StatusHistory(
+            domain_id=result.domain_id,
+            status=result.status,
+            checked_at=result.checked_at,
+            details=record,
+            threat_types=record.get('threat_types'),
+            ssl_status=result.ssl_status
+        ))
+        rollup.add(domain.project, domain.purpose, result.checked_at, result.status, result.old_status,
+                   result.ssl_status)
+        episodes.add(result.domain_id, result.checked_at, result.status, result.old_status, result.ssl_status,
+                     result.old_ssl_status, record.get('threat_types'))
+
+        transition = result.transition()
+        if dispatch and transition is not None:
+            # Survives a dispatcher that misses the NOTIFY below
+            outbox.add(session, 'ban' if transition == 'banned' else 'unban', domain, result.checked_at)
+
+        if (result.old_status, result.old_ssl_status) != (result.status, result.ssl_status):
+            events.publish(session, events.DOMAIN_CHANNEL, {
+                'type': 'transition',
+                'id': result.domain_id,
+                'domain': domain.domain,
+                'project': domain.project,
+                'purpose': domain.purpose,
+                'current_status': result.status,
+                'previous_status': result.old_status,
+                'ssl_status': result.ssl_status,
+                'previous_ssl_status': result.old_ssl_status,
+                'last_check_time': result.checked_at.isoformat(),
+                # Whether the dispatcher has a queued notification to send (wakes it up)
+                'notify': dispatch
+            })
+
+    def _save_one_by_one(self, session, results, verdicts, dispatch):
+        """
+        After a failed batch commit: save each verdict in its own transaction so one
+        bad row doesn't lose the batch. Returns: the results that were saved
+        """
+        saved = []
+        for result in results:
+            rollup = RollupBatch()
+            episodes = EpisodeBatch()
+            try:
+                self._apply_result(session, result, rollup, episodes, dispatch)
+                rollup.flush(session)
+                episodes.flush(session)
+                verdicts.mark(session, [result.domain_id])
+                session.commit()
+                saved.append(result)
+            except Exception as e:
+                logger.error(f"Error saving domain {result.domain_id}: {str(e)}")
+                session.rollback()
+        return saved
+
+    def _update_run(self, run, checked, banned, unbanned, errors, timings, previous_seconds=None,
+                    last_domain_id=None):
+        """Copy cycle counters onto the run record (committed with the domain)"""
+        run.checked = checked
+        run.banned = banned
+        run.unbanned = unbanned
+        run.errors = errors
+        totals = timings.totals()
+        for stage, seconds in (previous_seconds or {}).items():
+            totals[stage] = round(totals.get(stage, 0) + seconds, 3)
+        run.stage_seconds = json.dumps(totals)
+        run.updated_at = datetime.utcnow()
+        if last_domain_id is not None:
+            run.last_domain_id = last_domain_id
+
+    def _publish_run(self, session, run):
+        """Progress event for the dashboards, delivered when the batch commits"""
+        events.publish(session, events.RUN_CHANNEL, {'type': 'progress', 'run': run.to_dict()})
+
+    def _fail_run(self, session, run):
+        """Mark the progress record as failed so the dashboard stops waiting"""
+        if run is None:
+            return
+        try:
+            run.status = 'failed'
+            run.finished_at = datetime.utcnow()
+            self._publish_run(session, run)
+            session.commit()
+        except Exception as e:
+            logger.error(f"Error marking check run as failed: {str(e)}")
+            session.rollback()
+
     def send_status_report(self, session):
         """Send status report to Telegram"""
         try:
@@ -312,6 +665,113 @@ class DomainChecker:
             logger.error(f"Error sending status report: {str(e)}")
 
 
+class CheckResult(SimpleNamespace):
+    """A verdict waiting to be written: the domain, its new and previous state"""
+
+    def transition(self):
+        if self.status == 'banned' and self.old_status != 'banned':
+            return 'banned'
+        if self.status == 'ok' and self.old_status == 'banned':
+            return 'unbanned'
+        return None
+
+
+class RunHeartbeat:
+    """Refreshes check_runs.heartbeat_at from a background thread while a run is in progress"""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.interval = float(os.getenv('CHECK_RUN_HEARTBEAT_SECONDS', 30))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f'heartbeat-{self.run_id}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            session = get_session()
+            try:
+                session.query(CheckRun).filter(CheckRun.id == self.run_id)\
+                    .update({'heartbeat_at': datetime.utcnow()}, synchronize_session=False)
+                session.commit()
+            except Exception as e:
+                logger.warning(f"Could not refresh heartbeat of check run {self.run_id}: {str(e)}")
+                session.rollback()
+            finally:
+                session.close()
+
+
+def dump_options(filters, notify, report, stages):
+    """How a run was started, stored to resume it after a restart"""
+    filters = dict(filters or {})
+    if filters.get('not_checked_since'):
+        filters['not_checked_since'] = filters['not_checked_since'].isoformat()
+    return json.dumps({'filters': filters, 'notify': notify, 'report': report, 'stages': list(stages)})
+
+
+def load_filters(filters):
+    filters = dict(filters)
+    if filters.get('not_checked_since'):
+        filters['not_checked_since'] = datetime.fromisoformat(filters['not_checked_since'])
+    return filters
+
+
+def parse_since(value):
+    """'6h', '2d', '30m' (relative to now) or an ISO timestamp, in UTC"""
+    match = re.fullmatch(r'(\d+)([mhd])', value.strip())
+    if match:
+        unit = {'m': 'minutes', 'h': 'hours', 'd': 'days'}[match.group(2)]
+        return datetime.utcnow() - timedelta(**{unit: int(match.group(1))})
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected 30m/6h/2d or an ISO timestamp, got {value!r}")
+
+
+def print_jsonl(result):
+    """Write one result per line to stdout (logs go to stderr)"""
+    sys.stdout.write(json.dumps(result, ensure_ascii=False) + '\n')
+    sys.stdout.flush()
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check domains (all of them unless filtered)')
+    parser.add_argument('--trigger', default='cli', choices=['scheduler', 'web', 'cli'],
+                        help='What started this run (recorded in check_runs)')
+    parser.add_argument('--project', action='append', help='Only this project (repeatable)')
+    parser.add_argument('--purpose', action='append', help='Only this purpose (repeatable)')
+    parser.add_argument('--status', action='append', choices=['ok', 'banned', 'error', 'pending'],
+                        help='Only domains currently in this status (repeatable)')
+    parser.add_argument('--not-checked-since', type=parse_since, metavar='WHEN',
+                        help='Only domains not checked since WHEN: 30m, 6h, 2d or an ISO timestamp (UTC)')
+    parser.add_argument('--concurrency', type=int,
+                        help='Safe Browsing worker threads (default: adaptive, see autotune.py)')
+    parser.add_argument('--batch-size', type=int, help='Domains per database commit (CHECK_BATCH_SIZE, default 100)')
+    parser.add_argument('--no-notify', action='store_true', help='Do not send Telegram notifications or the report')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Check and print results without saving statuses or notifying')
+    parser.add_argument('--jsonl', action='store_true', help='Stream one JSON result per line to stdout')
+    args = parser.parse_args()
+
     checker = DomainChecker()
-    checker.check_all_domains()
+    checker.check_all_domains(
+        trigger=args.trigger,
+        filters={
+            'projects': args.project,
+            'purposes': args.purpose,
+            'statuses': args.status,
+            'not_checked_since': args.not_checked_since
+        },
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        notify=not args.no_notify,
+        dry_run=args.dry_run,
+        on_result=print_jsonl if args.jsonl else None
+    )
@@ -65,6 +65,7 @@ if [ ! -f ".env" ]; then
     echo "  TELEGRAM_BOT_TOKEN=your_telegram_bot_token"
     echo "  TELEGRAM_CHAT_ID=your_telegram_chat_id"
     echo "  CHECK_INTERVAL_HOURS=8"
+    echo "  METRICS_TOKEN=random_token_for_prometheus   # optional, /metrics is local-only without it"
     exit 1
 else
     echo ".env file found"
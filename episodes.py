@@ -0,0 +1,217 @@
+"""Ban and SSL-failure episodes per domain
+
+"How long was this domain banned", "how many times" or "mean time to unban per
+project" would otherwise need a gaps-and-islands scan of status_history. The
+checker (and the tls stage, which updates SSL status on its own schedule) adds
+every result to an EpisodeBatch, which opens and closes rows of domain_episodes
+on transitions only, in the same transaction as the history rows.
+
+    ban  opens on the first banned result, closes on the next ok one
+    ssl  opens when SSL status becomes expired/invalid/missing, closes on valid
+
+Errors (and pending SSL checks) say nothing about the state, so they neither
+open nor close an episode: banned -> error -> banned is one ban.
+
+rebuild() recomputes all episodes from status_history with the same rules,
+for databases that had history before episodes were introduced.
+
+    python episodes.py --rebuild
+"""
+
+import logging
+import argparse
+from collections import defaultdict
+from datetime import datetime
+from statistics import median
+
+from sqlalchemy import bindparam
+
+from models import get_session, dialect_insert, Domain, DomainEpisode, StatusHistory
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+KINDS = ('ban', 'ssl')
+SSL_FAILURES = ('expired', 'invalid', 'missing')
+
+CHUNK_SIZE = 1000
+
+
+def changes(status, previous_status, ssl_status, previous_ssl_status):
+    """Episodes one result opens and closes. Returns: (opened kinds, closed kinds)"""
+    opened, closed = [], []
+    if status == 'banned' and previous_status != 'banned':
+        opened.append('ban')
+    elif status == 'ok' and previous_status != 'ok':
+        # Also after banned -> error -> ok; closing nothing is a no-op
+        closed.append('ban')
+
+    if ssl_status in SSL_FAILURES and previous_ssl_status not in SSL_FAILURES:
+        opened.append('ssl')
+    elif ssl_status == 'valid' and previous_ssl_status != 'valid':
+        closed.append('ssl')
+    return opened, closed
+
+
+class EpisodeBatch:
+    """Episodes opened and closed by a batch of results, written by flush()"""
+
+    def __init__(self):
+        self.opened = []
+        self.closed = []
+
+    def add(self, domain_id, checked_at, status, previous_status, ssl_status, previous_ssl_status,
+            threat_types=None):
+        opened, closed = changes(status, previous_status, ssl_status, previous_ssl_status)
+        for kind in closed:
+            self.closed.append({'b_domain_id': domain_id, 'b_kind': kind, 'b_ended_at': checked_at})
+        for kind in opened:
+            self.opened.append({
+                'domain_id': domain_id,
+                'kind': kind,
+                'started_at': checked_at,
+                'ended_at': None,
+                'threat_types': (threat_types or None) if kind == 'ban' else None,
+                'ssl_status': ssl_status if kind == 'ssl' else None
+            })
+
+    def flush(self, session):
+        """Close and open episodes in the session's transaction and start over"""
+        table = DomainEpisode.__table__
+        if self.closed:
+            session.execute(
+                table.update()
+                .where(table.c.domain_id == bindparam('b_domain_id'), table.c.kind == bindparam('b_kind'),
+                       table.c.ended_at.is_(None))
+                .values(ended_at=bindparam('b_ended_at')),
+                self.closed
+            )
+        insert = dialect_insert(session.get_bind())
+        for start in range(0, len(self.opened), CHUNK_SIZE):
+            # An episode that is already open (e.g. banned -> error -> banned) stays as it is
+            session.execute(insert(table).values(self.opened[start:start + CHUNK_SIZE]).on_conflict_do_nothing(
+                index_elements=['domain_id', 'kind'], index_where=table.c.ended_at.is_(None)
+            ))
+        self.opened = []
+        self.closed = []
+
+
+def rebuild(session):
+    """Recompute every episode from status_history. Returns: episodes written"""
+    rows = session.query(
+        StatusHistory.domain_id, StatusHistory.checked_at, StatusHistory.status,
+        StatusHistory.ssl_status, StatusHistory.threat_types
+    ).order_by(StatusHistory.domain_id, StatusHistory.checked_at, StatusHistory.id).yield_per(CHUNK_SIZE)
+
+    episodes = []
+    domain_id = None
+    previous_status = previous_ssl_status = None
+    current = {}
+    for row in rows:
+        if row.domain_id != domain_id:
+            domain_id, previous_status, previous_ssl_status, current = row.domain_id, None, None, {}
+
+        opened, closed = changes(row.status, previous_status, row.ssl_status, previous_ssl_status)
+        for kind in closed:
+            if kind in current:
+                current.pop(kind)['ended_at'] = row.checked_at
+        for kind in opened:
+            if kind not in current:
+                current[kind] = {
+                    'domain_id': row.domain_id,
+                    'kind': kind,
+                    'started_at': row.checked_at,
+                    'ended_at': None,
+                    'threat_types': (row.threat_types or None) if kind == 'ban' else None,
+                    'ssl_status': row.ssl_status if kind == 'ssl' else None
+                }
+                episodes.append(current[kind])
+
+        previous_status = row.status
+        # History written before SSL status was recorded keeps the last known one
+        previous_ssl_status = row.ssl_status or previous_ssl_status
+
+    session.query(DomainEpisode).delete(synchronize_session=False)
+    table = DomainEpisode.__table__
+    for start in range(0, len(episodes), CHUNK_SIZE):
+        session.execute(table.insert(), episodes[start:start + CHUNK_SIZE])
+    return len(episodes)
+
+
+def domain_summary(episodes, now=None):
+    """{kind: {'count', 'open', 'total_seconds', 'longest_seconds'}} of one domain's episodes"""
+    now = now or datetime.utcnow()
+    summary = {kind: {'count': 0, 'open': False, 'total_seconds': 0, 'longest_seconds': 0} for kind in KINDS}
+    for episode in episodes:
+        stats = summary[episode.kind]
+        seconds = episode.duration(now)
+        stats['count'] += 1
+        stats['open'] = stats['open'] or episode.ended_at is None
+        stats['total_seconds'] += seconds
+        stats['longest_seconds'] = max(stats['longest_seconds'], seconds)
+    return summary
+
+
+def project_report(session, kind='ban', since=None, until=None, projects=None):
+    """
+    Per project: episodes of `kind` started in the period, domains affected,
+    episodes still open and time to recovery (mean, median, longest) of those closed.
+    """
+    query = session.query(Domain.project, DomainEpisode.domain_id, DomainEpisode.started_at,
+                          DomainEpisode.ended_at)\
+        .join(Domain, Domain.id == DomainEpisode.domain_id)\
+        .filter(DomainEpisode.kind == kind)
+    if since:
+        query = query.filter(DomainEpisode.started_at >= since)
+    if until:
+        query = query.filter(DomainEpisode.started_at < until)
+    if projects:
+        query = query.filter(Domain.project.in_(projects))
+
+    per_project = defaultdict(lambda: {'domains': set(), 'open': 0, 'durations': []})
+    for project, domain_id, started_at, ended_at in query:
+        stats = per_project[project or '']
+        stats['domains'].add(domain_id)
+        if ended_at is None:
+            stats['open'] += 1
+        else:
+            stats['durations'].append((ended_at - started_at).total_seconds())
+
+    report = []
+    for project, stats in sorted(per_project.items()):
+        durations = stats['durations']
+        report.append({
+            'project': project or None,
+            'episodes': len(durations) + stats['open'],
+            'domains': len(stats['domains']),
+            'open': stats['open'],
+            'closed': len(durations),
+            'mean_seconds': round(sum(durations) / len(durations)) if durations else None,
+            'median_seconds': round(median(durations)) if durations else None,
+            'longest_seconds': round(max(durations)) if durations else None
+        })
+    return {
+        'kind': kind,
+        'from': since.isoformat() if since else None,
+        'to': until.isoformat() if until else None,
+        'projects': report
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ban and SSL-failure episodes')
+    parser.add_argument('--rebuild', action='store_true', required=True,
+                        help='Recompute all episodes from status history')
+    args = parser.parse_args()
+
+    session = get_session()
+    try:
+        count = rebuild(session)
+        session.commit()
+        logger.info(f"Rebuilt {count} episodes from status history")
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error rebuilding episodes: {str(e)}")
+        raise
+    finally:
+        session.close()
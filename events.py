@@ -0,0 +1,243 @@
+"""PostgreSQL LISTEN/NOTIFY events between the checker, web workers and notifier
+
+Writers publish inside their transaction (pg_notify), so listeners only see
+changes that were committed. Every process that reacts to events holds one
+listening connection on a background thread and fans notifications out to
+in-process subscribers: SSE streams, caches and the Telegram dispatcher.
+
+Channels:
+    gdbchecker_domain   status transitions and added/removed domains
+    gdbchecker_run      check-run progress
+
+Other databases (SQLite in development) have no LISTEN/NOTIFY: publish() is a
+no-op and the listener never connects, so callers fall back to polling.
+"""
+
+import os
+import json
+import time
+import queue
+import select
+import logging
+import threading
+from collections import defaultdict
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from models import get_engine
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DOMAIN_CHANNEL = 'gdbchecker_domain'
+RUN_CHANNEL = 'gdbchecker_run'
+CHANNELS = (DOMAIN_CHANNEL, RUN_CHANNEL)
+
+# Delivered to every subscriber after (re)connecting: events may have been missed
+RESYNC = 'resync'
+
+# NOTIFY payloads are limited to 8000 bytes
+MAX_PAYLOAD_BYTES = 7900
+
+# application_name of the scheduler's Telegram dispatcher connection
+NOTIFIER_APPLICATION = 'gdbchecker-notifier'
+
+
+def enabled(engine=None):
+    engine = engine or get_engine()
+    return engine.dialect.name == 'postgresql' and os.getenv('EVENTS_ENABLED', '1') != '0'
+
+
+def publish(session, channel, payload):
+    """Queue a notification in the session's transaction (sent on commit)"""
+    if not enabled(session.get_bind()):
+        return
+    data = json.dumps(payload, default=str)
+    if len(data.encode()) > MAX_PAYLOAD_BYTES:
+        logger.warning(f"Event on {channel} too large ({len(data)} bytes), not published")
+        return
+    session.execute(text('SELECT pg_notify(:channel, :payload)'), {'channel': channel, 'payload': data})
+
+
+def notifier_listening(session):
+    """Whether a Telegram dispatcher is connected and will act on transitions"""
+    if not enabled(session.get_bind()):
+        return False
+    return session.execute(
+        text('SELECT 1 FROM pg_stat_activity WHERE application_name = :name LIMIT 1'),
+        {'name': NOTIFIER_APPLICATION}
+    ).first() is not None
+
+
+class EventListener:
+    """One LISTEN connection per process, dispatching to subscriber callbacks"""
+
+    def __init__(self, channels=CHANNELS, application_name='gdbchecker-events'):
+        self.channels = channels
+        self.application_name = application_name
+        self.reconnect_seconds = float(os.getenv('EVENTS_RECONNECT_SECONDS', 5))
+        self._subscribers = defaultdict(list)
+        self._lock = threading.Lock()
+        self._connected = threading.Event()
+        self._thread = None
+
+    @property
+    def connected(self):
+        return self._connected.is_set()
+
+    def subscribe(self, channel, callback):
+        """callback(channel, payload) runs on the listener thread; keep it short"""
+        with self._lock:
+            self._subscribers[channel].append(callback)
+
+    def unsubscribe(self, channel, callback):
+        with self._lock:
+            if callback in self._subscribers[channel]:
+                self._subscribers[channel].remove(callback)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='event-listener', daemon=True)
+            self._thread.start()
+        return self
+
+    def _dispatch(self, channel, payload):
+        with self._lock:
+            callbacks = list(self._subscribers[channel])
+        for callback in callbacks:
+            try:
+                callback(channel, payload)
+            except Exception as e:
+                logger.error(f"Event subscriber failed on {channel}: {str(e)}")
+
+    def _run(self):
+        # A dedicated connection outside the pool: it is held for the process lifetime
+        engine = create_engine(get_engine().url, poolclass=NullPool,
+                               connect_args={'application_name': self.application_name})
+        while True:
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                dbapi = connection.driver_connection
+                dbapi.autocommit = True
+                with dbapi.cursor() as cursor:
+                    for channel in self.channels:
+                        cursor.execute(f'LISTEN {channel}')
+                self._connected.set()
+                logger.info(f"Listening on {', '.join(self.channels)}")
+                for channel in self.channels:
+                    self._dispatch(channel, {'type': RESYNC})
+
+                while True:
+                    if select.select([dbapi], [], [], 60) == ([], [], []):
+                        continue
+                    dbapi.poll()
+                    while dbapi.notifies:
+                        notify = dbapi.notifies.pop(0)
+                        try:
+                            payload = json.loads(notify.payload)
+                        except ValueError:
+                            logger.warning(f"Ignoring malformed event on {notify.channel}")
+                            continue
+                        self._dispatch(notify.channel, payload)
+
+            except Exception as e:
+                logger.error(f"Event listener connection lost: {str(e)}")
+            finally:
+                self._connected.clear()
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+            time.sleep(self.reconnect_seconds)
+
+
+class Subscription:
+    """Queue of events for one consumer (e.g. an SSE stream)"""
+
+    def __init__(self, listener, channels=CHANNELS, maxsize=1000):
+        # maxsize=0 for consumers that must not lose events
+        self.listener = listener
+        self.channels = channels
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def _put(self, channel, payload):
+        try:
+            self.queue.put_nowait((channel, payload))
+        except queue.Full:
+            # A stalled consumer loses events and is told to resync instead
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            self.queue.put_nowait((channel, {'type': RESYNC}))
+
+    def __enter__(self):
+        for channel in self.channels:
+            self.listener.subscribe(channel, self._put)
+        return self
+
+    def __exit__(self, *exc):
+        for channel in self.channels:
+            self.listener.unsubscribe(channel, self._put)
+
+    def get(self, timeout):
+        """Returns: (channel, payload) or None after timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventCache:
+    """
+    A computed value kept until an event arrives on one of the channels.
+    Without a live listener nothing is cached.
+    """
+
+    def __init__(self, listener, channels=(DOMAIN_CHANNEL,)):
+        self.listener = listener
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._value = None
+        self._valid = False
+        for channel in channels:
+            listener.subscribe(channel, self.invalidate)
+
+    def invalidate(self, channel=None, payload=None):
+        with self._lock:
+            self._generation += 1
+            self._valid = False
+
+    def get(self, compute):
+        if not self.listener.connected:
+            return compute()
+        with self._lock:
+            if self._valid:
+                return self._value
+            generation = self._generation
+        value = compute()
+        with self._lock:
+            # An event that arrived while computing makes the value stale already
+            if generation == self._generation:
+                self._value = value
+                self._valid = True
+        return value
+
+
+_listener = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def get_listener():
+    """Return this process's listener, started on first use (after a gunicorn fork)"""
+    global _listener, _listener_pid
+    if _listener is None or _listener_pid != os.getpid():
+        with _listener_lock:
+            if _listener is None or _listener_pid != os.getpid():
+                _listener = EventListener()
+                _listener_pid = os.getpid()
+                if enabled():
+                    _listener.start()
+    return _listener
@@ -55,7 +55,7 @@ services:
       - gdbchecker_network
     command: >
       sh -c "python init_db.py &&
-             gunicorn -w 4 -b 0.0.0.0:8080 --access-logfile logs/access.log --error-logfile logs/error.log app:app &
+             gunicorn -w 4 -k gthread --threads 8 -b 0.0.0.0:8080 --access-logfile logs/access.log --error-logfile logs/error.log app:app &
              python scheduler.py"
 
 volumes:
@@ -0,0 +1,10 @@
+"""Gunicorn settings picked up automatically from the working directory"""
+
+import os
+
+
+def child_exit(server, worker):
+    """Drop live gauges of exited workers from the Prometheus multiprocess directory"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
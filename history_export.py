@@ -0,0 +1,200 @@
+"""Streaming export of status_history joined with domain attributes
+
+Rows are read from a server-side cursor (stream_results) in chunks of
+EXPORT_CHUNK_ROWS and encoded chunk by chunk, so memory stays flat however
+many rows are exported and the response starts immediately.
+
+Formats:
+    ndjson    gzip-compressed JSON lines (no extra dependencies)
+    parquet   Parquet, zstd-compressed row group per chunk (needs pyarrow)
+    arrow     Arrow IPC stream, zstd-compressed record batch per chunk (needs pyarrow)
+"""
+
+import os
+import json
+import zlib
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+from models import get_engine, Domain, StatusHistory
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson.gz'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+COLUMNS = ('checked_at', 'domain_id', 'domain', 'project', 'purpose', 'status', 'ssl_status',
+           'threat_types', 'details')
+
+
+class HistoryExport:
+    def __init__(self, engine=None):
+        self.engine = engine or get_engine()
+        self.chunk_rows = int(os.getenv('EXPORT_CHUNK_ROWS', 5000))
+
+    def query(self, since=None, until=None, projects=None, purposes=None, statuses=None, threat_type=None):
+        """History rows in checked_at order (range scan on the checked_at index)"""
+        query = select(
+            StatusHistory.checked_at, StatusHistory.domain_id, Domain.domain, Domain.project,
+            Domain.purpose, StatusHistory.status, StatusHistory.ssl_status, StatusHistory.threat_types,
+            StatusHistory.details
+        ).join(Domain, Domain.id == StatusHistory.domain_id)
+
+        if since:
+            query = query.where(StatusHistory.checked_at >= since)
+        if until:
+            query = query.where(StatusHistory.checked_at < until)
+        if projects:
+            query = query.where(Domain.project.in_(projects))
+        if purposes:
+            query = query.where(Domain.purpose.in_(purposes))
+        if statuses:
+            query = query.where(StatusHistory.status.in_(statuses))
+        if threat_type:
+            query = query.where(StatusHistory.has_threat_type(self.engine.dialect.name, threat_type))
+        return query.order_by(StatusHistory.checked_at, StatusHistory.id)
+
+    def chunks(self, query):
+        """Lists of row tuples; the connection is held only while iterating"""
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, max_row_buffer=self.chunk_rows).execute(query)
+            for partition in result.partitions(self.chunk_rows):
+                yield partition
+
+    def stream(self, fmt, query):
+        """Encoded bytes of the export, produced one chunk at a time"""
+        if fmt == 'ndjson':
+            return self._ndjson(query)
+        if fmt == 'parquet':
+            return self._parquet(query)
+        if fmt == 'arrow':
+            return self._arrow(query)
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+
+    def _ndjson(self, query):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+        rows = 0
+        for chunk in self.chunks(query):
+            lines = []
+            for row in chunk:
+                record = dict(zip(COLUMNS, row))
+                record['checked_at'] = row.checked_at.isoformat() if row.checked_at else None
+                lines.append(json.dumps(record, ensure_ascii=False))
+            rows += len(chunk)
+            data = compressor.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+            if data:
+                yield data
+        yield compressor.flush()
+        logger.info(f"History export (ndjson): {rows} rows")
+
+    def _parquet(self, query):
+        pa, pq = _pyarrow()
+        sink = _Drain()
+        writer = pq.ParquetWriter(sink, _schema(pa), compression='zstd')
+        rows = 0
+        try:
+            for chunk in self.chunks(query):
+                writer.write_table(pa.Table.from_batches([_batch(pa, chunk)]))
+                rows += len(chunk)
+                yield sink.take()
+        finally:
+            writer.close()
+        yield sink.take()
+        logger.info(f"History export (parquet): {rows} rows")
+
+    def _arrow(self, query):
+        pa, _ = _pyarrow()
+        sink = _Drain()
+        writer = pa.ipc.new_stream(sink, _schema(pa), options=pa.ipc.IpcWriteOptions(compression='zstd'))
+        rows = 0
+        try:
+            for chunk in self.chunks(query):
+                writer.write_batch(_batch(pa, chunk))
+                rows += len(chunk)
+                yield sink.take()
+        finally:
+            writer.close()
+        yield sink.take()
+        logger.info(f"History export (arrow): {rows} rows")
+
+
+def available_formats():
+    try:
+        _pyarrow()
+        return list(FORMATS)
+    except ImportError:
+        return ['ndjson']
+
+
+def _pyarrow():
+    import pyarrow
+    import pyarrow.ipc  # noqa: F401
+    import pyarrow.parquet
+    return pyarrow, pyarrow.parquet
+
+
+def _schema(pa):
+    return pa.schema([
+        ('checked_at', pa.timestamp('us')),
+        ('domain_id', pa.int32()),
+        ('domain', pa.string()),
+        ('project', pa.string()),
+        ('purpose', pa.string()),
+        ('status', pa.string()),
+        ('ssl_status', pa.string()),
+        ('threat_types', pa.list_(pa.string())),
+        ('details', pa.string()),  # JSON text
+    ])
+
+
+def _batch(pa, chunk):
+    columns = [list(column) for column in zip(*chunk)] if chunk else [[] for _ in COLUMNS]
+    details = COLUMNS.index('details')
+    columns[details] = [json.dumps(value, ensure_ascii=False) if value is not None else None
+                        for value in columns[details]]
+    return pa.RecordBatch.from_arrays(columns, schema=_schema(pa))
+
+
+class _Drain:
+    """Write-only file object whose contents are handed out as they are written"""
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def parse_time(value):
+    """Date or datetime from a query parameter (ISO 8601) as naive UTC, like the stored times"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
@@ -0,0 +1,185 @@
+"""Shared keep-alive HTTP client for Safe Browsing, RDAP and Telegram"""
+
+import os
+import time
+import logging
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import OUTBOUND_LATENCY, OUTBOUND_REQUESTS
+
+try:
+    import httpx
+    import h2  # noqa: F401 - httpx needs it for HTTP/2
+except ImportError:
+    httpx = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Metric label of a request: a fixed class of destination, never the host itself
+# (probes and RDAP reach arbitrary hosts; per-host detail is in stats())
+DESTINATIONS = ('safebrowsing', 'rdap', 'telegram', 'probe', 'other')
+
+
+class HttpClient:
+    """
+    One pooled client per process. Connections to each host are kept alive and
+    reused (HTTP_POOL_MAXSIZE per host); with HTTP_CLIENT_HTTP2=1 and httpx[http2]
+    installed, requests to a host are multiplexed over HTTP/2 instead.
+
+    Every call gets a timeout budget: the connect timeout is capped by
+    HTTP_CONNECT_TIMEOUT and the read timeout by whatever remains of the budget.
+    Transport errors are raised as requests exceptions for both backends.
+    """
+
+    def __init__(self):
+        self.pool_connections = int(os.getenv('HTTP_POOL_CONNECTIONS', 10))  # hosts kept in the pool
+        self.pool_maxsize = int(os.getenv('HTTP_POOL_MAXSIZE', 20))  # connections per host
+        self.connect_timeout = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+        self.default_budget = float(os.getenv('HTTP_TIMEOUT_BUDGET', 10))
+        self.http2 = os.getenv('HTTP_CLIENT_HTTP2', '').lower() in ('1', 'true', 'yes')
+
+        if self.http2 and httpx is None:
+            logger.warning("HTTP/2 requested but httpx[http2] is not installed, using HTTP/1.1")
+            self.http2 = False
+
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {
+            'requests': 0, 'errors': 0, 'new_connections': 0,
+            'latency_total': 0.0, 'latency_max': 0.0, 'status_codes': defaultdict(int)
+        })
+
+        if self.http2:
+            self._client = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=self.pool_connections * self.pool_maxsize,
+                    max_keepalive_connections=self.pool_connections * self.pool_maxsize
+                )
+            )
+        else:
+            self._session = requests.Session()
+            # pool_block keeps the per-host limit hard instead of opening overflow connections
+            adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                  pool_maxsize=self.pool_maxsize, pool_block=True)
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+            self._adapter = adapter
+
+    def _timeouts(self, budget):
+        budget = budget or self.default_budget
+        connect = min(self.connect_timeout, budget)
+        return connect, max(budget - connect, 0.1)
+
+    def request(self, method, url, budget=None, destination='other', **kwargs):
+        """Send a request within a timeout budget (seconds for the whole call)"""
+        host = urlsplit(url).netloc
+        if destination not in DESTINATIONS:
+            destination = 'other'
+        connect, read = self._timeouts(budget)
+        started = time.monotonic()
+        status_code = None
+
+        try:
+            if self.http2:
+                response = self._request_http2(method, url, host, connect, read, **kwargs)
+            else:
+                response = self._session.request(method, url, timeout=(connect, read), **kwargs)
+            status_code = response.status_code
+            return response
+        finally:
+            self._record(host, destination, time.monotonic() - started, status_code)
+
+    def _request_http2(self, method, url, host, connect, read, **kwargs):
+        def trace(event, info):
+            if event == 'connection.connect_tcp.complete':
+                with self._lock:
+                    self._stats[host]['new_connections'] += 1
+
+        # requests follows redirects by default except for HEAD
+        follow_redirects = kwargs.pop('allow_redirects', method != 'HEAD')
+        try:
+            return self._client.request(
+                method, url,
+                timeout=httpx.Timeout(read, connect=connect),
+                follow_redirects=follow_redirects,
+                extensions={'trace': trace},
+                **kwargs
+            )
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e))
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(str(e))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def _record(self, host, destination, elapsed, status_code):
+        OUTBOUND_REQUESTS.labels(destination, str(status_code or 'error')).inc()
+        OUTBOUND_LATENCY.labels(destination).observe(elapsed)
+
+        with self._lock:
+            stats = self._stats[host]
+            stats['requests'] += 1
+            stats['latency_total'] += elapsed
+            stats['latency_max'] = max(stats['latency_max'], elapsed)
+            if status_code is None:
+                stats['errors'] += 1
+            else:
+                stats['status_codes'][status_code] += 1
+
+    def _pool_connections(self):
+        """New connections opened per host, from the urllib3 connection pools"""
+        opened = {}
+        for key in list(self._adapter.poolmanager.pools.keys()):
+            pool = self._adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            host = pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"
+            opened[host] = opened.get(host, 0) + pool.num_connections
+        return opened
+
+    def stats(self):
+        """Per-host request counts, connection reuse and latency"""
+        opened = {} if self.http2 else self._pool_connections()
+
+        with self._lock:
+            result = {}
+            for host, stats in self._stats.items():
+                new_connections = stats['new_connections'] if self.http2 else opened.get(host, 0)
+                requests_made = stats['requests']
+                result[host] = {
+                    'requests': requests_made,
+                    'errors': stats['errors'],
+                    'new_connections': new_connections,
+                    'reused_connections': max(requests_made - stats['errors'] - new_connections, 0),
+                    'latency_avg': round(stats['latency_total'] / requests_made, 4) if requests_made else 0,
+                    'latency_max': round(stats['latency_max'], 4),
+                    'status_codes': dict(stats['status_codes'])
+                }
+            return result
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide HTTP client"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient()
+    return _client
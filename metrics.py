@@ -0,0 +1,213 @@
+"""Prometheus metrics for the checker, web app and notifier"""
+
+import os
+import time
+import heapq
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+    CONTENT_TYPE_LATEST, generate_latest, start_http_server
+)
+from prometheus_client import multiprocess
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# With PROMETHEUS_MULTIPROC_DIR set (gunicorn workers, scheduler and manual
+# checker runs in one container) every process writes its samples there and
+# any exporter aggregates all of them.
+MULTIPROCESS = bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_LATENCY = Histogram(
+    'gdbchecker_stage_duration_seconds',
+    'Latency of one unit of work in a check stage',
+    ['stage'],  # safebrowsing, dns, tls, db_flush, telegram
+    buckets=LATENCY_BUCKETS
+)
+OUTBOUND_REQUESTS = Counter(
+    'gdbchecker_outbound_requests_total',
+    'Outbound HTTP requests by destination (safebrowsing, rdap, telegram, probe, other) and status code '
+    '(status="error" for transport failures)',
+    ['destination', 'status']
+)
+OUTBOUND_LATENCY = Histogram(
+    'gdbchecker_outbound_request_duration_seconds',
+    'Outbound HTTP request latency by destination',
+    ['destination'],
+    buckets=LATENCY_BUCKETS
+)
+CYCLE_DURATION = Histogram(
+    'gdbchecker_cycle_duration_seconds',
+    'Duration of a full check cycle',
+    buckets=(10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400)
+)
+CYCLE_DOMAINS = Counter(
+    'gdbchecker_cycle_domains_total',
+    'Domains processed by check cycles by SafeBrowsing result',
+    ['status']
+)
+CYCLE_THROUGHPUT = Gauge(
+    'gdbchecker_cycle_throughput_domains_per_second',
+    'Throughput of the last completed check cycle',
+    multiprocess_mode='liveall'
+)
+QUEUE_DEPTH = Gauge(
+    'gdbchecker_queue_depth',
+    'Domains waiting in a check stage',
+    ['stage'],
+    multiprocess_mode='livesum'
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    'gdbchecker_db_pool_checked_out',
+    'Database connections currently checked out of the pool',
+    multiprocess_mode='livesum'
+)
+DB_POOL_SIZE = Gauge(
+    'gdbchecker_db_pool_size',
+    'Database connections held by the pool',
+    multiprocess_mode='livesum'
+)
+WEB_REQUEST_LATENCY = Histogram(
+    'gdbchecker_web_request_duration_seconds',
+    'Web request latency by endpoint',
+    ['endpoint', 'method', 'status'],
+    buckets=LATENCY_BUCKETS
+)
+WEB_REQUEST_QUERIES = Histogram(
+    'gdbchecker_web_request_db_queries',
+    'SQL statements executed per web request by endpoint',
+    ['endpoint'],
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 1000, 5000)
+)
+DB_READ_ROUTE = Counter(
+    'gdbchecker_db_read_route_total',
+    'Read-only web requests by database served (replica or primary fallback)',
+    ['target']
+)
+PROBE_CONCURRENCY_LIMIT = Gauge(
+    'gdbchecker_probe_concurrency_limit',
+    'Current adaptive concurrency limit of an outbound stage',
+    ['stage'],  # dns, tls, safebrowsing, rdap
+    multiprocess_mode='liveall'
+)
+PROBE_TIMEOUT = Gauge(
+    'gdbchecker_probe_timeout_seconds',
+    'Current adaptive request timeout of an outbound stage',
+    ['stage'],
+    multiprocess_mode='liveall'
+)
+
+
+class StageTimings:
+    """Cumulative time per stage for one check cycle, plus its slowest domains"""
+
+    def __init__(self, outlier_limit=None, outlier_min_seconds=None, keep_samples=False):
+        self.outlier_limit = int(outlier_limit or os.getenv('CHECK_OUTLIER_LIMIT', 10))
+        self.outlier_min_seconds = float(outlier_min_seconds or os.getenv('CHECK_OUTLIER_MIN_SECONDS', 1))
+        self.keep_samples = keep_samples  # every duration, for percentiles (benchmarks)
+        self._lock = threading.Lock()
+        self._totals = defaultdict(float)
+        self._samples = defaultdict(list)
+        self._slowest = defaultdict(list)  # stage -> min-heap of (seconds, domain)
+
+    def add(self, stage, seconds, domain=None):
+        with self._lock:
+            self._totals[stage] += seconds
+            if self.keep_samples:
+                self._samples[stage].append(seconds)
+            if domain is None or seconds < self.outlier_min_seconds:
+                return
+            heap = self._slowest[stage]
+            if len(heap) < self.outlier_limit:
+                heapq.heappush(heap, (seconds, domain))
+            elif seconds > heap[0][0]:
+                heapq.heapreplace(heap, (seconds, domain))
+
+    @contextmanager
+    def track(self, stage, domain=None):
+        """Add the duration of the wrapped block without observing the histogram"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started, domain)
+
+    def totals(self):
+        with self._lock:
+            return {stage: round(seconds, 3) for stage, seconds in self._totals.items()}
+
+    def percentiles(self, stage, points=(50, 99)):
+        """Nearest-rank percentiles of a stage's samples (requires keep_samples)"""
+        with self._lock:
+            samples = sorted(self._samples.get(stage, []))
+        if not samples:
+            return {}
+        return {
+            f'p{point}': samples[min(len(samples) - 1, max(0, int(round(point / 100 * len(samples))) - 1))]
+            for point in points
+        }
+
+    def counts(self):
+        with self._lock:
+            return {stage: len(samples) for stage, samples in self._samples.items()}
+
+    def outliers(self):
+        """Returns: [(stage, domain, seconds)], slowest first within each stage"""
+        with self._lock:
+            return [
+                (stage, domain, seconds)
+                for stage, heap in self._slowest.items()
+                for seconds, domain in sorted(heap, reverse=True)
+            ]
+
+
+@contextmanager
+def timed(stage, timings=None, domain=None):
+    """
+    Observe the duration of the wrapped block in the stage latency histogram
+    and, when given, add it to a cycle's StageTimings
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_LATENCY.labels(stage).observe(elapsed)
+        if timings is not None:
+            timings.add(stage, elapsed, domain)
+
+
+def update_pool_metrics(engine):
+    """Sample connection pool usage (pools without counters, e.g. SQLite, are skipped)"""
+    pool = engine.pool
+    if hasattr(pool, 'checkedout'):
+        DB_POOL_CHECKED_OUT.set(pool.checkedout())
+    if hasattr(pool, 'checkedin') and hasattr(pool, 'checkedout'):
+        DB_POOL_SIZE.set(pool.checkedin() + pool.checkedout())
+
+
+def registry():
+    """Registry to export: all processes in multiprocess mode, this process otherwise"""
+    if MULTIPROCESS:
+        aggregated = CollectorRegistry()
+        multiprocess.MultiProcessCollector(aggregated)
+        return aggregated
+    return REGISTRY
+
+
+def render():
+    """Return (body, content_type) for a /metrics response"""
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port=None):
+    """Serve /metrics from a background thread (scheduler / worker processes)"""
+    port = int(port or os.getenv('METRICS_PORT', 9100))
+    start_http_server(port, registry=registry())
+    logger.info(f"Metrics exporter listening on port {port}")
@@ -0,0 +1,136 @@
+"""Versioned schema migrations, applied at startup by init_db.py
+
+create_all only creates missing tables, so columns and indexes added to
+existing tables reach deployed databases through the steps below. Every
+statement is idempotent (IF [NOT] EXISTS): a fresh database already built by
+create_all just records the versions.
+
+To change the schema, update models.py and append a step here; never edit a
+step that has been released.
+"""
+
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import text
+
+from models import SchemaMigration
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+Migration = namedtuple('Migration', ['version', 'name', 'statements'])
+
+MIGRATIONS = [
+    Migration(1, 'columns and indexes added since the initial schema', [
+        'ALTER TABLE check_runs ADD COLUMN IF NOT EXISTS "trigger" VARCHAR(20)',
+        'ALTER TABLE check_runs ADD COLUMN IF NOT EXISTS stage_seconds TEXT',
+        'CREATE INDEX IF NOT EXISTS ix_domains_last_check_time ON domains (last_check_time)',
+    ]),
+    Migration(2, 'composite and partial indexes for dashboard, report and history queries', [
+        # Status cards, banned lists and per-project filters
+        'CREATE INDEX IF NOT EXISTS ix_domains_status_project ON domains (current_status, project)',
+        'CREATE INDEX IF NOT EXISTS ix_domains_project ON domains (project)',
+        # Domain page: latest history of one domain
+        'CREATE INDEX IF NOT EXISTS ix_status_history_domain_checked ON status_history (domain_id, checked_at)',
+        # Status report: last ban of a domain within 24 hours
+        'CREATE INDEX IF NOT EXISTS ix_status_history_domain_status_checked '
+        'ON status_history (domain_id, status, checked_at)',
+        # Recent bans across the fleet; bans are a small share of history
+        "CREATE INDEX IF NOT EXISTS ix_status_history_banned ON status_history (checked_at) "
+        "WHERE status = 'banned'",
+        # Covered by the composites above
+        'DROP INDEX IF EXISTS ix_status_history_domain_id',
+    ]),
+    Migration(3, 'trigram indexes for domain, project and purpose search', [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        'CREATE INDEX IF NOT EXISTS ix_domains_domain_trgm ON domains USING gin (domain gin_trgm_ops)',
+        'CREATE INDEX IF NOT EXISTS ix_domains_project_trgm ON domains USING gin (project gin_trgm_ops)',
+        'CREATE INDEX IF NOT EXISTS ix_domains_purpose_trgm ON domains USING gin (purpose gin_trgm_ops)',
+    ]),
+    Migration(4, 'HTTP reachability and timing of the TLS probe', [
+        'ALTER TABLE tls_probes ADD COLUMN IF NOT EXISTS http_status INTEGER',
+        'ALTER TABLE tls_probes ADD COLUMN IF NOT EXISTS http_location VARCHAR(2048)',
+        'ALTER TABLE tls_probes ADD COLUMN IF NOT EXISTS http_scheme VARCHAR(10)',
+        'ALTER TABLE tls_probes ADD COLUMN IF NOT EXISTS connect_seconds DOUBLE PRECISION',
+        'ALTER TABLE tls_probes ADD COLUMN IF NOT EXISTS handshake_seconds DOUBLE PRECISION',
+        'ALTER TABLE tls_probes ADD COLUMN IF NOT EXISTS response_seconds DOUBLE PRECISION',
+    ]),
+    Migration(5, 'JSONB history details, indexed threat types and SSL status in history', [
+        # Rewrites status_history under an exclusive lock; run in a maintenance window
+        # on large tables. Non-JSON details (error messages) become {"error": ...}
+        """DO $$
+        BEGIN
+            IF (SELECT data_type FROM information_schema.columns
+                WHERE table_name = 'status_history' AND column_name = 'details') = 'text' THEN
+                ALTER TABLE status_history ALTER COLUMN details TYPE JSONB USING (
+                    CASE
+                        WHEN details IS NULL OR details = '' THEN NULL
+                        WHEN left(details, 1) = '{' THEN details::jsonb
+                        ELSE jsonb_build_object('error', details)
+                    END
+                );
+            END IF;
+        END $$""",
+        'ALTER TABLE status_history ADD COLUMN IF NOT EXISTS threat_types TEXT[]',
+        'ALTER TABLE status_history ADD COLUMN IF NOT EXISTS ssl_status VARCHAR(50)',
+        # Only banned results carry threat types (served by ix_status_history_banned)
+        "UPDATE status_history SET threat_types = ARRAY(SELECT jsonb_array_elements_text(details -> 'threat_types')) "
+        "WHERE status = 'banned' AND threat_types IS NULL AND jsonb_typeof(details -> 'threat_types') = 'array'",
+        'CREATE INDEX IF NOT EXISTS ix_status_history_threat_types ON status_history USING gin (threat_types)',
+    ]),
+    Migration(6, 'check run checkpoints and heartbeats', [
+        'ALTER TABLE check_runs ADD COLUMN IF NOT EXISTS last_domain_id INTEGER',
+        'ALTER TABLE check_runs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP WITHOUT TIME ZONE',
+        'ALTER TABLE check_runs ADD COLUMN IF NOT EXISTS options TEXT',
+        'ALTER TABLE check_runs ADD COLUMN IF NOT EXISTS resumed INTEGER DEFAULT 0',
+        'ALTER TABLE check_runs ADD COLUMN IF NOT EXISTS report_sent_at TIMESTAMP WITHOUT TIME ZONE',
+    ]),
+]
+
+# pg_advisory_xact_lock key, so concurrent starts don't migrate twice
+MIGRATION_LOCK_ID = 7305001
+
+
+def run_migrations(engine):
+    """Apply pending migrations, one transaction per version"""
+    postgres = engine.dialect.name == 'postgresql'
+    SchemaMigration.__table__.create(engine, checkfirst=True)
+
+    for migration in MIGRATIONS:
+        with engine.begin() as conn:
+            if postgres:
+                conn.execute(text('SELECT pg_advisory_xact_lock(:id)'), {'id': MIGRATION_LOCK_ID})
+
+            applied = conn.execute(
+                text('SELECT 1 FROM schema_migrations WHERE version = :version'),
+                {'version': migration.version}
+            ).first()
+            if applied:
+                continue
+
+            if postgres:
+                for statement in migration.statements:
+                    conn.execute(text(statement))
+            else:
+                # Development databases (SQLite) are built by create_all from the models
+                logger.info(f"Skipping SQL of migration {migration.version} on {engine.dialect.name}")
+
+            conn.execute(SchemaMigration.__table__.insert(), {
+                'version': migration.version, 'name': migration.name, 'applied_at': datetime.utcnow()
+            })
+            logger.info(f"Applied migration {migration.version}: {migration.name}")
+
+
+def current_version(engine):
+    with engine.connect() as conn:
+        return conn.execute(text('SELECT MAX(version) FROM schema_migrations')).scalar() or 0
+
+
+if __name__ == '__main__':
+    from models import get_engine
+
+    engine = get_engine()
+    run_migrations(engine)
+    print(f"Schema version: {current_version(engine)}")
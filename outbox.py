@@ -0,0 +1,77 @@
+"""Outbox of ban/unban notifications left to the scheduler's dispatcher
+
+A NOTIFY is lost when the dispatcher's LISTEN connection is down, so a checker
+that leaves notifications to the dispatcher also commits a notification_outbox
+row with the transition. The dispatcher sends pending rows when a transition
+is published, after every (re)connect and on its idle timeout, and deletes
+each row once Telegram accepted it. A failed send is retried up to
+NOTIFY_OUTBOX_MAX_ATTEMPTS times.
+"""
+
+import os
+import logging
+from types import SimpleNamespace
+
+from models import get_session, NotificationOutbox
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+KINDS = ('ban', 'unban')
+
+BATCH_SIZE = 100
+
+
+def add(session, kind, domain, checked_at):
+    """Queue a notification in the session's transaction (committed with the transition)"""
+    session.add(NotificationOutbox(kind=kind, domain_id=domain.id, domain=domain.domain,
+                                   project=domain.project, purpose=domain.purpose, checked_at=checked_at))
+
+
+def deliver(notifier):
+    """Send pending notifications in order. Returns: number sent"""
+    max_attempts = int(os.getenv('NOTIFY_OUTBOX_MAX_ATTEMPTS', 5))
+    sent = 0
+    session = get_session()
+    try:
+        while True:
+            # SKIP LOCKED: a second dispatcher never sends the same row
+            rows = session.query(NotificationOutbox)\
+                .order_by(NotificationOutbox.id)\
+                .limit(BATCH_SIZE)\
+                .with_for_update(skip_locked=True)\
+                .all()
+            if not rows:
+                return sent
+
+            failed = False
+            for row in rows:
+                domain = SimpleNamespace(domain=row.domain, project=row.project, purpose=row.purpose)
+                if row.kind == 'ban':
+                    ok = notifier.send_ban_notification(domain, row.checked_at)
+                else:
+                    ok = notifier.send_unban_notification(domain, row.checked_at)
+
+                if ok or not notifier.configured:
+                    session.delete(row)
+                    sent += ok
+                    continue
+                row.attempts += 1
+                if row.attempts >= max_attempts:
+                    logger.error(f"Giving up on {row.kind} notification for {row.domain} "
+                                 f"after {row.attempts} attempts")
+                    session.delete(row)
+                else:
+                    # Telegram is failing: stop here and retry on the next wake-up
+                    failed = True
+                    break
+            session.commit()
+            if failed:
+                return sent
+
+    except Exception as e:
+        logger.error(f"Error delivering queued notifications: {str(e)}")
+        session.rollback()
+        return sent
+    finally:
+        session.close()
@@ -0,0 +1,338 @@
+"""Probe stages and their per-domain schedule
+
+Every check is a registered stage fed from the same list of domains:
+
+    dns           A/AAAA records                  -> domain_resolutions
+    tls           certificate, then HEAD / over   -> tls_probes, domains.ssl_status
+                  the same connection (HTTP)
+    safebrowsing  Safe Browsing verdict           -> domains.current_status, status_history
+    registry      RDAP expiry and autorenew       -> domain_registrations, domains.expire_date
+
+A stage has its own interval (<STAGE>_INTERVAL_HOURS, 0 disables it), worker
+pool and request timeout (adapted to the network by autotune.py). probe_schedule records when each (domain, stage)
+pair is due next. The scheduler's tick starts every stage with due domains on
+its own thread, so a slow TLS run doesn't hold back Safe Browsing verdicts and
+cheap stages can run hourly while expensive ones run daily.
+
+A full check (checker.py, "Проверить сейчас") runs dns, tls and safebrowsing
+over its selection in one pass and resets their schedule.
+
+    python probes.py                  # due domains per stage
+    python probes.py --run tls        # run one stage over its due domains
+    python probes.py --run tls --all  # ... over all domains
+"""
+
+import os
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_
+
+from models import get_session, dialect_insert, Domain, DomainResolution, DomainRegistration, ProbeSchedule
+from episodes import EpisodeBatch
+from rdap import RdapCollector, prepare_bootstrap
+from resolver import Resolution
+import events
+from metrics import StageTimings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STAGES = {}
+
+# Run by a full check before the Safe Browsing verdicts, in this order
+INLINE_STAGES = ('dns', 'tls')
+
+CHUNK_SIZE = 1000
+
+
+def register(cls):
+    """Class decorator adding a stage to the pipeline (in definition order)"""
+    STAGES[cls.name] = cls
+    return cls
+
+
+class ProbeStage:
+    """
+    One kind of check. run() probes the given domains and stores its results;
+    `context` carries results between stages of one pass (e.g. DNS answers to TLS).
+    """
+
+    name = None
+    interval_env = None
+    default_interval_hours = None  # None: CHECK_INTERVAL_HOURS
+
+    # Stages that record their schedule as they commit (per batch) instead of after run()
+    marks_itself = False
+
+    def __init__(self, checker):
+        self.checker = checker
+        default = self.default_interval_hours or os.getenv('CHECK_INTERVAL_HOURS', 8)
+        hours = float(os.getenv(self.interval_env) or default)
+        self.interval = timedelta(hours=hours) if hours > 0 else None
+
+    @property
+    def enabled(self):
+        return self.interval is not None
+
+    @property
+    def tuner(self):
+        """autotune.StageTuner of the stage's outbound requests"""
+        raise NotImplementedError
+
+    @property
+    def concurrency(self):
+        return self.tuner.limit
+
+    @property
+    def timeout(self):
+        return round(self.tuner.timeout(), 2)
+
+    def run(self, session, domains, context, timings=None):
+        raise NotImplementedError
+
+    def mark(self, session, domain_ids, now=None, due_at=None):
+        """
+        Record a run of this stage for the domains; due again after the interval,
+        or earlier for domains in due_at ({domain_id: datetime})
+        """
+        if not domain_ids or not self.enabled:
+            return
+        now = now or datetime.utcnow()
+        due_at = due_at or {}
+        table = ProbeSchedule.__table__
+        insert = dialect_insert(session.get_bind())
+        for start in range(0, len(domain_ids), CHUNK_SIZE):
+            statement = insert(table).values([
+                {'domain_id': domain_id, 'stage': self.name, 'last_run_at': now,
+                 'next_run_at': min(now + self.interval, due_at.get(domain_id) or now + self.interval)}
+                for domain_id in domain_ids[start:start + CHUNK_SIZE]
+            ])
+            session.execute(statement.on_conflict_do_update(
+                index_elements=['domain_id', 'stage'],
+                set_={'last_run_at': statement.excluded.last_run_at, 'next_run_at': statement.excluded.next_run_at}
+            ))
+
+
+@register
+class DnsStage(ProbeStage):
+    name = 'dns'
+    interval_env = 'DNS_INTERVAL_HOURS'
+    default_interval_hours = 1
+
+    @property
+    def tuner(self):
+        return self.checker.resolver.tuner
+
+    def run(self, session, domains, context, timings=None):
+        context['resolutions'] = self.checker.resolver.resolve_all(session, domains, timings)
+
+
+@register
+class TlsStage(ProbeStage):
+    name = 'tls'
+    interval_env = 'TLS_INTERVAL_HOURS'
+
+    @property
+    def tuner(self):
+        return self.checker.prober.tuner
+
+    def run(self, session, domains, context, timings=None):
+        resolutions = context.get('resolutions')
+        if resolutions is None:
+            # Scheduled on its own: connect to the addresses the dns stage stored last
+            resolutions = {
+                row.domain_id: Resolution(row.status, row.address_list(), row.ttl, row.error)
+                for row in session.query(DomainResolution)
+                .filter(DomainResolution.domain_id.in_([d.id for d in domains]))
+            }
+        statuses = self.checker.prober.probe_all(session, domains, resolutions, timings)
+        context['ssl_statuses'] = statuses
+        if not context.get('inline'):
+            # A full check stores SSL status together with the verdict
+            self._update_domains(session, statuses)
+
+    def _update_domains(self, session, statuses):
+        # probe_all committed: reload the domains in one query rather than one per object
+        domains = session.query(Domain).filter(Domain.id.in_(list(statuses))).all()
+        checked_at = datetime.utcnow()
+        episodes = EpisodeBatch()
+        for domain in domains:
+            ssl_status = statuses[domain.id]
+            if domain.ssl_status == ssl_status:
+                continue
+            events.publish(session, events.DOMAIN_CHANNEL, {
+                'type': 'transition',
+                'id': domain.id,
+                'domain': domain.domain,
+                'project': domain.project,
+                'purpose': domain.purpose,
+                'current_status': domain.current_status,
+                'previous_status': domain.current_status,
+                'ssl_status': ssl_status,
+                'previous_ssl_status': domain.ssl_status,
+                'last_check_time': checked_at.isoformat(),
+                'notify': False
+            })
+            episodes.add(domain.id, checked_at, domain.current_status, domain.current_status,
+                         ssl_status, domain.ssl_status)
+            domain.ssl_status = ssl_status
+        episodes.flush(session)
+        session.commit()
+
+
+@register
+class SafeBrowsingStage(ProbeStage):
+    name = 'safebrowsing'
+    interval_env = 'SAFEBROWSING_INTERVAL_HOURS'
+    marks_itself = True
+
+    @property
+    def tuner(self):
+        return self.checker.tuner
+
+    def run(self, session, domains, context, timings=None):
+        # Verdicts are written by the checker: history, rollups, events and a check_runs record.
+        # The status report is sent on its own schedule, not after every tick.
+        self.checker.check_all_domains(
+            trigger=context.get('trigger', 'scheduler'),
+            timings=timings,
+            filters={'ids': [d.id for d in domains]},
+            stages=(),
+            report=False
+        )
+
+
+@register
+class RegistryStage(ProbeStage):
+    name = 'registry'
+    interval_env = 'RDAP_INTERVAL_HOURS'
+    default_interval_hours = 24
+    # Failed and rate-limited names are due again before the interval
+    marks_itself = True
+
+    def __init__(self, checker):
+        super().__init__(checker)
+        self.collector = RdapCollector()
+
+    @property
+    def tuner(self):
+        return self.collector.tuner
+
+    def run(self, session, domains, context, timings=None):
+        if not prepare_bootstrap(self.collector):
+            # Not marked as run: retried on the next tick
+            raise RuntimeError('RDAP bootstrap file not available')
+        # Registrations are cached until close to expiry: most due domains cost no query
+        now = datetime.utcnow()
+        domain_ids = [d.id for d in domains]
+        self.collector.collect(session, domains, timings=timings)
+
+        # A result that is not final (rate_limited, error) stays due at its next_check_at
+        due_at = {}
+        for start in range(0, len(domain_ids), CHUNK_SIZE):
+            due_at.update(session.query(DomainRegistration.domain_id, DomainRegistration.next_check_at)
+                          .filter(DomainRegistration.domain_id.in_(domain_ids[start:start + CHUNK_SIZE])))
+        self.mark(session, domain_ids, now, due_at)
+        session.commit()
+
+
+def build_stages(checker):
+    return {name: cls(checker) for name, cls in STAGES.items()}
+
+
+def _due(query, stage, now=None):
+    """Domains without a schedule row for the stage or whose row is due"""
+    now = now or datetime.utcnow()
+    return query\
+        .outerjoin(ProbeSchedule, and_(ProbeSchedule.domain_id == Domain.id, ProbeSchedule.stage == stage))\
+        .filter(or_(ProbeSchedule.next_run_at.is_(None), ProbeSchedule.next_run_at <= now))
+
+
+def due_domains(session, stage, now=None):
+    return _due(session.query(Domain), stage, now).order_by(Domain.id).all()
+
+
+def due_counts(session, now=None):
+    """{stage: number of due domains}"""
+    return {stage: _due(session.query(func.count(Domain.id)), stage, now).scalar() for stage in STAGES}
+
+
+class ProbePipeline:
+    """Runs each stage over its due domains, one thread and worker pool per stage"""
+
+    def __init__(self, checker=None):
+        if checker is None:
+            from checker import DomainChecker
+            checker = DomainChecker()
+        self.checker = checker
+        self.stages = checker.probes
+        self._locks = {name: threading.Lock() for name in self.stages}
+
+    def run_stage(self, name, all_domains=False, trigger='scheduler'):
+        """
+        Run one stage now; skipped while a previous run of it is still going.
+        Returns: number of domains probed (None when skipped or failed)
+        """
+        stage = self.stages[name]
+        if not self._locks[name].acquire(blocking=False):
+            logger.info(f"Stage {name} is still running, skipped this tick")
+            return None
+
+        session = get_session()
+        try:
+            domains = session.query(Domain).order_by(Domain.id).all() if all_domains \
+                else due_domains(session, name)
+            if not domains:
+                return 0
+            # Read before the stage commits: committed objects reload attribute by attribute
+            domain_ids = [d.id for d in domains]
+            logger.info(f"Stage {name}: {len(domain_ids)} domains due "
+                        f"(concurrency {stage.concurrency}, timeout {stage.timeout}s)")
+
+            timings = StageTimings()
+            stage.run(session, domains, {'trigger': trigger}, timings)
+            if not stage.marks_itself:
+                stage.mark(session, domain_ids)
+                session.commit()
+            logger.info(f"Stage {name} completed: {len(domain_ids)} domains, {timings.totals()}")
+            return len(domain_ids)
+
+        except Exception as e:
+            logger.error(f"Error in probe stage {name}: {str(e)}")
+            session.rollback()
+            return None
+
+        finally:
+            session.close()
+            self._locks[name].release()
+
+    def run_due(self):
+        """Scheduler tick: start every enabled stage that isn't running yet"""
+        threads = []
+        for name, stage in self.stages.items():
+            if not stage.enabled or self._locks[name].locked():
+                continue
+            thread = threading.Thread(target=self.run_stage, args=(name,), name=f'probe-{name}', daemon=True)
+            thread.start()
+            threads.append(thread)
+        return threads
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Probe stages: due domains or run one stage now')
+    parser.add_argument('--run', choices=list(STAGES), help='Run this stage over its due domains')
+    parser.add_argument('--all', action='store_true', help='With --run: all domains, due or not')
+    args = parser.parse_args()
+
+    if args.run:
+        ProbePipeline().run_stage(args.run, all_domains=args.all, trigger='cli')
+    else:
+        session = get_session()
+        try:
+            for stage, count in due_counts(session).items():
+                print(f"{stage}: {count} due")
+        finally:
+            session.close()
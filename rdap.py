@@ -0,0 +1,533 @@
+"""RDAP collection stage: registration expiry and autorenew per domain"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import requests
+from collections import namedtuple, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import update
+
+from models import get_session, Domain, DomainRegistration
+from http_client import get_client
+from metrics import QUEUE_DEPTH, timed
+import autotune
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IANA_BOOTSTRAP_URL = 'https://data.iana.org/rdap/dns.json'
+DEFAULT_BOOTSTRAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rdap_bootstrap.json')
+PUBLIC_SUFFIX_LIST_URL = 'https://publicsuffix.org/list/public_suffix_list.dat'
+DEFAULT_PSL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public_suffix_list.dat')
+
+# A downloaded Public Suffix List must give these registrable names before it
+# replaces the local copy (None: the name is a public suffix itself)
+PSL_CHECKS = {
+    'example.com': 'example.com',
+    'www.example.com': 'example.com',
+    'example.co.uk': 'example.co.uk',
+    'shop.example.co.uk': 'example.co.uk',
+    'loja.com.br': 'loja.com.br',
+    'co.uk': None,
+}
+
+# RDAP status values (RFC 8056 mapping of EPP statuses) that tell whether the
+# registration will renew by itself
+AUTORENEW_ENABLED = {'auto renew period'}
+AUTORENEW_DISABLED = {'client renew prohibited', 'server renew prohibited', 'pending delete', 'redemption period'}
+
+CHUNK_SIZE = 1000
+
+# status: ok, not_found, unsupported, rate_limited, error
+RdapResult = namedtuple('RdapResult', [
+    'status', 'expires_at', 'registered_at', 'statuses', 'autorenew', 'error', 'retry_after'
+])
+
+
+def parse_rdap_time(value):
+    """RDAP timestamps (RFC 3339) as naive UTC"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def autorenew_from_statuses(statuses):
+    if AUTORENEW_ENABLED & set(statuses):
+        return 'enabled'
+    if AUTORENEW_DISABLED & set(statuses):
+        return 'disabled'
+    return 'unknown'
+
+
+def parse_rdap(data):
+    """Extract expiry, registration date and statuses from an RDAP domain object"""
+    events = {event.get('eventAction'): event.get('eventDate') for event in data.get('events', [])}
+    statuses = [status.lower() for status in data.get('status', [])]
+    return RdapResult(
+        status='ok',
+        expires_at=parse_rdap_time(events.get('expiration')),
+        registered_at=parse_rdap_time(events.get('registration')),
+        statuses=statuses,
+        autorenew=autorenew_from_statuses(statuses),
+        error=None,
+        retry_after=None
+    )
+
+
+class RdapBootstrap:
+    """IANA DNS bootstrap registry: TLD -> RDAP base URL (RFC 9224)"""
+
+    def __init__(self, services):
+        self.services = services
+
+    @classmethod
+    def from_json(cls, data):
+        services = {}
+        for tlds, urls in data.get('services', []):
+            # Prefer HTTPS base URLs
+            urls = sorted(urls, key=lambda url: not url.startswith('https://'))
+            for tld in tlds:
+                services[tld.lower()] = urls[0] if urls[0].endswith('/') else urls[0] + '/'
+        return cls(services)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_json(json.load(f))
+
+    def lookup(self, domain, public_suffixes):
+        """
+        Registrable name (from the Public Suffix List) and RDAP base URL (longest
+        matching bootstrap entry) for a domain
+        Returns: (registered_name, base_url) or (None, None)
+        """
+        name = public_suffixes.registrable(domain)
+        if name is None:
+            return None, None
+        labels = name.split('.')
+        for i in range(1, len(labels)):
+            base_url = self.services.get('.'.join(labels[i:]))
+            if base_url:
+                return name, base_url
+        return None, None
+
+
+class PublicSuffixList:
+    """
+    Public Suffix List rules (publicsuffix.org): which part of a name is the
+    suffix under which anyone can register, e.g. co.uk or com.br. The registrable
+    name is that suffix plus one label: shop.example.co.uk -> example.co.uk.
+    """
+
+    def __init__(self, rules, wildcards, exceptions):
+        self.rules = rules
+        self.wildcards = wildcards  # "*.ck" stored as "ck"
+        self.exceptions = exceptions  # "!www.ck" stored as "www.ck"
+
+    @classmethod
+    def from_text(cls, text):
+        rules, wildcards, exceptions = set(), set(), set()
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith('//'):
+                continue
+            rule = line.split()[0].lower()
+            # Domains are stored as entered: keep IDN rules in Unicode and punycode
+            for form in {rule, _to_ascii(rule)}:
+                if form.startswith('!'):
+                    exceptions.add(form[1:])
+                elif form.startswith('*.'):
+                    wildcards.add(form[2:])
+                else:
+                    rules.add(form)
+        if not rules:
+            raise ValueError('Public Suffix List has no rules')
+        return cls(rules, wildcards, exceptions)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls.from_text(f.read())
+
+    def suffix_length(self, labels):
+        """Labels in the public suffix of a name (longest matching rule, default 1)"""
+        for i in range(len(labels)):
+            candidate = '.'.join(labels[i:])
+            if candidate in self.exceptions:
+                return len(labels) - i - 1
+            if candidate in self.rules or '.'.join(labels[i + 1:]) in self.wildcards:
+                return len(labels) - i
+        return 1
+
+    def registrable(self, domain):
+        """Registrable name of a domain, None for a public suffix itself"""
+        labels = domain.lower().rstrip('.').split('.')
+        length = self.suffix_length(labels)
+        if length >= len(labels):
+            return None
+        return '.'.join(labels[-(length + 1):])
+
+    def check(self):
+        """Raises ValueError unless the list splits known multi-label suffixes right"""
+        for domain, expected in PSL_CHECKS.items():
+            if self.registrable(domain) != expected:
+                raise ValueError(f"Public Suffix List gives {self.registrable(domain)} for {domain}, "
+                                 f"expected {expected}")
+
+
+def _to_ascii(rule):
+    try:
+        return rule.encode('idna').decode('ascii')
+    except UnicodeError:
+        return rule
+
+
+def update_bootstrap(path=None, url=None):
+    """Download the IANA bootstrap file and replace the local copy atomically"""
+    path = path or os.getenv('RDAP_BOOTSTRAP_FILE', DEFAULT_BOOTSTRAP_FILE)
+    url = url or os.getenv('RDAP_BOOTSTRAP_URL', IANA_BOOTSTRAP_URL)
+
+    response = get_client().get(url, budget=30, destination='rdap')
+    response.raise_for_status()
+    data = response.json()
+    RdapBootstrap.from_json(data)  # refuse to replace a good file with garbage
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+    logger.info(f"RDAP bootstrap updated from {url}: {len(data.get('services', []))} services")
+    return path
+
+
+def update_public_suffix_list(path=None, url=None):
+    """Download the Public Suffix List and replace the local copy atomically"""
+    path = path or os.getenv('RDAP_PSL_FILE', DEFAULT_PSL_FILE)
+    url = url or os.getenv('RDAP_PSL_URL', PUBLIC_SUFFIX_LIST_URL)
+
+    response = get_client().get(url, budget=30, destination='rdap')
+    response.raise_for_status()
+    text = response.text
+    suffixes = PublicSuffixList.from_text(text)
+    suffixes.check()  # refuse to replace a good file with garbage
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    logger.info(f"Public Suffix List updated from {url}: {len(suffixes.rules)} rules")
+    return path
+
+
+class RegistryRateLimiter:
+    """Minimum spacing between requests to one registry, plus Retry-After pauses"""
+
+    def __init__(self, rate, max_wait):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._next_slot = defaultdict(float)
+
+    def acquire(self, registry):
+        """Wait for the registry's next slot; False if that is more than max_wait away"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot[registry])
+            if slot - now > self.max_wait:
+                return False
+            self._next_slot[registry] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+        return True
+
+    def pause(self, registry, seconds):
+        with self._lock:
+            self._next_slot[registry] = max(self._next_slot[registry], time.monotonic() + seconds)
+
+    def ready_in(self, registry):
+        """Seconds until acquire() for the registry would be accepted again"""
+        with self._lock:
+            return max(0.0, self._next_slot[registry] - self.max_wait - time.monotonic())
+
+
+class RdapCollector:
+    def __init__(self, bootstrap_file=None, concurrency=None, timeout=None, rate_per_registry=None,
+                 psl_file=None):
+        self.bootstrap_file = bootstrap_file or os.getenv('RDAP_BOOTSTRAP_FILE', DEFAULT_BOOTSTRAP_FILE)
+        self.psl_file = psl_file or os.getenv('RDAP_PSL_FILE', DEFAULT_PSL_FILE)
+        self.concurrency = int(concurrency or os.getenv('RDAP_CONCURRENCY', 10))
+        self.timeout = float(timeout or os.getenv('RDAP_TIMEOUT', 15))
+        rate = float(rate_per_registry or os.getenv('RDAP_RATE_PER_REGISTRY', 1))  # requests per second
+        self.limiter = RegistryRateLimiter(rate, float(os.getenv('RDAP_MAX_WAIT_SECONDS', 60)))
+        # Names turned away by the rate limit are queued again until this runs out
+        self.run_budget = float(os.getenv('RDAP_RUN_BUDGET_SECONDS', 3600))
+        # A registration is re-queried this long before it expires, and at least this often
+        self.expiry_margin = timedelta(days=float(os.getenv('RDAP_EXPIRY_MARGIN_DAYS', 30)))
+        self.max_cache_age = timedelta(days=float(os.getenv('RDAP_MAX_CACHE_DAYS', 90)))
+        self.near_expiry_interval = timedelta(hours=float(os.getenv('RDAP_NEAR_EXPIRY_HOURS', 24)))
+        self.retry_after = timedelta(hours=float(os.getenv('RDAP_RETRY_HOURS', 6)))
+        self.http = get_client()
+        # One destination per registry, on top of its rate limit
+        self.tuner = autotune.get_tuner('rdap', self.concurrency, self.timeout,
+                                        destination_maximum=self.http.pool_maxsize)
+        self._bootstrap = None
+        self._public_suffixes = None
+
+    @property
+    def bootstrap(self):
+        if self._bootstrap is None:
+            self._bootstrap = RdapBootstrap.load(self.bootstrap_file)
+        return self._bootstrap
+
+    @property
+    def public_suffixes(self):
+        if self._public_suffixes is None:
+            suffixes = PublicSuffixList.load(self.psl_file)
+            suffixes.check()
+            self._public_suffixes = suffixes
+        return self._public_suffixes
+
+    def lookup(self, name, base_url, timings=None):
+        """
+        Query one registrable name
+        Returns: RdapResult
+        """
+        registry = base_url.split('/')[2]
+        if not self.limiter.acquire(registry):
+            return RdapResult('rate_limited', None, None, [], None, 'Registry rate limit', None)
+
+        with self.tuner.slot(registry) as slot:
+            try:
+                with timed('rdap', timings, name):
+                    response = self.http.get(f"{base_url}domain/{name}", budget=slot.timeout, destination='rdap',
+                                             headers={'Accept': 'application/rdap+json'})
+            except Exception as e:
+                logger.warning(f"RDAP request failed for {name}: {str(e)}")
+                slot.outcome = 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'error'
+                return RdapResult('error', None, None, [], None, str(e), None)
+            if response.status_code == 429:
+                slot.outcome = 'overload'
+            elif response.status_code >= 500:
+                slot.outcome = 'error'
+
+        if response.status_code == 200:
+            try:
+                return parse_rdap(response.json())
+            except ValueError as e:
+                return RdapResult('error', None, None, [], None, f"Invalid RDAP response: {e}", None)
+
+        if response.status_code == 404:
+            return RdapResult('not_found', None, None, [], None, None, None)
+
+        if response.status_code == 429:
+            retry_after = response.headers.get('Retry-After', '')
+            seconds = int(retry_after) if retry_after.isdigit() else 60
+            self.limiter.pause(registry, seconds)
+            logger.warning(f"RDAP rate limit at {registry}, pausing {seconds}s")
+            return RdapResult('rate_limited', None, None, [], None, 'HTTP 429', seconds)
+
+        return RdapResult('error', None, None, [], None, f"HTTP {response.status_code}", None)
+
+    def next_check_at(self, result, now):
+        """Cache answers until close to expiry; retry failures sooner"""
+        if result.status == 'ok':
+            if result.expires_at is None:
+                return now + self.max_cache_age
+            due = result.expires_at - self.expiry_margin
+            return min(max(due, now + self.near_expiry_interval), now + self.max_cache_age)
+        if result.status == 'rate_limited':
+            # Due again on the next run (tick) once the registry's pause is over
+            return now + timedelta(seconds=result.retry_after or 0)
+        if result.status in ('not_found', 'unsupported'):
+            return now + timedelta(days=7)
+        return now + self.retry_after
+
+    def collect(self, session, domains=None, force=False, timings=None):
+        """
+        Query RDAP for domains whose cached registration is due and write
+        expire_date / autorenew in bulk
+        Returns: {status: count} of the queried domains
+        """
+        if domains is None:
+            domains = session.query(Domain).all()
+        now = datetime.utcnow()
+        domain_ids = [d.id for d in domains]
+        stored = {}
+        for start in range(0, len(domain_ids), CHUNK_SIZE):
+            stored.update((row.domain_id, row) for row in session.query(DomainRegistration)
+                          .filter(DomainRegistration.domain_id.in_(domain_ids[start:start + CHUNK_SIZE])))
+
+        # A cached row queried under another name (e.g. the suffix co.uk) is refreshed
+        due = []
+        for domain in domains:
+            registered_name, base_url = self.bootstrap.lookup(domain.domain, self.public_suffixes)
+            row = stored.get(domain.id)
+            # An unsupported TLD is stored under the domain's own name (see _store)
+            stored_name = registered_name or domain.domain
+            if force or row is None or row.next_check_at <= now or row.registered_name != stored_name:
+                due.append((domain.id, domain.domain, registered_name, base_url))
+        logger.info(f"RDAP: {len(domains) - len(due)} cached, {len(due)} due")
+        if not due:
+            return {}
+
+        # www.example.com and example.com share one query
+        by_name = defaultdict(list)
+        registries = {}
+        results = {}
+        for domain_id, name, registered_name, base_url in due:
+            if registered_name is None:
+                results[domain_id] = (name, None, RdapResult(
+                    'unsupported', None, None, [], None, 'No RDAP service for this TLD', None))
+                continue
+            by_name[registered_name].append(domain_id)
+            registries[registered_name] = base_url
+
+        names = list(by_name)
+        QUEUE_DEPTH.labels('rdap').set(len(names))
+        deadline = time.monotonic() + self.run_budget
+        pending, deferred = names, []
+        with ThreadPoolExecutor(max_workers=self.tuner.maximum) as pool:
+            while pending:
+                # Workers never wait long for a registry: names past its rate limit
+                # come back rate_limited and are queued again while the budget lasts
+                deferred = []
+                for name, result in zip(pending, pool.map(
+                        lambda n: self.lookup(n, registries[n], timings), pending)):
+                    for domain_id in by_name[name]:
+                        results[domain_id] = (name, registries[name], result)
+                    if result.status == 'rate_limited':
+                        deferred.append(name)
+                    else:
+                        QUEUE_DEPTH.labels('rdap').dec()
+
+                remaining = deadline - time.monotonic()
+                if not deferred or remaining <= 0:
+                    break
+                # Sleep until at least one registry takes requests again (e.g. after a 429 pause)
+                wait = min(self.limiter.ready_in(registries[name].split('/')[2]) for name in deferred)
+                time.sleep(min(wait, remaining))
+                pending = deferred
+
+        QUEUE_DEPTH.labels('rdap').set(0)
+        if deferred:
+            logger.warning(f"RDAP: {len(deferred)} names deferred by registry rate limits after "
+                           f"{self.run_budget:g}s, due again on the next run")
+
+        counts = defaultdict(int)
+        expiry_updates = []
+        autorenew_updates = []
+        for domain_id, (name, registry, result) in results.items():
+            counts[result.status] += 1
+            self._store(session, stored, domain_id, name, registry, result, now)
+            if result.status == 'ok':
+                expiry_updates.append({'id': domain_id, 'expire_date': result.expires_at})
+                # Keep a manually entered value unless RDAP tells something definite
+                if result.autorenew != 'unknown':
+                    autorenew_updates.append({'id': domain_id, 'autorenew': result.autorenew})
+
+        # Bulk UPDATE ... WHERE id = :id (executemany) instead of one flush per domain
+        if expiry_updates:
+            session.execute(update(Domain), expiry_updates)
+        if autorenew_updates:
+            session.execute(update(Domain), autorenew_updates)
+        session.commit()
+
+        logger.info(f"RDAP: {dict(counts)} ({len(names)} queries)")
+        return dict(counts)
+
+    def _store(self, session, stored, domain_id, name, registry, result, now):
+        row = stored.get(domain_id)
+        if row is None:
+            row = DomainRegistration(domain_id=domain_id)
+            session.add(row)
+            stored[domain_id] = row
+
+        row.registered_name = name
+        row.registry = registry
+        row.status = result.status
+        row.error = result.error
+        row.checked_at = now
+        row.next_check_at = self.next_check_at(result, now)
+        # A failed refresh keeps the last known registration data
+        if result.status == 'ok':
+            row.expires_at = result.expires_at
+            row.registered_at = result.registered_at
+            row.statuses = json.dumps(result.statuses)
+            row.autorenew = result.autorenew
+
+
+def bootstrap_is_stale(path, max_age_days):
+    try:
+        return time.time() - os.path.getmtime(path) > max_age_days * 86400
+    except OSError:
+        return True
+
+
+def prepare_bootstrap(collector):
+    """Refresh a stale bootstrap file and Public Suffix List. Returns: whether both are available"""
+    max_age_days = float(os.getenv('RDAP_BOOTSTRAP_MAX_AGE_DAYS', 7))
+    if bootstrap_is_stale(collector.bootstrap_file, max_age_days):
+        try:
+            update_bootstrap(collector.bootstrap_file)
+        except Exception as e:
+            logger.warning(f"Could not update RDAP bootstrap: {str(e)}")
+    if bootstrap_is_stale(collector.psl_file, max_age_days):
+        try:
+            update_public_suffix_list(collector.psl_file)
+            collector._public_suffixes = None
+        except Exception as e:
+            logger.warning(f"Could not update Public Suffix List: {str(e)}")
+    for path in (collector.bootstrap_file, collector.psl_file):
+        if not os.path.exists(path):
+            logger.error(f"RDAP file {path} not found, skipping collection")
+            return False
+    return True
+
+
+def run_collection(force=False, domain_names=None):
+    """Refresh a stale bootstrap file, then collect (CLI)"""
+    collector = RdapCollector()
+    if not prepare_bootstrap(collector):
+        return {}
+
+    session = get_session()
+    try:
+        domains = None
+        if domain_names:
+            domains = session.query(Domain).filter(Domain.domain.in_(domain_names)).all()
+        return collector.collect(session, domains, force=force)
+    except Exception as e:
+        logger.error(f"Error in RDAP collection: {str(e)}")
+        session.rollback()
+        return {}
+    finally:
+        session.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collect registration expiry and autorenew from RDAP')
+    parser.add_argument('--update-bootstrap', action='store_true',
+                        help='Download the IANA bootstrap file and the Public Suffix List and exit')
+    parser.add_argument('--force', action='store_true', help='Ignore cached registrations')
+    parser.add_argument('--domain', action='append', help='Only this domain (repeatable)')
+    args = parser.parse_args()
+
+    if args.update_bootstrap:
+        print(f"Bootstrap saved to {update_bootstrap()}")
+        print(f"Public Suffix List saved to {update_public_suffix_list()}")
+        sys.exit(0)
+
+    print(json.dumps(run_collection(force=args.force, domain_names=args.domain)))
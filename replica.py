@@ -0,0 +1,189 @@
+"""Optional read replica for read-only web routes (DATABASE_READ_URL)
+
+Dashboard pages, lists, history, exports and reports read from the replica so
+they don't compete with the checker's writes on the primary. A read goes to
+the primary instead when:
+
+- the user wrote within READ_YOUR_WRITES_SECONDS and the replica has not yet
+  replayed the WAL position recorded after that write (read-your-writes);
+- the replica lags more than REPLICA_MAX_LAG_SECONDS or cannot be reached.
+
+The checker, scheduler and all writes always use the primary (models.get_session).
+"""
+
+import os
+import time
+import logging
+import threading
+
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.orm import sessionmaker
+
+from models import get_engine, get_session
+from metrics import DB_READ_ROUTE
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Replay position, age of the last replayed commit and WAL receiver state. The
+# replica alone can't tell lag: with the WAL receiver disconnected, everything
+# received is replayed too, so the position is compared with the primary's.
+REPLICA_STATUS_SQL = """
+SELECT
+    pg_is_in_recovery() AS standby,
+    CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END::text AS replay_lsn,
+    EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) AS replay_age_seconds,
+    (SELECT status FROM pg_stat_wal_receiver) AS receiver_status,
+    EXTRACT(EPOCH FROM now() - (SELECT last_msg_receipt_time FROM pg_stat_wal_receiver)) AS receipt_age_seconds
+"""
+
+_read_engine = None
+_read_session_factory = None
+_monitor = None
+_lock = threading.Lock()
+
+
+def configured():
+    return bool(os.getenv('DATABASE_READ_URL'))
+
+
+def get_read_engine():
+    """Engine of the replica (the primary when DATABASE_READ_URL is not set)"""
+    global _read_engine
+    if not configured():
+        return get_engine()
+    if _read_engine is None:
+        with _lock:
+            if _read_engine is None:
+                url = make_url(os.getenv('DATABASE_READ_URL'))
+                connect_args = {}
+                if url.get_backend_name() == 'postgresql':
+                    # An unreachable replica must fall back to the primary quickly
+                    connect_args['connect_timeout'] = int(os.getenv('REPLICA_CONNECT_TIMEOUT', 3))
+                _read_engine = create_engine(url, pool_pre_ping=True, connect_args=connect_args)
+    return _read_engine
+
+
+def get_read_session():
+    global _read_session_factory
+    if _read_session_factory is None:
+        _read_session_factory = sessionmaker(bind=get_read_engine())
+    return _read_session_factory()
+
+
+def parse_lsn(value):
+    """'16/B374D848' -> comparable integer"""
+    high, low = value.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def primary_lsn():
+    """Current WAL position of the primary, recorded after a user's write"""
+    with get_engine().connect() as conn:
+        return conn.execute(text('SELECT pg_current_wal_lsn()::text')).scalar()
+
+
+class ReplicaMonitor:
+    """
+    Replica replay position and lag, refreshed at most every REPLICA_CHECK_SECONDS.
+
+    The replica is caught up when it has replayed the primary's current WAL
+    position (read first). Otherwise its data is at most as old as the last time
+    it was seen caught up, and at most as old as its last replayed commit:
+    the lag is the smaller of the two.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.check_seconds = float(os.getenv('REPLICA_CHECK_SECONDS', 2))
+        self.max_lag_seconds = float(os.getenv('REPLICA_MAX_LAG_SECONDS', 30))
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._replay_lsn = None
+        self._lag_seconds = None
+        self._caught_up_at = None
+        self._receiver_status = None
+
+    def _refresh(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is not None and now - self._checked_at < self.check_seconds:
+                return
+            self._checked_at = now
+            try:
+                target = parse_lsn(primary_lsn())
+                with self.engine.connect() as conn:
+                    row = conn.execute(text(REPLICA_STATUS_SQL)).one()
+                self._replay_lsn = parse_lsn(row.replay_lsn) if row.replay_lsn else None
+                self._lag_seconds = self._lag(row, target, now)
+            except Exception as e:
+                logger.error(f"Read replica status check failed: {str(e)}")
+                self._replay_lsn = None
+                self._lag_seconds = None
+
+    def _lag(self, row, target, now):
+        if not row.standby or (self._replay_lsn is not None and self._replay_lsn >= target):
+            self._caught_up_at = now
+            return 0.0
+
+        if row.receiver_status != self._receiver_status:
+            if row.receiver_status != 'streaming':
+                age = f"{row.receipt_age_seconds:.0f} s ago" if row.receipt_age_seconds is not None else "never"
+                logger.warning(f"Read replica WAL receiver is {row.receiver_status or 'not running'} "
+                               f"(last message {age})")
+            self._receiver_status = row.receiver_status
+
+        bounds = []
+        if self._caught_up_at is not None:
+            bounds.append(now - self._caught_up_at)
+        if row.replay_age_seconds is not None:
+            bounds.append(float(row.replay_age_seconds))
+        # Behind the primary with nothing to bound the lag: unknown, not healthy
+        return min(bounds) if bounds else float('inf')
+
+    def healthy(self):
+        self._refresh()
+        return self._lag_seconds is not None and self._lag_seconds <= self.max_lag_seconds
+
+    def caught_up(self, lsn):
+        """Whether the replica has replayed the primary's WAL up to lsn"""
+        self._refresh()
+        return self._replay_lsn is not None and self._replay_lsn >= parse_lsn(lsn)
+
+    @property
+    def lag_seconds(self):
+        return self._lag_seconds
+
+
+def get_monitor():
+    global _monitor
+    if _monitor is None:
+        with _lock:
+            if _monitor is None:
+                _monitor = ReplicaMonitor(get_read_engine())
+    return _monitor
+
+
+def use_replica(write_lsn=None, written_at=None):
+    """Route a read: the user's last write position and time (from their session)"""
+    if not configured():
+        return False
+    monitor = get_monitor()
+    read_your_writes = float(os.getenv('READ_YOUR_WRITES_SECONDS', 60))
+    if write_lsn and written_at and time.time() - written_at < read_your_writes:
+        if not monitor.caught_up(write_lsn):
+            DB_READ_ROUTE.labels('primary_own_write').inc()
+            return False
+    if not monitor.healthy():
+        DB_READ_ROUTE.labels('primary_lagging').inc()
+        return False
+    DB_READ_ROUTE.labels('replica').inc()
+    return True
+
+
+def read_session(write_lsn=None, written_at=None):
+    return get_read_session() if use_replica(write_lsn, written_at) else get_session()
+
+
+def read_engine(write_lsn=None, written_at=None):
+    return get_read_engine() if use_replica(write_lsn, written_at) else get_engine()
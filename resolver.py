@@ -0,0 +1,154 @@
+"""Concurrent DNS resolution stage with a TTL-aware cache"""
+
+import os
+import json
+import time
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import dns.exception
+import dns.rdatatype
+import dns.resolver
+
+from models import DomainResolution
+from metrics import QUEUE_DEPTH, timed
+import autotune
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# status: resolved, nxdomain, nodata, timeout, error
+Resolution = namedtuple('Resolution', ['status', 'addresses', 'ttl', 'error'])
+
+CHUNK_SIZE = 1000
+
+
+def _negative_ttl(response, default):
+    """Negative-caching TTL from the SOA in the authority section (RFC 2308)"""
+    if response is None:
+        return default
+    for rrset in response.authority:
+        if rrset.rdtype == dns.rdatatype.SOA:
+            return min(rrset.ttl, rrset[0].minimum, default)
+    return default
+
+
+class DnsResolver:
+    def __init__(self, nameservers=None, port=None, timeout=None, concurrency=None):
+        nameservers = nameservers or [
+            ns.strip() for ns in os.getenv('DNS_NAMESERVERS', '').split(',') if ns.strip()
+        ]
+        self.timeout = float(timeout or os.getenv('DNS_TIMEOUT', 5))
+        self.concurrency = int(concurrency or os.getenv('DNS_CONCURRENCY', 50))
+        self.min_ttl = int(os.getenv('DNS_MIN_TTL', 60))
+        self.max_ttl = int(os.getenv('DNS_MAX_TTL', 86400))
+        self.negative_ttl = int(os.getenv('DNS_NEGATIVE_TTL', 300))
+
+        # Explicit nameservers (e.g. a local stub resolver) replace /etc/resolv.conf
+        self.resolver = dns.resolver.Resolver(configure=not nameservers)
+        if nameservers:
+            self.resolver.nameservers = nameservers
+        self.resolver.port = int(port or os.getenv('DNS_PORT', 53))
+        self.resolver.lifetime = self.timeout
+        # Every query goes to the same resolver(s): one destination
+        self.destination = ','.join(str(ns) for ns in self.resolver.nameservers)
+        # Timeouts and SERVFAIL mostly come from dead authoritative servers, not from
+        # the resolver: only its latency and refusals limit concurrency
+        self.tuner = autotune.get_tuner('dns', self.concurrency, self.timeout,
+                                        destination_signals=autotune.STAGE_SIGNALS)
+
+    def _clamp_ttl(self, ttl):
+        return max(self.min_ttl, min(int(ttl), self.max_ttl))
+
+    def resolve(self, name, timings=None):
+        """
+        Resolve A (then AAAA) records for a name
+        Returns: Resolution(status, addresses, ttl, error)
+        """
+        with self.tuner.slot(self.destination) as slot:
+            with timed('dns', timings, name):
+                result = self._resolve(name, slot.timeout)
+            slot.outcome = {'timeout': 'timeout', 'error': 'error'}.get(result.status, 'ok')
+            return result
+
+    def _resolve(self, name, timeout=None):
+        try:
+            answer = None
+            for rdtype in ('A', 'AAAA'):
+                answer = self.resolver.resolve(name, rdtype, raise_on_no_answer=False,
+                                               lifetime=timeout or self.timeout)
+                if answer.rrset is not None:
+                    addresses = [rdata.address for rdata in answer.rrset]
+                    # expiration is the lowest TTL along the CNAME chain
+                    ttl = self._clamp_ttl(answer.expiration - time.time())
+                    return Resolution('resolved', addresses, ttl, None)
+
+            ttl = _negative_ttl(answer.response if answer else None, self.negative_ttl)
+            return Resolution('nodata', [], self._clamp_ttl(ttl), None)
+
+        except dns.resolver.NXDOMAIN as e:
+            ttl = _negative_ttl(e.response(e.qnames()[0]), self.negative_ttl)
+            return Resolution('nxdomain', [], self._clamp_ttl(ttl), None)
+
+        except dns.exception.Timeout:
+            return Resolution('timeout', [], self.min_ttl, 'DNS timeout')
+
+        except Exception as e:
+            return Resolution('error', [], self.min_ttl, str(e))
+
+    def resolve_all(self, session, domains, timings=None):
+        """
+        Resolve domains concurrently, reusing cached results until their TTL expires
+        and recording each result in domain_resolutions
+        Returns: {domain_id: Resolution}
+        """
+        now = datetime.utcnow()
+        domain_ids = [d.id for d in domains]
+        cached = {}
+        for start in range(0, len(domain_ids), CHUNK_SIZE):
+            cached.update((row.domain_id, row) for row in session.query(DomainResolution)
+                          .filter(DomainResolution.domain_id.in_(domain_ids[start:start + CHUNK_SIZE])))
+
+        resolutions = {}
+        stale = []
+        for domain in domains:
+            row = cached.get(domain.id)
+            if row is not None and row.expires_at > now:
+                resolutions[domain.id] = Resolution(row.status, row.address_list(), row.ttl, row.error)
+            else:
+                stale.append(domain)
+
+        logger.info(f"DNS: {len(resolutions)} cached, {len(stale)} to resolve")
+
+        if stale:
+            # Names are read here: ORM objects must not be touched from worker threads
+            names = [d.domain for d in stale]
+            QUEUE_DEPTH.labels('dns').set(len(names))
+            # Threads up to the tuner's maximum; its current limit decides how many query at once
+            with ThreadPoolExecutor(max_workers=self.tuner.maximum) as pool:
+                results = pool.map(lambda name: self.resolve(name, timings), names)
+
+                for domain, result in zip(stale, results):
+                    QUEUE_DEPTH.labels('dns').dec()
+                    resolutions[domain.id] = result
+                    row = cached.get(domain.id)
+                    if row is None:
+                        row = DomainResolution(domain_id=domain.id)
+                        session.add(row)
+
+                    resolved_at = datetime.utcnow()
+                    row.status = result.status
+                    row.addresses = json.dumps(result.addresses)
+                    row.ttl = result.ttl
+                    row.error = result.error
+                    row.resolved_at = resolved_at
+                    row.expires_at = resolved_at + timedelta(seconds=result.ttl)
+
+                    if result.status != 'resolved':
+                        logger.warning(f"Domain {domain.domain} doesn't resolve: {result.status}")
+
+            session.commit()
+
+        return resolutions
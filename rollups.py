@@ -0,0 +1,199 @@
+"""Daily per-project and per-purpose rollups of check results
+
+status_history has no project column, so trend questions ("bans per project
+per week") would scan it joined with domains. Instead the checker adds every
+result to a RollupBatch and upserts the day's counters together with the
+batch's history rows (same transaction), and trends are read from
+daily_rollups only.
+
+Days are UTC, like checked_at. rebuild() recomputes days from status_history
+when rollups are introduced on an existing database; rows written before
+history recorded SSL status count no SSL state, and the domains' current
+project/purpose is used for past days.
+
+    python rollups.py --rebuild-days 90
+"""
+
+import logging
+import argparse
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import case, func, select
+
+from models import get_session, dialect_insert, DailyRollup, Domain, StatusHistory
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = ('project', 'purpose')
+METRICS = ('checks', 'ok', 'banned', 'errors', 'bans', 'unbans',
+           'ssl_valid', 'ssl_expired', 'ssl_invalid', 'ssl_missing')
+SSL_STATUSES = ('valid', 'expired', 'invalid', 'missing')
+
+
+def result_counts(status, previous_status, ssl_status=None):
+    """Counters contributed by one check result"""
+    counts = Counter(checks=1)
+    if status == 'ok':
+        counts['ok'] = 1
+    elif status == 'banned':
+        counts['banned'] = 1
+    elif status == 'error':
+        counts['errors'] = 1
+
+    if status == 'banned' and previous_status != 'banned':
+        counts['bans'] = 1
+    elif status == 'ok' and previous_status == 'banned':
+        counts['unbans'] = 1
+
+    if ssl_status in SSL_STATUSES:
+        counts[f'ssl_{ssl_status}'] = 1
+    return counts
+
+
+class RollupBatch:
+    """Counters of a batch of results, added to daily_rollups by flush()"""
+
+    def __init__(self):
+        self.counters = defaultdict(Counter)
+
+    def add(self, project, purpose, checked_at, status, previous_status, ssl_status):
+        counts = result_counts(status, previous_status, ssl_status)
+        for dimension, value in (('project', project), ('purpose', purpose)):
+            self.counters[(checked_at.date(), dimension, value or '')].update(counts)
+
+    def flush(self, session):
+        """Upsert the counters in the session's transaction and start over"""
+        if not self.counters:
+            return
+        rows = [dict({metric: counts[metric] for metric in METRICS},
+                     day=day, dimension=dimension, value=value, updated_at=datetime.utcnow())
+                for (day, dimension, value), counts in self.counters.items()]
+        session.execute(_upsert(session, rows, increment=True))
+        self.counters.clear()
+
+
+def _upsert(session, rows, increment):
+    """INSERT ... ON CONFLICT: add to (increment) or replace existing counters"""
+    table = DailyRollup.__table__
+    statement = dialect_insert(session.get_bind())(table).values(rows)
+    updates = {metric: (table.c[metric] + statement.excluded[metric]) if increment else statement.excluded[metric]
+               for metric in METRICS}
+    updates['updated_at'] = statement.excluded.updated_at
+    return statement.on_conflict_do_update(index_elements=['dimension', 'day', 'value'], set_=updates)
+
+
+def rebuild(session, since):
+    """Recompute rollups of days from `since` (a date) out of status_history"""
+    # The status before each check, including checks older than `since`
+    history = select(
+        StatusHistory.domain_id,
+        StatusHistory.status,
+        StatusHistory.checked_at,
+        StatusHistory.ssl_status,
+        func.lag(StatusHistory.status).over(
+            partition_by=StatusHistory.domain_id, order_by=StatusHistory.checked_at
+        ).label('previous_status')
+    ).subquery()
+    since_time = datetime.combine(since, datetime.min.time())
+    day = func.date(history.c.checked_at)
+
+    def total(condition):
+        return func.sum(case((condition, 1), else_=0))
+
+    rows = []
+    for dimension in DIMENSIONS:
+        column = getattr(Domain, dimension)
+        query = session.query(
+            day, column,
+            func.count(),
+            total(history.c.status == 'ok'),
+            total(history.c.status == 'banned'),
+            total(history.c.status == 'error'),
+            total((history.c.status == 'banned') & (func.coalesce(history.c.previous_status, '') != 'banned')),
+            total((history.c.status == 'ok') & (history.c.previous_status == 'banned')),
+            *[total(history.c.ssl_status == ssl_status) for ssl_status in SSL_STATUSES]
+        ).join(Domain, Domain.id == history.c.domain_id)\
+            .filter(history.c.checked_at >= since_time)\
+            .group_by(day, column)
+
+        for row_day, value, *counts in query:
+            if isinstance(row_day, str):
+                row_day = date.fromisoformat(row_day)
+            rows.append(dict(zip(METRICS, counts), day=row_day, dimension=dimension, value=value or '',
+                             updated_at=datetime.utcnow()))
+
+    session.query(DailyRollup).filter(DailyRollup.day >= since).delete(synchronize_session=False)
+    # Several NULL and '' projects collapse into one value
+    merged = {}
+    for row in rows:
+        key = (row['dimension'], row['day'], row['value'])
+        if key in merged:
+            for metric in METRICS:
+                merged[key][metric] += row[metric]
+        else:
+            merged[key] = row
+    merged = list(merged.values())
+    for start in range(0, len(merged), 1000):
+        session.execute(_upsert(session, merged[start:start + 1000], increment=False))
+    return len(merged)
+
+
+def trends(session, dimension, metric, days, bucket='day', limit=8, today=None):
+    """
+    One metric over the last `days` days per dimension value, bucketed by day or
+    ISO week. The `limit` values with the largest totals get their own series.
+    """
+    today = today or datetime.utcnow().date()
+    start = today - timedelta(days=days - 1)
+    column = getattr(DailyRollup, metric)
+
+    rows = session.query(DailyRollup.day, DailyRollup.value, column)\
+        .filter(DailyRollup.dimension == dimension, DailyRollup.day.between(start, today))\
+        .all()
+
+    def bucket_of(day):
+        return day - timedelta(days=day.weekday()) if bucket == 'week' else day
+
+    labels = []
+    current = bucket_of(start)
+    while current <= today:
+        labels.append(current)
+        current += timedelta(days=7 if bucket == 'week' else 1)
+    position = {label: i for i, label in enumerate(labels)}
+
+    per_value = defaultdict(lambda: [0] * len(labels))
+    for day, value, count in rows:
+        per_value[value][position[bucket_of(day)]] += count
+
+    totals = [sum(points) for points in zip(*per_value.values())] if per_value else [0] * len(labels)
+    ranked = sorted(per_value.items(), key=lambda item: (-sum(item[1]), item[0]))
+    return {
+        'dimension': dimension,
+        'metric': metric,
+        'bucket': bucket,
+        'labels': [label.isoformat() for label in labels],
+        'series': [{'value': value or None, 'data': points, 'total': sum(points)}
+                   for value, points in ranked[:limit] if sum(points) > 0],
+        'totals': totals
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild daily rollups from status history')
+    parser.add_argument('--rebuild-days', type=int, required=True, help='Days to recompute, counting today')
+    args = parser.parse_args()
+
+    session = get_session()
+    try:
+        since = datetime.utcnow().date() - timedelta(days=args.rebuild_days - 1)
+        count = rebuild(session, since)
+        session.commit()
+        logger.info(f"Rebuilt {count} rollup rows since {since}")
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error rebuilding rollups: {str(e)}")
+        raise
+    finally:
+        session.close()
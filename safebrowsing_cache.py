@@ -0,0 +1,109 @@
+"""Persistent Safe Browsing verdict cache keyed by URL expression"""
+
+import os
+import json
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from models import get_session, SafeBrowsingVerdict
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def parse_cache_duration(value, default):
+    """Parse the API's duration string (e.g. '300s' or '300.5s') into seconds"""
+    try:
+        return float(str(value).rstrip('s'))
+    except (TypeError, ValueError):
+        return default
+
+
+class SafeBrowsingCache:
+    """
+    Shared by scheduled cycles, targeted re-checks and manual runs: verdicts
+    live in the database, so overlapping processes reuse each other's answers.
+    Matches are cached for the API's cacheDuration, clean URLs for
+    SAFEBROWSING_NEGATIVE_CACHE_SECONDS.
+    """
+
+    def __init__(self):
+        self.negative_ttl = int(os.getenv('SAFEBROWSING_NEGATIVE_CACHE_SECONDS', 3600))
+
+    def get(self, urls):
+        """
+        Look up unexpired verdicts
+        Returns: {url: (threat_types, platform)} for cached URLs only
+        (none when the cache can't be read: the URLs are looked up in the API)
+        """
+        session = get_session()
+        try:
+            rows = session.query(SafeBrowsingVerdict)\
+                .filter(SafeBrowsingVerdict.url.in_(urls))\
+                .filter(SafeBrowsingVerdict.expires_at > datetime.utcnow())\
+                .all()
+            return {row.url: (row.threat_type_list(), row.platform) for row in rows}
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error reading Safe Browsing verdict cache: {str(e)}")
+            return {}
+        finally:
+            session.close()
+
+    def put(self, urls, matches):
+        """Store verdicts for looked-up URLs given the API's matches list"""
+        now = datetime.utcnow()
+        verdicts = {}
+        for url in urls:
+            url_matches = [m for m in matches if m.get('threat', {}).get('url') == url]
+            if url_matches:
+                ttl = min(parse_cache_duration(m.get('cacheDuration'), self.negative_ttl) for m in url_matches)
+                verdicts[url] = (
+                    [m.get('threatType', 'UNKNOWN') for m in url_matches],
+                    url_matches[0].get('platformType', 'UNKNOWN'),
+                    ttl
+                )
+            else:
+                verdicts[url] = ([], None, self.negative_ttl)
+
+        session = get_session()
+        try:
+            existing = {
+                row.url: row for row in
+                session.query(SafeBrowsingVerdict).filter(SafeBrowsingVerdict.url.in_(urls)).all()
+            }
+            for url, (threat_types, platform, ttl) in verdicts.items():
+                if ttl <= 0:
+                    continue
+                row = existing.get(url)
+                if row is None:
+                    row = SafeBrowsingVerdict(url=url)
+                    session.add(row)
+                row.threat_types = json.dumps(threat_types)
+                row.platform = platform
+                row.cached_at = now
+                row.expires_at = now + timedelta(seconds=ttl)
+            session.commit()
+
+        except IntegrityError:
+            # A concurrent run cached the same URL first; its answer is as good as ours
+            session.rollback()
+
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error caching Safe Browsing verdicts: {str(e)}")
+
+        finally:
+            session.close()
+
+    def purge_expired(self):
+        """Delete expired verdicts"""
+        session = get_session()
+        try:
+            deleted = session.query(SafeBrowsingVerdict)\
+                .filter(SafeBrowsingVerdict.expires_at <= datetime.utcnow())\
+                .delete(synchronize_session=False)
+            session.commit()
+            return deleted
+        finally:
+            session.close()
@@ -2,10 +2,17 @@
 
 import os
 import logging
+import threading
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from checker import DomainChecker
-from datetime import datetime
+from telegram_notifier import TelegramNotifier
+import events
+import outbox
+from probes import ProbePipeline
+from models import get_session
+from metrics import start_metrics_server
+from datetime import datetime, timedelta
 
 logging.basicConfig(
     level=logging.INFO,
@@ -22,34 +29,158 @@ def run_check():
 
     try:
         checker = DomainChecker()
-        checker.check_all_domains()
+        checker.check_all_domains(trigger='scheduler')
         logger.info("Scheduled check completed successfully")
     except Exception as e:
         logger.error(f"Error in scheduled check: {str(e)}")
 
 
+def run_startup_check(checker, interval_hours):
+    """
+    Resume a cycle interrupted by a restart, or skip the initial full check when
+    the last one finished within the interval: a redeploy re-checks nothing that
+    is still fresh and sends no extra report. Runs of the previous scheduler
+    process are dead however recent their last heartbeat.
+    """
+    try:
+        run_id = checker.resume_interrupted(dead_trigger='scheduler')
+        if run_id is not None:
+            logger.info(f"Resumed interrupted check run {run_id}")
+            return
+
+        session = get_session()
+        try:
+            last = checker.last_full_run(session)
+            finished_at = last.finished_at if last is not None else None
+        finally:
+            session.close()
+        if finished_at is not None and finished_at > datetime.utcnow() - timedelta(hours=interval_hours):
+            logger.info(f"Last full check finished at {finished_at:%Y-%m-%d %H:%M:%S} UTC, "
+                        f"skipping the initial check")
+            return
+    except Exception as e:
+        logger.error(f"Error checking for interrupted or recent runs: {str(e)}")
+
+    logger.info("Running initial domain check...")
+    run_check()
+
+
+def resume_interrupted_runs(checker):
+    """Resume or close runs whose process died since startup (web, CLI)"""
+    try:
+        run_id = checker.resume_interrupted()
+        if run_id is not None:
+            logger.info(f"Resumed interrupted check run {run_id}")
+    except Exception as e:
+        logger.error(f"Error resuming interrupted check runs: {str(e)}")
+
+
+def run_due_probes(pipeline):
+    """Start every probe stage that has due domains, each on its own thread"""
+    try:
+        pipeline.run_due()
+    except Exception as e:
+        logger.error(f"Error starting probe stages: {str(e)}")
+
+
+def send_report(checker):
+    """Status report to Telegram (probe stages don't send one per run)"""
+    session = get_session()
+    try:
+        checker.send_status_report(session)
+    finally:
+        session.close()
+
+
+def dispatch_notifications(subscription, notifier):
+    """
+    Send the ban/unban notifications queued in the outbox by any checker run.
+    A published transition only wakes the dispatcher up: NOTIFYs sent while the
+    connection was down are lost, so the outbox is also drained after every
+    (re)connect and on the idle timeout.
+    """
+    while True:
+        item = subscription.get(timeout=60)
+        if item is not None:
+            _, payload = item
+            if payload.get('type') == events.RESYNC:
+                logger.info("Notification dispatcher (re)connected, sending queued notifications")
+            elif payload.get('type') != 'transition' or not payload.get('notify'):
+                continue
+        outbox.deliver(notifier)
+
+
+def start_notification_dispatcher():
+    """
+    Listen for status transitions (PostgreSQL). While this connection is up,
+    checker runs - scheduled, web-triggered or CLI - queue ban/unban
+    notifications in the outbox for it instead of sending them inline.
+    """
+    if not events.enabled() or os.getenv('NOTIFY_VIA_EVENTS', '1') == '0':
+        return
+    listener = events.EventListener(channels=(events.DOMAIN_CHANNEL,),
+                                    application_name=events.NOTIFIER_APPLICATION)
+    # Unbounded: a slow Telegram API must not drop notifications
+    subscription = events.Subscription(listener, channels=(events.DOMAIN_CHANNEL,), maxsize=0).__enter__()
+    threading.Thread(target=dispatch_notifications, args=(subscription, TelegramNotifier()),
+                     name='notification-dispatcher', daemon=True).start()
+    listener.start()
+    logger.info("Ban/unban notifications are sent from published status transitions")
+
+
 if __name__ == '__main__':
     check_interval_hours = int(os.getenv('CHECK_INTERVAL_HOURS', 8))
+    probe_tick_minutes = float(os.getenv('PROBE_TICK_MINUTES', 5))
 
     logger.info(f"Starting GDBChecker Scheduler (check interval: {check_interval_hours} hours)")
     logger.info(f"Current time: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC")
 
-    # Run initial check
-    logger.info("Running initial domain check...")
-    run_check()
+    # Prometheus exporter for the checker running in this process
+    if os.getenv('METRICS_PORT', '9100') != '0':
+        start_metrics_server()
+
+    start_notification_dispatcher()
 
-    # Setup scheduler
+    # Initial check (resets the dns, tls and safebrowsing schedule) unless a
+    # recent one is still fresh; an interrupted one is finished first
+    checker = DomainChecker()
+    run_startup_check(checker, check_interval_hours)
+
+    pipeline = ProbePipeline(checker)
+    for name, stage in pipeline.stages.items():
+        logger.info(f"Probe stage {name}: " + (f"every {stage.interval}, concurrency {stage.concurrency}, "
+                                                f"timeout {stage.timeout}s" if stage.enabled else "disabled"))
+
+    # Setup scheduler: each tick runs the stages whose domains are due
     scheduler = BlockingScheduler()
     scheduler.add_job(
-        run_check,
+        run_due_probes,
+        args=(pipeline,),
+        trigger=IntervalTrigger(minutes=probe_tick_minutes),
+        id='probe_tick',
+        name='Run due probe stages',
+        next_run_time=datetime.now(),
+        replace_existing=True
+    )
+    scheduler.add_job(
+        resume_interrupted_runs,
+        args=(checker,),
+        trigger=IntervalTrigger(seconds=float(os.getenv('CHECK_RUN_STALE_SECONDS', 120))),
+        id='resume_interrupted',
+        name='Resume interrupted check runs',
+        replace_existing=True
+    )
+    scheduler.add_job(
+        send_report,
+        args=(checker,),
         trigger=IntervalTrigger(hours=check_interval_hours),
-        id='domain_check',
-        name='Check all domains',
+        id='status_report',
+        name='Send status report',
         replace_existing=True
     )
 
     try:
-        logger.info(f"Scheduler started. Next check in {check_interval_hours} hours.")
+        logger.info(f"Scheduler started. Probe stages checked every {probe_tick_minutes:g} minutes.")
         scheduler.start()
     except (KeyboardInterrupt, SystemExit):
         logger.info("Scheduler stopped by user")
@@ -2,9 +2,10 @@
 
 import os
 import logging
-from telegram import Bot
-from telegram.error import TelegramError
+import requests
 from datetime import datetime
+from http_client import get_client
+from metrics import timed
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,74 +15,75 @@ class TelegramNotifier:
     def __init__(self):
         self.bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
         self.chat_id = os.getenv('TELEGRAM_CHAT_ID')
-        self.bot = None
+        self.api_url = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+        self.http = get_client()
 
         if self.bot_token and self.chat_id:
-            try:
-                self.bot = Bot(token=self.bot_token)
-                logger.info("Telegram bot initialized successfully")
-            except Exception as e:
-                logger.error(f"Failed to initialize Telegram bot: {str(e)}")
+            logger.info("Telegram bot initialized successfully")
         else:
             logger.warning("Telegram credentials not configured")
 
+    @property
+    def configured(self):
+        return bool(self.bot_token and self.chat_id)
+
     def send_message(self, message):
         """Send message to Telegram channel"""
-        if not self.bot or not self.chat_id:
+        if not self.bot_token or not self.chat_id:
             logger.warning("Telegram not configured, skipping notification")
             return False
 
         try:
-            import asyncio
-
-            # Run async function in sync context
-            async def _send():
-                await self.bot.send_message(
-                    chat_id=self.chat_id,
-                    text=message,
-                    parse_mode='HTML'
+            # Bot API call over the shared keep-alive client
+            with timed('telegram'):
+                response = self.http.post(
+                    f"{self.api_url}/bot{self.bot_token}/sendMessage",
+                    json={
+                        'chat_id': self.chat_id,
+                        'text': message,
+                        'parse_mode': 'HTML'
+                    },
+                    budget=15,
+                    destination='telegram'
                 )
+            result = response.json()
 
-            # Get or create event loop
-            try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
+            if response.status_code == 200 and result.get('ok'):
+                logger.info("Telegram notification sent successfully")
+                return True
 
-            loop.run_until_complete(_send())
-            logger.info("Telegram notification sent successfully")
-            return True
+            logger.error(f"Telegram error: {result.get('description', response.status_code)}")
+            return False
 
-        except TelegramError as e:
-            logger.error(f"Telegram error: {str(e)}")
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Telegram request failed: {str(e)}")
             return False
 
         except Exception as e:
             logger.error(f"Unexpected error sending Telegram message: {str(e)}")
             return False
 
-    def send_ban_notification(self, domain):
-        """Send notification when domain gets banned"""
+    def send_ban_notification(self, domain, checked_at=None):
+        """Send notification when domain gets banned (checked_at: when, default now)"""
         message = f"""🚨 <b>ДОМЕН ЗАБАНЕН</b>
 
 <b>Домен:</b> {domain.domain}
 <b>Проект:</b> {domain.project or 'Не указан'}
 <b>Назначение:</b> {domain.purpose or 'Не указано'}
-<b>Время проверки:</b> {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC
+<b>Время проверки:</b> {(checked_at or datetime.utcnow()).strftime('%Y-%m-%d %H:%M:%S')} UTC
 
 ⚠️ Google Safe Browsing обнаружил угрозу на этом домене."""
 
         return self.send_message(message)
 
-    def send_unban_notification(self, domain):
-        """Send notification when domain gets unbanned"""
+    def send_unban_notification(self, domain, checked_at=None):
+        """Send notification when domain gets unbanned (checked_at: when, default now)"""
         message = f"""✅ <b>ДОМЕН РАЗБАНЕН</b>
 
 <b>Домен:</b> {domain.domain}
 <b>Проект:</b> {domain.project or 'Не указан'}
 <b>Назначение:</b> {domain.purpose or 'Не указано'}
-<b>Время проверки:</b> {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC
+<b>Время проверки:</b> {(checked_at or datetime.utcnow()).strftime('%Y-%m-%d %H:%M:%S')} UTC
 
 ✨ Домен больше не находится в черном списке Google."""
 
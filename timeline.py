@@ -0,0 +1,103 @@
+"""Status timeline of many domains: a domain x time bucket matrix
+
+A heatmap of a project used to cost one /api/domains/<id>/history request per
+domain. matrix() computes every cell in one grouped query over status_history
+(range scans of ix_status_history_domain_checked) and returns dense arrays:
+one row per domain, one small integer per bucket, the worst status the domain
+had in that bucket.
+
+Buckets are aligned to multiples of the step since the Unix epoch (UTC), so
+a 1d bucket is a UTC day and the same range always gives the same cells.
+"""
+
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy import Integer, case, cast, func
+
+from models import Domain, StatusHistory
+
+# Cell values; a bucket without checks is 0
+CODES = {'none': 0, 'ok': 1, 'error': 2, 'banned': 3}
+
+UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+MIN_STEP_SECONDS = 300
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def parse_bucket(value):
+    """'15m', '1h', '6h', '1d' -> seconds. Raises ValueError."""
+    match = re.fullmatch(r'(\d+)([mhd])', (value or '').strip())
+    if not match:
+        raise ValueError('bucket must look like 15m, 1h or 1d')
+    seconds = int(match.group(1)) * UNITS[match.group(2)]
+    if seconds < MIN_STEP_SECONDS:
+        raise ValueError(f'bucket must be at least {MIN_STEP_SECONDS // 60}m')
+    return seconds
+
+
+def align(since, until, step):
+    """Range widened to whole buckets. Returns: (start, number of buckets)"""
+    start_seconds = int((since - EPOCH).total_seconds()) // step * step
+    end_seconds = int((until - EPOCH).total_seconds())
+    buckets = max(1, -(-(end_seconds - start_seconds) // step))
+    return EPOCH + timedelta(seconds=start_seconds), buckets
+
+
+def _bucket_index(dialect, column, start, step):
+    """Bucket number of a timestamp, computed by the database"""
+    offset = int((start - EPOCH).total_seconds())
+    if dialect == 'postgresql':
+        return cast(func.floor((func.extract('epoch', column) - offset) / step), Integer)
+    # SQLite: whole seconds; rows are >= start, so integer division floors
+    return (cast(func.strftime('%s', column), Integer) - offset) // step
+
+
+def matrix(session, condition, since, until, step, max_domains=None):
+    """
+    Worst status per (domain, bucket) of the domains matching `condition`
+    (a WHERE clause over domains, None for all) between since and until.
+    Raises ValueError when more than max_domains match.
+    """
+    start, buckets = align(since, until, step)
+    end = start + timedelta(seconds=step * buckets)
+
+    query = session.query(Domain.id, Domain.domain, Domain.project, Domain.purpose, Domain.current_status)
+    if condition is not None:
+        query = query.filter(condition)
+    query = query.order_by(Domain.project, Domain.domain)
+    if max_domains:
+        query = query.limit(max_domains + 1)
+    domains = query.all()
+    if max_domains and len(domains) > max_domains:
+        raise ValueError(f'More than {max_domains} domains selected, narrow the selection')
+    row_of = {domain.id: i for i, domain in enumerate(domains)}
+    cells = [[0] * buckets for _ in domains]
+
+    if domains:
+        bucket = _bucket_index(session.get_bind().dialect.name, StatusHistory.checked_at, start, step)
+        severity = func.max(case(
+            *[(StatusHistory.status == status, code) for status, code in CODES.items() if code],
+            else_=0
+        ))
+        history = session.query(StatusHistory.domain_id, bucket.label('bucket'), severity)\
+            .filter(StatusHistory.checked_at >= start, StatusHistory.checked_at < end)
+        if condition is not None:
+            history = history.join(Domain, Domain.id == StatusHistory.domain_id).filter(condition)
+        for domain_id, index, code in history.group_by(StatusHistory.domain_id, bucket):
+            row = row_of.get(domain_id)
+            # A domain added after the list was read has no row
+            if row is not None and 0 <= index < buckets:
+                cells[row][index] = code
+
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'step': step,
+        'buckets': buckets,
+        'codes': CODES,
+        'domains': [{'id': d.id, 'domain': d.domain, 'project': d.project, 'purpose': d.purpose,
+                     'current_status': d.current_status} for d in domains],
+        'matrix': cells
+    }
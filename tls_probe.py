@@ -0,0 +1,303 @@
+"""Concurrent TLS probe pool that records certificate metadata and HTTP reachability"""
+
+import os
+import ssl
+import json
+import time
+import socket
+import hashlib
+import logging
+import http.client
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from cryptography import x509
+
+from models import TlsProbe
+from metrics import QUEUE_DEPTH, timed
+import autotune
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# X509_V_ERR_CERT_HAS_EXPIRED
+VERIFY_CODE_EXPIRED = 10
+
+# DNS answers that say the name has no address; timeout and error say nothing
+DNS_NO_ADDRESS = ('nxdomain', 'nodata')
+
+CHUNK_SIZE = 1000
+
+# http_scheme is 'https' when the response came over the probed TLS
+# connection, 'http' for the plain HTTP fallback
+HTTP_FIELDS = ['http_status', 'http_location', 'http_scheme',
+               'connect_seconds', 'handshake_seconds', 'response_seconds']
+
+ProbeResult = namedtuple('ProbeResult', [
+    'ssl_status', 'fingerprint', 'not_before', 'not_after', 'issuer', 'subject', 'san', 'error'
+] + HTTP_FIELDS, defaults=(None,) * len(HTTP_FIELDS))
+
+
+def parse_certificate(der):
+    """Extract metadata from a DER certificate (works for unverified certificates too)"""
+    cert = x509.load_der_x509_certificate(der)
+
+    try:
+        san = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName)\
+            .value.get_values_for_type(x509.DNSName)
+    except x509.ExtensionNotFound:
+        san = []
+
+    return {
+        'fingerprint': hashlib.sha256(der).hexdigest(),
+        'not_before': cert.not_valid_before,  # naive UTC
+        'not_after': cert.not_valid_after,
+        'issuer': cert.issuer.rfc4514_string()[:512],
+        'subject': cert.subject.rfc4514_string()[:512],
+        'san': san
+    }
+
+
+def _outcome(result):
+    """For the tuner: refusals and certificate errors are answers, only timeouts signal trouble"""
+    error = (result.error or '').lower()
+    return 'timeout' if 'timed out' in error or 'timeout' in error else 'ok'
+
+
+class TlsProber:
+    def __init__(self, concurrency=None, timeout=None, port=None, cafile=None):
+        self.concurrency = int(concurrency or os.getenv('TLS_CONCURRENCY', 50))
+        self.timeout = float(timeout or os.getenv('TLS_TIMEOUT', 10))
+        self.port = int(port or os.getenv('TLS_PORT', 443))
+        self.cafile = cafile or os.getenv('TLS_CA_FILE') or None
+        # Plain HTTP port tried when the TLS port refuses connections (0 disables)
+        self.http_port = int(os.getenv('TLS_HTTP_FALLBACK_PORT', 80))
+        self.user_agent = os.getenv('TLS_PROBE_USER_AGENT', 'gdbchecker/1.0')
+        # A certificate verified within this window and far from expiry is not re-probed
+        self.reverify_after = timedelta(hours=float(os.getenv('TLS_REVERIFY_HOURS', 24)))
+        self.expiry_margin = timedelta(days=float(os.getenv('TLS_EXPIRY_MARGIN_DAYS', 14)))
+
+        self.context = ssl.create_default_context(cafile=self.cafile)
+        self.unverified_context = ssl.create_default_context()
+        self.unverified_context.check_hostname = False
+        self.unverified_context.verify_mode = ssl.CERT_NONE
+        # Concurrency and timeouts per destination network, TLS_TIMEOUT at most
+        self.tuner = autotune.get_tuner('tls', self.concurrency, self.timeout)
+
+    def _connect(self, domain, addresses, port=None, timeout=None):
+        """Open a TCP connection, going straight to resolved addresses when known"""
+        port = port or self.port
+        timeout = timeout or self.timeout
+        if not addresses:
+            return socket.create_connection((domain, port), timeout=timeout)
+
+        last_error = None
+        for address in addresses:
+            try:
+                return socket.create_connection((address, port), timeout=timeout)
+            except OSError as e:
+                last_error = e
+        raise last_error
+
+    def _http_request(self, sock, domain, scheme):
+        """
+        HEAD / over an already open connection
+        Returns: dict of http_* fields (empty status when the server didn't answer)
+        """
+        started = time.perf_counter()
+        try:
+            host = domain if domain.isascii() else domain.encode('idna').decode('ascii')
+            request = (f"HEAD / HTTP/1.1\r\nHost: {host}\r\nUser-Agent: {self.user_agent}\r\n"
+                       f"Accept: */*\r\nConnection: close\r\n\r\n")
+            sock.sendall(request.encode('ascii'))
+            response = http.client.HTTPResponse(sock, method='HEAD')
+            try:
+                response.begin()
+                location = response.getheader('Location')
+                return {
+                    'http_status': response.status,
+                    'http_location': location[:2048] if location else None,
+                    'http_scheme': scheme,
+                    'response_seconds': time.perf_counter() - started
+                }
+            finally:
+                response.close()
+        except (OSError, http.client.HTTPException, UnicodeError) as e:
+            logger.debug(f"HTTP request over {scheme} failed for {domain}: {str(e)}")
+            return {'http_scheme': scheme}
+
+    def _result(self, ssl_status, der=None, error=None, **http):
+        metadata = parse_certificate(der) if der else {}
+        return ProbeResult(
+            ssl_status=ssl_status,
+            fingerprint=metadata.get('fingerprint'),
+            not_before=metadata.get('not_before'),
+            not_after=metadata.get('not_after'),
+            issuer=metadata.get('issuer'),
+            subject=metadata.get('subject'),
+            san=metadata.get('san', []),
+            error=error,
+            **http
+        )
+
+    def probe(self, domain, addresses=None, timings=None):
+        """
+        Handshake with the domain, capture its certificate and send one HTTP
+        request over the same connection
+        Returns: ProbeResult with ssl_status 'valid', 'expired', 'invalid' or 'missing'
+        """
+        destination = autotune.destination_network(addresses[0]) if addresses else 'unresolved'
+        with self.tuner.slot(destination) as slot:
+            with timed('tls', timings, domain):
+                result = self._probe(domain, addresses, slot.timeout)
+            slot.outcome = _outcome(result)
+            return result
+
+    def _probe(self, domain, addresses, timeout=None):
+        started = time.perf_counter()
+        try:
+            sock = self._connect(domain, addresses, timeout=timeout)
+        except socket.gaierror:
+            # Domain doesn't resolve
+            logger.warning(f"Domain {domain} doesn't resolve")
+            return self._result('missing', error='DNS resolution failed')
+        except ConnectionRefusedError as e:
+            # The host is up but has no HTTPS: plain HTTP tells whether the site is served at all
+            return self._http_fallback(domain, addresses, str(e), timeout)
+        except OSError as e:
+            # Timeouts and unreachable hosts: a second connection would fail the same way
+            return self._result('missing', error=str(e) or 'Connection timeout')
+
+        timing = {'connect_seconds': time.perf_counter() - started}
+        with sock:
+            try:
+                started = time.perf_counter()
+                with self.context.wrap_socket(sock, server_hostname=domain) as ssock:
+                    # The handshake already verified chain, hostname and validity period
+                    timing['handshake_seconds'] = time.perf_counter() - started
+                    der = ssock.getpeercert(binary_form=True)
+                    return self._result('valid', der, **timing, **self._http_request(ssock, domain, 'https'))
+
+            except ssl.SSLCertVerificationError as e:
+                logger.warning(f"SSL error for {domain}: {str(e)}")
+                ssl_status = 'expired' if e.verify_code == VERIFY_CODE_EXPIRED else 'invalid'
+                der, http = self._fetch_unverified(domain, addresses, timeout)
+                return self._result(ssl_status, der, e.verify_message, **timing, **http)
+
+            except ssl.SSLError as e:
+                logger.warning(f"SSL error for {domain}: {str(e)}")
+                return self._result('invalid', error=str(e), **timing)
+
+            except OSError as e:
+                # Handshake timed out or the connection was reset
+                return self._result('missing', error=str(e) or 'Handshake timeout', **timing)
+
+            except Exception as e:
+                logger.error(f"Unexpected error checking SSL for {domain}: {str(e)}")
+                return self._result('missing', error=str(e), **timing)
+
+    def _fetch_unverified(self, domain, addresses, timeout=None):
+        """
+        Reconnect without verification to capture a rejected certificate (a failed
+        handshake closes the connection) and send the HTTP request over it
+        Returns: (der or None, http fields)
+        """
+        try:
+            with self._connect(domain, addresses, timeout=timeout) as sock:
+                with self.unverified_context.wrap_socket(sock, server_hostname=domain) as ssock:
+                    return ssock.getpeercert(binary_form=True), self._http_request(ssock, domain, 'https')
+        except Exception:
+            return None, {}
+
+    def _http_fallback(self, domain, addresses, error, timeout=None):
+        """HTTPS refused: record whether plain HTTP answers instead"""
+        if not self.http_port:
+            return self._result('missing', error=error)
+        started = time.perf_counter()
+        try:
+            with self._connect(domain, addresses, self.http_port, timeout) as sock:
+                connect_seconds = time.perf_counter() - started
+                http = self._http_request(sock, domain, 'http')
+        except OSError:
+            return self._result('missing', error=error)
+        return self._result('missing', error=error, connect_seconds=connect_seconds, **http)
+
+    def _is_fresh(self, row, now):
+        """Recently verified certificate that is far from expiry"""
+        return (row is not None
+                and row.ssl_status == 'valid'
+                and row.verified_at is not None
+                and row.verified_at >= now - self.reverify_after
+                and row.not_after is not None
+                and row.not_after >= now + self.expiry_margin)
+
+    def probe_all(self, session, domains, resolutions=None, timings=None):
+        """
+        Probe domains concurrently and store certificate metadata in tls_probes
+        Returns: {domain_id: ssl_status}
+        """
+        resolutions = resolutions or {}
+        now = datetime.utcnow()
+        domain_ids = [d.id for d in domains]
+        stored = {}
+        for start in range(0, len(domain_ids), CHUNK_SIZE):
+            stored.update((row.domain_id, row) for row in session.query(TlsProbe)
+                          .filter(TlsProbe.domain_id.in_(domain_ids[start:start + CHUNK_SIZE])))
+
+        statuses = {}
+        targets = []
+        for domain in domains:
+            resolution = resolutions.get(domain.id)
+            row = stored.get(domain.id)
+            if self._is_fresh(row, now):
+                statuses[domain.id] = 'valid'
+            elif resolution is not None and resolution.status in DNS_NO_ADDRESS:
+                # Unresolvable domains are marked without a TLS attempt
+                statuses[domain.id] = 'missing'
+                self._store(session, stored, domain.id, self._result('missing', error=f"DNS: {resolution.status}"))
+            elif resolution is not None and resolution.status != 'resolved' and row is not None:
+                # A failed DNS lookup keeps the last TLS result rather than flipping it
+                statuses[domain.id] = row.ssl_status
+            elif resolution is not None and resolution.status != 'resolved':
+                # Never probed: let the connection resolve the name itself
+                targets.append((domain.id, domain.domain, None))
+            else:
+                targets.append((domain.id, domain.domain, resolution.addresses if resolution else None))
+
+        logger.info(f"TLS: {len(statuses)} skipped (fresh, unresolvable or DNS failed), {len(targets)} to probe")
+
+        if targets:
+            QUEUE_DEPTH.labels('tls').set(len(targets))
+            with ThreadPoolExecutor(max_workers=self.tuner.maximum) as pool:
+                results = pool.map(lambda t: self.probe(t[1], t[2], timings), targets)
+
+                for (domain_id, _, _), result in zip(targets, results):
+                    QUEUE_DEPTH.labels('tls').dec()
+                    statuses[domain_id] = result.ssl_status
+                    self._store(session, stored, domain_id, result)
+
+        session.commit()
+        return statuses
+
+    def _store(self, session, stored, domain_id, result):
+        row = stored.get(domain_id)
+        if row is None:
+            row = TlsProbe(domain_id=domain_id)
+            session.add(row)
+            stored[domain_id] = row
+
+        probed_at = datetime.utcnow()
+        row.ssl_status = result.ssl_status
+        row.fingerprint = result.fingerprint
+        row.not_before = result.not_before
+        row.not_after = result.not_after
+        row.issuer = result.issuer
+        row.subject = result.subject
+        row.san = json.dumps(result.san)
+        row.error = result.error
+        for field in HTTP_FIELDS:
+            setattr(row, field, getattr(result, field))
+        row.probed_at = probed_at
+        if result.ssl_status == 'valid':
+            row.verified_at = probed_at